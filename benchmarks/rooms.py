@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+
+'''
+Synthetic room geometry module for Ray Tracing Method benchmarks, rooms are written in the input file format.
+'''
+
+import numpy as np
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+SOURCE_POS = (.5, .5, 1.5)   # source position inside all synthetic rooms, in room file coordinates
+MATERIALS = (   # materials records of all synthetic rooms
+    'abs floor <2 3 5 10 20 30> {200 100 50}',
+    'abs ceiling <10 20 30 40 50 60>',
+    'abs wall <5 5 6 7 8 9>',
+)
+
+
+class RoomWriter():
+
+    def __init__(self):
+        '''
+        Class collecting points and faces records of a synthetic room.
+        '''
+        self._points = []
+        self._faces = []
+
+    def add_face(self, corners, material):
+        '''
+        Method adding a face with its own points.
+        :param corners: array of shape (n, 3) with face corners in order
+        :param material: material name
+        '''
+        first = len(self._points) + 1
+        self._points.extend(corners)
+        self._faces.append('[{} / {} / {}]'.format(len(self._faces) + 1, ' '.join(
+            str(point_id) for point_id in range(first, first + len(corners))), material))
+
+    def add_box(self, lower, upper, materials):
+        '''
+        Method adding faces of an axis-aligned box.
+        :param lower: lower corner tuple
+        :param upper: upper corner tuple
+        :param materials: dictionary with 'floor', 'ceiling' and 'wall' materials, faces with None are skipped
+        '''
+        (x0, y0, z0), (x1, y1, z1) = lower, upper
+        faces = (
+            ('floor', ((x0, y0, z0), (x1, y0, z0), (x1, y1, z0), (x0, y1, z0))),
+            ('ceiling', ((x0, y0, z1), (x1, y0, z1), (x1, y1, z1), (x0, y1, z1))),
+            ('wall', ((x0, y0, z0), (x1, y0, z0), (x1, y0, z1), (x0, y0, z1))),
+            ('wall', ((x1, y0, z0), (x1, y1, z0), (x1, y1, z1), (x1, y0, z1))),
+            ('wall', ((x1, y1, z0), (x0, y1, z0), (x0, y1, z1), (x1, y1, z1))),
+            ('wall', ((x0, y1, z0), (x0, y0, z0), (x0, y0, z1), (x0, y1, z1))),
+        )
+        for kind, corners in faces:
+            if materials[kind] is not None:
+                self.add_face(corners, materials[kind])
+
+    def text(self):
+        '''
+        Method formatting all records in the input file format.
+        :return: string with the room file content
+        '''
+        points = ['{} {!r} {!r} {!r}'.format(index, *map(float, point)) for index, point in enumerate(self._points, 1)]
+        return '\n'.join(points + self._faces + list(MATERIALS)) + '\n'
+
+
+def box_room(size=(10, 8, 3), subdivisions=1):
+    '''
+    Function creating a convex box room with each side split into a grid of faces.
+    :param size: room size tuple, the room spans from the origin
+    :param subdivisions: number of faces along each edge of each side, the room has 6 * subdivisions ** 2 faces
+    :return: string with the room file content
+    '''
+    writer = RoomWriter()
+    steps = np.linspace(0, 1, subdivisions + 1)
+    for axis in range(3):
+        first, second = [other for other in range(3) if other != axis]
+        for side, kind in ((0, 'floor' if axis == 2 else 'wall'), (1, 'ceiling' if axis == 2 else 'wall')):
+            for i in range(subdivisions):
+                for j in range(subdivisions):
+                    corners = np.zeros((4, 3))
+                    corners[:, axis] = side * size[axis]
+                    corners[:, first] = np.array([steps[i], steps[i + 1], steps[i + 1], steps[i]]) * size[first]
+                    corners[:, second] = np.array([steps[j], steps[j], steps[j + 1], steps[j + 1]]) * size[second]
+                    writer.add_face(corners, kind)
+    return writer.text()
+
+
+def pillars_room(faces_count=1000, height=3):
+    '''
+    Function creating a non-convex room, a box with a grid of pillars, with at least faces_count faces.
+    Pillars are 0.5 m wide and spaced 2 m apart, SOURCE_POS stays outside of all of them.
+    :param faces_count: minimum number of faces, each pillar adds 5 faces to 6 faces of the box
+    :param height: room height
+    :return: string with the room file content
+    '''
+    pillars_count = max(1, int(np.ceil((faces_count - 6) / 5)))
+    grid_size = int(np.ceil(np.sqrt(pillars_count)))
+    writer = RoomWriter()
+    writer.add_box((0, 0, 0), (2 * grid_size, 2 * grid_size, height),
+                   {'floor': 'floor', 'ceiling': 'ceiling', 'wall': 'wall'})
+    for index in range(pillars_count):
+        x, y = 2 * (index % grid_size) + 1, 2 * (index // grid_size) + 1   # pillar center
+        writer.add_box((x - .25, y - .25, 0), (x + .25, y + .25, height * .8),
+                       {'floor': None, 'ceiling': 'ceiling', 'wall': 'wall'})
+    return writer.text()
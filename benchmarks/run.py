@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+
+'''
+Benchmark runner module for Ray Tracing Method, timings are written to a JSON file for comparisons between commits.
+Run it from the project directory with `python -m benchmarks.run`, it never imports PyQt5 or PyOpenGL.
+'''
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.rooms import SOURCE_POS, box_room, pillars_room
+from geometry.room import FREQUENCIES, GEOMETRY_ARRAYS, Room
+from gui.buffers import particle_colors, particle_positions, room_wireframe
+from input.file_loader import FileLoader
+from simulation.emitter import fibonacci_directions
+from simulation.engine import SimulationEngine
+from simulation.worker import Snapshot
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+
+def measure(function, repeats):
+    '''
+    Function timing consecutive calls of a function.
+    :param function: function without arguments
+    :param repeats: number of calls
+    :return: dictionary with all times and their minimum, median and mean [s]
+    '''
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {'times': times, 'min': min(times), 'median': statistics.median(times), 'mean': statistics.mean(times)}
+
+
+def _commit():
+    '''
+    Function reading the current git commit of the project, to label the results.
+    :return: commit hash or None outside of a git repository
+    '''
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_rooms(rooms, directory):
+    '''
+    Function writing synthetic rooms to room files.
+    :param rooms: list of tuples (room name, room file content)
+    :param directory: directory the room files are written to
+    :return: list of tuples (room name, room file path)
+    '''
+    paths = []
+    for name, text in rooms:
+        paths.append((name, os.path.join(directory, name + '.txt')))
+        with open(paths[-1][1], 'w') as room_file:
+            room_file.write(text)
+    return paths
+
+
+def benchmark_rooms(rooms, repeats):
+    '''
+    Function timing loading of room files, Room construction from parsed arrays and room wireframe preparation.
+    :param rooms: list of tuples (room name, room file path)
+    :param repeats: number of calls of each benchmark
+    :return: list of results dictionaries
+    '''
+    results = []
+    for name, path in rooms:
+        room = FileLoader().load_master_file(path)
+        geometry = {key: room.to_arrays()[key] for key in GEOMETRY_ARRAYS}
+        parameters = {'room': name, 'faces': len(room.face_ids), 'bytes': os.path.getsize(path)}
+        for benchmark, function in (
+                ('load_master_file', lambda: FileLoader().load_master_file(path)),
+                ('room_construction', lambda: Room.from_arrays(geometry)),
+                ('room_wireframe', lambda: room_wireframe(room))):
+            results.append(dict(benchmark=benchmark, **parameters, **measure(function, repeats)))
+    return results
+
+
+def benchmark_particles(rooms, rays_counts, repeats):
+    '''
+    Function timing a single simulation step and the particles draw path at various numbers of rays.
+    The draw path is measured without OpenGL: snapshot copy and vertex arrays preparation for each frame.
+    :param rooms: list of tuples (room name, room file path)
+    :param rays_counts: list of numbers of emitted rays
+    :param repeats: number of calls of each benchmark
+    :return: list of results dictionaries
+    '''
+    results = []
+    source_pos = (SOURCE_POS[0], SOURCE_POS[2], SOURCE_POS[1])   # simulation has Y axis pointing up
+    band = FREQUENCIES.index(1000)
+    for name, path in rooms:
+        room = FileLoader().load_master_file(path)
+        for rays_count in rays_counts:
+            parameters = {'room': name, 'faces': len(room.face_ids), 'rays': rays_count}
+            engine = SimulationEngine(room, source_pos=source_pos, directions=fibonacci_directions(rays_count))
+            results.append(dict(benchmark='step', **parameters, **measure(engine.step, repeats)))
+            snapshot = Snapshot(engine.particles_count, len(FREQUENCIES))
+
+            def draw():
+                snapshot.copy_from(engine)
+                particle_positions(snapshot.positions)
+                particle_colors(snapshot.energies[:, band], engine.source_spl)
+
+            results.append(dict(benchmark='draw_particles', particles=engine.particles_count, **parameters,
+                                **measure(draw, repeats)))
+    return results
+
+
+def compare(results, baseline):
+    '''
+    Function printing median times of the results next to the matching ones of a baseline run.
+    :param results: list of results dictionaries
+    :param baseline: list of results dictionaries of the baseline run
+    '''
+    def key(result):
+        return tuple((name, value) for name, value in sorted(result.items())
+                     if name in ('benchmark', 'room', 'faces', 'rays'))
+
+    previous = {key(result): result for result in baseline}
+    for result in results:
+        label = ', '.join('{}={}'.format(name, value) for name, value in key(result))
+        if key(result) in previous:
+            ratio = result['median'] / previous[key(result)]['median']
+            print('{}: {:.6f} s ({:.2f}x baseline)'.format(label, result['median'], ratio))
+        else:
+            print('{}: {:.6f} s (not in baseline)'.format(label, result['median']))
+
+
+def parse_arguments(arguments=None):
+    '''
+    Parses command-line arguments.
+    :param arguments: list of arguments, sys.argv if None
+    :return: argparse.Namespace with parsed arguments
+    '''
+    parser = argparse.ArgumentParser(description='Ray tracing method benchmarks.')
+    parser.add_argument('output', help='path of the .json file the results are written to')
+    parser.add_argument('--faces', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='numbers of faces of the non-convex rooms (default: 100 1000 10000)')
+    parser.add_argument('--subdivisions', type=int, nargs='+', default=[1, 10],
+                        help='faces along each edge of box rooms sides (default: 1 10)')
+    parser.add_argument('--rays', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='numbers of emitted rays (default: 1000 10000 100000)')
+    parser.add_argument('--repeats', type=int, default=5, help='number of calls of each benchmark (default: 5)')
+    parser.add_argument('--baseline', help='.json file of a previous run to compare the results with')
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    '''
+    Generates synthetic rooms, runs all benchmarks and writes the results to disk.
+    :param arguments: list of arguments, sys.argv if None
+    '''
+    arguments = parse_arguments(arguments)
+    rooms = [('box_{}'.format(6 * subdivisions ** 2), box_room(subdivisions=subdivisions))
+             for subdivisions in arguments.subdivisions]
+    rooms += [('pillars_{}'.format(faces_count), pillars_room(faces_count)) for faces_count in arguments.faces]
+    with tempfile.TemporaryDirectory() as directory:
+        rooms = write_rooms(rooms, directory)
+        results = benchmark_rooms(rooms, arguments.repeats)
+        # tracing is measured in the simplest box and the most complex non-convex room only
+        results += benchmark_particles([rooms[0], rooms[-1]], arguments.rays, arguments.repeats)
+    report = {
+        'commit': _commit(),
+        'created': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'repeats': arguments.repeats,
+        'results': results,
+    }
+    with open(arguments.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    if arguments.baseline is not None:
+        with open(arguments.baseline) as baseline_file:
+            compare(results, json.load(baseline_file)['results'])
+    print('{} benchmarks written to {}'.format(len(results), arguments.output))
+
+if __name__ == '__main__':
+    sys.exit(main())
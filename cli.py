@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+
+'''
+Command-line module for headless Ray Tracing Method simulation runs, it never imports PyQt5 or PyOpenGL.
+'''
+
+import argparse
+import sys
+
+import numpy as np
+
+from geometry.room import FREQUENCIES
+from input.room_cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE, load_room
+from simulation.air import air_attenuation
+from simulation.batch import BatchRunner
+from simulation.emitter import DEFAULT_RAYS_COUNT, EMITTERS, PATTERNS, emit_directions
+from simulation.engine import SPEED_OF_SOUND
+from simulation.image_sources import ImageSources
+from simulation.profiler import Profiler
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+
+def to_simulation_axes(position):
+    '''
+    Swaps Y and Z coordinates, room files have Z axis pointing up while the simulation has Y axis pointing up.
+    :param position: position tuple in room file coordinates
+    :return: position tuple in simulation coordinates
+    '''
+    x, y, z = position
+    return (x, z, y)
+
+
+def add_simulation_arguments(parser):
+    '''
+    Adds command-line arguments of the room, rays and results shared by single runs and sweeps,
+    everything but the output and source parameters.
+    :param parser: argparse.ArgumentParser() instance
+    '''
+    parser.add_argument('room', help='room geometry file in the format of the visualization input file')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='directory with compiled rooms (default: {})'.format(DEFAULT_CACHE_DIR))
+    parser.add_argument('--cache-size', type=float, default=DEFAULT_CACHE_SIZE / 2 ** 20,
+                        help='compiled rooms are removed, least recently used first, beyond this size [MB] '
+                             '(default: {:.0f})'.format(DEFAULT_CACHE_SIZE / 2 ** 20))
+    parser.add_argument('--no-cache', action='store_true', help='always parse the room file, never compile it')
+    parser.add_argument('--bands', type=int, nargs='+', default=list(FREQUENCIES), choices=FREQUENCIES,
+                        metavar='FREQ', help='frequencies written to the output [Hz] (default: all)')
+    parser.add_argument('--rays', type=int, default=DEFAULT_RAYS_COUNT,
+                        help='number of emitted rays (default: {})'.format(DEFAULT_RAYS_COUNT))
+    parser.add_argument('--emitter', choices=EMITTERS, default='fibonacci',
+                        help='rays emission method (default: fibonacci)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='random seed of the stratified emitter and diffuse reflections')
+    parser.add_argument('--pattern', choices=PATTERNS, default='cardioid',
+                        help='directivity pattern of the directional emitter (default: cardioid)')
+    parser.add_argument('--axis', type=float, nargs=3, default=(1, 0, 0), metavar=('X', 'Y', 'Z'),
+                        help='axis of the directional emitter in room file coordinates (default: 1 0 0)')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--shards', type=int, default=64, help='number of ray shards (default: 64)')
+    parser.add_argument('--bin-width', type=float, default=.001, help='histogram bin width [s] (default: 0.001)')
+    parser.add_argument('--duration', type=float, default=2., help='histogram length [s] (default: 2)')
+    parser.add_argument('--max-reflections', type=int, default=None, help='reflections limit of each ray')
+    parser.add_argument('--receiver', type=float, nargs=3, action='append', default=[], metavar=('X', 'Y', 'Z'),
+                        help='receiver position in room file coordinates, may be repeated')
+    parser.add_argument('--receiver-radius', type=float, default=.5, help='receivers radius [m] (default: 0.5)')
+    parser.add_argument('--image-order', type=int, default=None,
+                        help='hybrid mode, reflections up to this order reach receivers from image sources and only '
+                             'later ones from rays')
+    parser.add_argument('--temperature', type=float, default=20., help='air temperature [C] (default: 20)')
+    parser.add_argument('--humidity', type=float, default=50., help='relative air humidity [%%] (default: 50)')
+    parser.add_argument('--no-air-absorption', action='store_true', help='ignore sound absorption of the air')
+    parser.add_argument('--grid', type=float, nargs=6, default=None, metavar=('X0', 'Y0', 'Z0', 'X1', 'Y1', 'Z1'),
+                        help='corners of a receiver grid box in room file coordinates, equal coordinates make a plane, '
+                             'e.g. a listener plane 1.2 m above the floor')
+    parser.add_argument('--grid-cell', type=float, default=.5, help='receiver grid cell size [m] (default: 0.5)')
+
+
+def parse_arguments(arguments=None):
+    '''
+    Parses command-line arguments.
+    :param arguments: list of arguments, sys.argv if None
+    :return: argparse.Namespace with parsed arguments
+    '''
+    parser = argparse.ArgumentParser(description='Headless ray tracing method simulation.')
+    add_simulation_arguments(parser)
+    parser.add_argument('output', help='path of the .npz file the results are written to')
+    parser.add_argument('--source', type=float, nargs=3, default=(0, 0, 0), metavar=('X', 'Y', 'Z'),
+                        help='source position in room file coordinates (default: 0 0 0)')
+    parser.add_argument('--spl', type=float, default=80, help='source sound pressure level [dB] (default: 80)')
+    parser.add_argument('--record', metavar='DIRECTORY',
+                        help='directory emission and reflections of rays are recorded to, for a replay')
+    parser.add_argument('--record-stride', type=int, default=1,
+                        help='record only every N-th ray, recordings of many rays take gigabytes (default: 1)')
+    parser.add_argument('--checkpoint', help='checkpoint file with results of the finished shards and states of shards '
+                                             'in progress saved during the run, an interrupted run resumes from it')
+    parser.add_argument('--checkpoint-interval', type=float, default=60.,
+                        help='minimum time between checkpoints [s] (default: 60)')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='JSON lines file engine stages timings and counters are appended to every second, '
+                             'merged as shards finish')
+    parsed = parser.parse_args(arguments)
+    if parsed.checkpoint is not None and parsed.emitter == 'stratified' and parsed.seed is None:
+        parser.error('--checkpoint requires --seed with the stratified emitter, so that resumed rays are the same')
+    return parsed
+
+
+def prepare_simulation(arguments):
+    '''
+    Loads room geometry and emits rays described by the parsed arguments of add_simulation_arguments().
+    :param arguments: argparse.Namespace with parsed arguments
+    :return: tuple (room, directions, parameters), parameters are keyword arguments of BatchRunner.run()
+             other than the source and run outputs
+    '''
+    room = load_room(arguments.room, cache_dir=None if arguments.no_cache else arguments.cache_dir,
+                     cache_size=int(arguments.cache_size * 2 ** 20))
+    options = {'stratified': {'seed': arguments.seed},
+               'directional': {'axis': to_simulation_axes(arguments.axis), 'pattern': arguments.pattern}}
+    grid = None
+    if arguments.grid is not None:
+        grid = (to_simulation_axes(arguments.grid[:3]), to_simulation_axes(arguments.grid[3:]), arguments.grid_cell)
+    directions = emit_directions(arguments.rays, arguments.emitter, **options.get(arguments.emitter, {}))
+    parameters = {
+        'bin_width': arguments.bin_width,
+        'duration': arguments.duration,
+        'max_reflections': arguments.max_reflections,
+        'receivers': [to_simulation_axes(receiver) for receiver in arguments.receiver],
+        'receiver_radius': arguments.receiver_radius,
+        'min_order': 0 if arguments.image_order is None else arguments.image_order + 1,
+        'grid': grid,
+        'air_attenuation': None if arguments.no_air_absorption else air_attenuation(arguments.temperature,
+                                                                                     arguments.humidity),
+        'seed': arguments.seed,
+    }
+    return room, directions, parameters
+
+
+def result_arrays(arguments, room, result, source, source_spl, air):
+    '''
+    Completes results of a run with image sources and converts them into output arrays of the selected bands.
+    :param arguments: argparse.Namespace with parsed arguments of add_simulation_arguments()
+    :param room: Room() instance
+    :param result: BatchResult() instance, image sources are added to its echograms
+    :param source: source position tuple in room file coordinates
+    :param source_spl: source sound pressure level
+    :param air: array with air attenuation [dB/m] of each frequency, None without air absorption
+    :return: dictionary of arrays
+    '''
+    if arguments.image_order is not None and arguments.receiver:
+        images = ImageSources(room, to_simulation_axes(source), arguments.image_order,
+                              max_distance=SPEED_OF_SOUND * arguments.duration, air_attenuation=air)
+        for echogram in result.echograms:   # early reflections weighted like energies of rays_count traced rays
+            images.add_to(echogram, weight=result.rays_count)
+    bands = [FREQUENCIES.index(freq) for freq in arguments.bands]
+    echograms = result.echograms
+    bins_shape = (len(echograms), len(result.histogram), len(bands))   # echograms have the histogram bins
+    grid_arrays = {}
+    if result.grid is not None:   # cells axes swapped back to room file coordinates
+        grid_arrays = {'grid_lower': np.array(to_simulation_axes(result.grid.lower)),
+                       'grid_upper': np.array(to_simulation_axes(result.grid.upper)),
+                       'grid_levels': np.transpose(result.grid.levels(result.rays_count), (0, 2, 1, 3))[..., bands]}
+    return dict(frequencies=np.array(arguments.bands),
+                histogram=result.histogram[:, bands],
+                bin_width=result.bin_width,
+                rays_count=result.rays_count,
+                face_ids=room.face_ids,
+                face_hits=result.face_hits,
+                receivers=np.array(arguments.receiver).reshape(-1, 3),
+                echograms=np.array([echogram.histogram[:, bands] for echogram in echograms]).reshape(bins_shape),
+                decay_curves=np.array([echogram.decay_curves()[:, bands] for echogram in echograms]).reshape(
+                    bins_shape),
+                t20=np.array([echogram.t20()[bands] for echogram in echograms]).reshape(-1, len(bands)),
+                t30=np.array([echogram.t30()[bands] for echogram in echograms]).reshape(-1, len(bands)),
+                rt60=np.array([echogram.rt60()[bands] for echogram in echograms]).reshape(-1, len(bands)),
+                source_pos=np.array(source),
+                source_spl=source_spl,
+                air_attenuation=(np.zeros(len(FREQUENCIES)) if air is None else air)[bands],
+                image_order=-1 if arguments.image_order is None else arguments.image_order,
+                **grid_arrays)
+
+
+def print_rt60(arguments, result):
+    '''
+    Prints reverberation times at the receivers in the selected bands.
+    :param arguments: argparse.Namespace with parsed arguments of add_simulation_arguments()
+    :param result: BatchResult() instance
+    '''
+    for position, echogram in zip(arguments.receiver, result.echograms):
+        print('RT60 at receiver {}: {}'.format(tuple(position), ', '.join(
+            '{} Hz: {:.2f} s'.format(freq, echogram.rt60()[FREQUENCIES.index(freq)]) for freq in arguments.bands)))
+
+
+def main(arguments=None):
+    '''
+    Loads room geometry, traces rays in a process pool and writes the results to disk.
+    :param arguments: list of arguments, sys.argv if None
+    '''
+    arguments = parse_arguments(arguments)
+    room, directions, parameters = prepare_simulation(arguments)
+    if arguments.checkpoint is not None and arguments.seed is None and room.face_scattering.any():
+        sys.exit('error: --checkpoint requires --seed with scattering materials, so that resumed rays are the same')
+    runner = BatchRunner(room, processes=arguments.processes, shards_count=arguments.shards)
+    profiler = None
+    if arguments.profile is not None:
+        profiler = Profiler(enabled=True)
+        profiler.start_dump(arguments.profile)
+    try:
+        result = runner.run(directions, source_pos=to_simulation_axes(arguments.source), source_spl=arguments.spl,
+                            record_path=arguments.record, record_stride=arguments.record_stride,
+                            checkpoint_path=arguments.checkpoint, checkpoint_interval=arguments.checkpoint_interval,
+                            profiler=profiler, **parameters)
+    finally:
+        if profiler is not None:
+            profiler.stop_dump()   # the last line has all shards
+    np.savez(arguments.output, **result_arrays(arguments, room, result, arguments.source, arguments.spl,
+                                               parameters['air_attenuation']))
+    print('Traced {} rays, results written to {}'.format(result.rays_count, arguments.output))
+    print_rt60(arguments, result)
+
+if __name__ == '__main__':
+    sys.exit(main())
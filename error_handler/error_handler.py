@@ -1,4 +1,4 @@
-#!/usr/bin/python3.4
+#!/usr/bin/python3
 
 '''
 Error handler module for Ray Tracing Method 4-dimensional visualization.
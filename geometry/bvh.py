@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+
+'''
+Bounding volume hierarchy module for Ray Tracing Method 4-dimensional visualization.
+'''
+
+import numpy as np
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+
+class BoundingVolumeHierarchy():
+
+    def __init__(self, triangles, leaf_size=4, progress=None):
+        '''
+        Class defining binary tree of axis-aligned bounding boxes over room triangles for fast ray intersection.
+        Tree nodes are stored in flat arrays, leaves reference contiguous ranges of the reordered triangles.
+        :param triangles: array of shape (n, 3, 3) with vertices of each triangle
+        :param leaf_size: maximum number of triangles in a single leaf
+        :param progress: function called after each tree level with numbers of levels built and of all levels,
+                         it may raise an exception to stop building, nothing is reported if None
+        '''
+        triangles = np.asarray(triangles, dtype=np.float64)
+        self.leaf_size = leaf_size
+        self.order = self._build(triangles, progress)   # triangles indices in the order the leaves reference them
+        triangles = triangles[self.order]
+        self._v0 = triangles[:, 0]   # first vertex of each triangle
+        self._e1 = triangles[:, 1] - triangles[:, 0]   # first edge of each triangle
+        self._e2 = triangles[:, 2] - triangles[:, 0]   # second edge of each triangle
+
+    def to_arrays(self):
+        '''
+        Method exporting the tree, e.g. to store it on disk.
+        :return: dictionary of all tree arrays
+        '''
+        return {
+            'leaf_size': np.array(self.leaf_size),
+            'order': self.order,
+            'bounds_min': self.bounds_min,
+            'bounds_max': self.bounds_max,
+            'left': self.left,
+            'right': self.right,
+            'start': self.start,
+            'count': self.count,
+            'v0': self._v0,
+            'e1': self._e1,
+            'e2': self._e2,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''
+        Creates the tree from arrays exported by to_arrays() without building it again.
+        :param arrays: dictionary of all tree arrays, they can be memory-mapped
+        :return: BoundingVolumeHierarchy() instance
+        '''
+        bvh = cls.__new__(cls)
+        bvh.leaf_size = int(arrays['leaf_size'])
+        bvh.order = arrays['order']
+        bvh.bounds_min = arrays['bounds_min']
+        bvh.bounds_max = arrays['bounds_max']
+        bvh.left = arrays['left']
+        bvh.right = arrays['right']
+        bvh.start = arrays['start']
+        bvh.count = arrays['count']
+        bvh._v0 = arrays['v0']
+        bvh._e1 = arrays['e1']
+        bvh._e2 = arrays['e2']
+        return bvh
+
+    def _build(self, triangles, progress=None):
+        '''
+        Method building the tree by splitting triangles in the median of the longest centroids axis.
+        All nodes of a single tree level are built at once, triangles of each node occupy a contiguous range
+        of the order, so bounds of all nodes are reduced over their ranges and all splits are a single sort.
+        :param triangles: array of shape (n, 3, 3) with vertices of each triangle
+        :param progress: function receiving the progress after each level, see __init__(), or None
+        :return: array with triangles indices in leaves order
+        '''
+        lower = triangles.min(axis=1) - 1e-9   # lower corner of each triangle bounding box, padded for flat boxes
+        upper = triangles.max(axis=1) + 1e-9   # upper corner of each triangle bounding box, padded for flat boxes
+        centroids = (lower + upper) * .5
+        order = np.arange(len(triangles))
+        levels = []   # tuples (bounds_min, bounds_max, left, right, start, count) of nodes of each level
+        firsts, lasts = np.array([0]), np.array([len(triangles)])   # triangles ranges of nodes of the current level
+        nodes_count = 0   # number of nodes of the previous levels
+        levels_count, largest = 1, len(triangles)   # the largest node of each level has half of the previous one
+        while largest > self.leaf_size:
+            levels_count, largest = levels_count + 1, (largest + 1) // 2
+        if progress is not None:
+            progress(0, levels_count)
+        while len(firsts):
+            counts = lasts - firsts
+            # reducing over ranges [first, last) of each node, a padding row keeps the last index within the array
+            ranges = np.column_stack((firsts, lasts)).ravel()
+            ordered_lower = np.vstack((lower[order], np.zeros((1, 3))))
+            ordered_upper = np.vstack((upper[order], np.zeros((1, 3))))
+            bounds_min = np.minimum.reduceat(ordered_lower, ranges)[::2]
+            bounds_max = np.maximum.reduceat(ordered_upper, ranges)[::2]
+            inner = np.flatnonzero(counts > self.leaf_size)   # nodes too large to become leaves
+            left = np.full(len(firsts), -1)
+            right = np.full(len(firsts), -1)
+            # children of the inner nodes are numbered in the next level in pairs, left one first
+            left[inner] = nodes_count + len(firsts) + 2 * np.arange(len(inner))
+            right[inner] = left[inner] + 1
+            levels.append((bounds_min, bounds_max, left, right, firsts, counts))
+            nodes_count += len(firsts)
+            if progress is not None:
+                progress(len(levels), levels_count)
+            firsts, lasts, counts = firsts[inner], lasts[inner], counts[inner]
+            if not len(inner):
+                break
+            # splitting along the longest centroids axis of each node
+            ordered_centroids = np.vstack((centroids[order], np.zeros((1, 3))))
+            ranges = np.column_stack((firsts, lasts)).ravel()
+            centroids_min = np.minimum.reduceat(ordered_centroids, ranges)[::2]
+            spread = np.maximum.reduceat(ordered_centroids, ranges)[::2] - centroids_min
+            axes = np.argmax(spread, axis=1)
+            nodes = np.arange(len(firsts))
+            scale = .5 / np.where(spread[nodes, axes] > 0, spread[nodes, axes], 1)
+            # sorting triangles of each node by its axis at once, by the node number plus the centroid scaled below 1,
+            # nodes ranges are ordered, so triangles stay within their nodes
+            segments = np.repeat(nodes, counts)
+            positions = np.repeat(firsts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+            indices = order[positions]
+            segment_axes = axes[segments]
+            keys = segments + (centroids[indices, segment_axes] - centroids_min[segments, segment_axes]) * scale[segments]
+            order[positions] = indices[np.argsort(keys)]
+            middles = firsts + counts // 2
+            firsts, lasts = np.column_stack((firsts, middles)).ravel(), np.column_stack((middles, lasts)).ravel()
+        self.bounds_min, self.bounds_max, self.left, self.right, self.start, self.count = (
+            np.concatenate(arrays) for arrays in zip(*levels))
+        return order
+
+    def intersect(self, origins, directions, epsilon=1e-6):
+        '''
+        Method finding the nearest triangle hit by each ray, traversing the tree with all rays at once.
+        :param origins: array of shape (n, 3) with rays origins
+        :param directions: array of shape (n, 3) with rays unit directions
+        :param epsilon: minimum hit distance, prevents rays from hitting the surface they start on
+        :return: tuple of arrays (triangles, distances), triangle -1 and distance inf if a ray hits nothing
+        '''
+        origins = np.asarray(origins, dtype=np.float64)
+        directions = np.asarray(directions, dtype=np.float64)
+        distances = np.full(len(origins), np.inf)
+        triangles = np.full(len(origins), -1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverse = 1 / directions
+            rays = np.arange(len(origins))   # rays of (ray, node) pairs still to visit
+            nodes = np.zeros(len(origins), dtype=int)   # nodes of (ray, node) pairs still to visit
+            while len(rays):
+                # slab test, NaN appears only for rays parallel to and lying on a slab plane, which is ignored
+                t0 = (self.bounds_min[nodes] - origins[rays]) * inverse[rays]
+                t1 = (self.bounds_max[nodes] - origins[rays]) * inverse[rays]
+                near = np.fmax.reduce(np.fmin(t0, t1), axis=1)
+                far = np.fmin.reduce(np.fmax(t0, t1), axis=1)
+                visit = (near <= far) & (far >= epsilon) & (near < distances[rays])
+                rays, nodes = rays[visit], nodes[visit]
+                leaves = self.left[nodes] < 0
+                if leaves.any():
+                    self._intersect_leaves(origins, directions, rays[leaves], nodes[leaves], epsilon,
+                                           distances, triangles)
+                inner = ~leaves
+                rays = np.concatenate((rays[inner], rays[inner]))
+                nodes = np.concatenate((self.left[nodes[inner]], self.right[nodes[inner]]))
+        triangles[triangles >= 0] = self.order[triangles[triangles >= 0]]   # translating to input triangles indices
+        return triangles, distances
+
+    def _intersect_leaves(self, origins, directions, rays, nodes, epsilon, distances, triangles):
+        '''
+        Method intersecting rays with all triangles of the leaves they reached (Moller-Trumbore algorithm).
+        Updates distances and triangles of the rays with nearer hits in place.
+        '''
+        counts = self.count[nodes]
+        offsets = np.cumsum(counts) - counts
+        rays = np.repeat(rays, counts)   # one entry per (ray, triangle) pair
+        candidates = np.repeat(self.start[nodes] - offsets, counts) + np.arange(counts.sum())
+        directions = directions[rays]
+        e1, e2 = self._e1[candidates], self._e2[candidates]
+        p = np.cross(directions, e2)
+        determinant = np.einsum('ij,ij->i', e1, p)
+        inverse = 1 / determinant
+        s = origins[rays] - self._v0[candidates]
+        u = np.einsum('ij,ij->i', s, p) * inverse
+        q = np.cross(s, e1)
+        v = np.einsum('ij,ij->i', directions, q) * inverse
+        t = np.einsum('ij,ij->i', e2, q) * inverse
+        hits = (np.abs(determinant) > 1e-12) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= epsilon)
+        hits &= t < distances[rays]
+        rays, candidates, t = rays[hits], candidates[hits], t[hits]
+        np.minimum.at(distances, rays, t)   # nearest hit distance of each ray
+        nearest = t == distances[rays]
+        triangles[rays[nearest]] = candidates[nearest]
@@ -1,13 +1,23 @@
-#!/usr/bin/python3.4
+#!/usr/bin/python3
 
 '''
 Room geometry class module for Ray Tracing Method 4-dimensional visualization.
 '''
 
+import numpy as np
+
+from geometry.bvh import BoundingVolumeHierarchy
+
 __author__ = 'Norbert Mieczkowski'
 __copyright__ = 'Copyright 2015, Norbert Mieczkowski'
 __version__ = '1.0.0'
 
+FREQUENCIES = (125, 250, 500, 1000, 2000, 4000)   # frequencies of sound absorption coefficients [Hz]
+BOUNDARIES = ('min_x', 'max_x', 'min_y', 'max_y', 'min_z', 'max_z')   # keys of room boundaries dictionary
+GEOMETRY_ARRAYS = ('point_ids', 'points', 'face_ids', 'face_offsets', 'face_points', 'face_materials',
+                   'material_names', 'material_values')   # keys of flat arrays defining room geometry
+MATERIAL_VALUES = 15   # 6 sound absorption coefficients, RGB color and 6 scattering coefficients of each material
+
 
 class Room():
 
@@ -16,13 +26,113 @@ class Room():
         Class defining room geometry, contains all information needed for rendering such as points, faces and materials.
         :param points: dictionary of all room points {id: (x, y, z)}
         :param faces: dictionary of all room faces {id: (point01, point02, ..., material_name)}
-        :param abs: dictionary of all room materials {name: (freq01, freq02, ..., R, G, B)}
+        :param abs: dictionary of all room materials {name: (freq01, freq02, ..., R, G, B, scattering01, ...)},
+                    scattering coefficients are optional and 0 if omitted
         '''
-        self.points = points
-        self.faces = faces
-        self.abs = abs
+        self._points = points
+        self._faces = faces
+        self._abs = abs
         self.average_alpha = self._compute_average_alpha()
-        self.boundaries = self._compute_boundaries()
+        self._compute_derived_structures(self._compute_geometry_arrays())
+        self.compiled_path = None   # path of compiled room the arrays are memory-mapped from, see input.room_cache
+
+    def to_arrays(self):
+        '''
+        Method exporting the geometry together with all derived structures as flat arrays, e.g. to store it on disk.
+        :return: dictionary of arrays, GEOMETRY_ARRAYS keys and derived ones, the tree arrays have 'bvh_' prefix
+        '''
+        arrays = dict(self._geometry)
+        arrays.update({
+            'boundaries': np.array([self.boundaries[key] for key in BOUNDARIES]),
+            'face_normals': self.face_normals,
+            'reflection_levels': self.reflection_levels,
+            'face_scattering': self.face_scattering,
+            'triangles_faces': self._triangles_faces,
+        })
+        for key, array in self.bvh.to_arrays().items():
+            arrays['bvh_' + key] = array
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, progress=None):
+        '''
+        Creates room from arrays exported by to_arrays() without computing derived structures again,
+        or from GEOMETRY_ARRAYS only, e.g. produced by FileLoader, computing the derived structures.
+        :param arrays: dictionary of arrays, they can be memory-mapped
+        :param progress: function receiving progress of building the tree of triangles, called with numbers
+                         of its levels built and of all its levels, see BoundingVolumeHierarchy
+        :return: Room() instance
+        '''
+        room = cls.__new__(cls)
+        room._points = room._faces = room._abs = None   # dictionaries are built from the arrays only when used
+        if 'bvh_order' not in arrays:   # only geometry arrays are given
+            room._compute_derived_structures(arrays, progress)
+        else:
+            room._geometry = {key: arrays[key] for key in GEOMETRY_ARRAYS}
+            room.face_ids = arrays['face_ids']
+            room.boundaries = dict(zip(BOUNDARIES, arrays['boundaries'].tolist()))
+            room.face_normals = arrays['face_normals']
+            room.reflection_levels = arrays['reflection_levels']
+            room.face_scattering = arrays['face_scattering']
+            room._triangles_faces = arrays['triangles_faces']
+            room.bvh = BoundingVolumeHierarchy.from_arrays({key[4:]: array for key, array in arrays.items()
+                                                            if key.startswith('bvh_')})
+        room.average_alpha = room._compute_average_alpha()
+        room.compiled_path = None
+        return room
+
+    @property
+    def points(self):
+        '''
+        Dictionary of all room points {id: (x, y, z)}, built from the geometry arrays on first use.
+        '''
+        if self._points is None:
+            self._points = dict(zip(self._geometry['point_ids'].tolist(),
+                                    map(tuple, self._geometry['points'].tolist())))
+        return self._points
+
+    @property
+    def faces(self):
+        '''
+        Dictionary of all room faces {id: (point01, point02, ..., material_name)}, built from the geometry arrays
+        on first use.
+        '''
+        if self._faces is None:
+            material_names = self._geometry['material_names'].tolist()
+            offsets = self._geometry['face_offsets'].tolist()
+            face_points = self._geometry['face_points'].tolist()
+            self._faces = {face_id: tuple(face_points[offsets[index]:offsets[index + 1]]) + (material_names[material],)
+                           for index, (face_id, material) in enumerate(zip(self._geometry['face_ids'].tolist(),
+                                                                          self._geometry['face_materials'].tolist()))}
+        return self._faces
+
+    @property
+    def abs(self):
+        '''
+        Dictionary of all room materials {name: (freq01, freq02, ..., R, G, B, scattering01, ...)}, built from
+        the geometry arrays on first use.
+        '''
+        if self._abs is None:
+            self._abs = dict(zip(self._geometry['material_names'].tolist(),
+                                 map(tuple, self._geometry['material_values'].tolist())))
+        return self._abs
+
+    def intersect(self, origins, directions):
+        '''
+        Method finding the nearest face hit by each of the rays.
+        :param origins: array of shape (n, 3) with rays origins
+        :param directions: array of shape (n, 3) with rays unit directions
+        :return: tuple of arrays (faces, distances, normals) with indices of hit faces in face_ids (-1 if a ray hits
+                 nothing), distances to the hits (inf if a ray hits nothing) and face normals facing the rays
+        '''
+        triangles, distances = self.bvh.intersect(origins, directions)
+        faces = np.where(triangles >= 0, self._triangles_faces[triangles], -1)
+        normals = self.face_normals[faces]
+        normals[faces < 0] = 0
+        # flipping normals of faces hit from their back side, so each normal points against its ray
+        backside = np.einsum('ij,ij->i', normals, np.asarray(directions)) > 0
+        normals[backside] *= -1
+        return faces, distances, normals
 
     def _compute_average_alpha(self):
         '''
@@ -44,19 +154,119 @@ class Room():
             4000: average_alpha[5],
         }
 
+    def _compute_geometry_arrays(self):
+        '''
+        Method converting points, faces and materials dictionaries into flat arrays.
+        :return: dictionary of arrays with GEOMETRY_ARRAYS keys
+        '''
+        material_names = list(self.abs)
+        material_indices = {name: index for index, name in enumerate(material_names)}
+        faces_points = [self.faces[face_id][:-1] for face_id in self.faces]
+        face_materials = []
+        for face_id in self.faces:   # iterate through all faces
+            material = self.faces[face_id][-1]
+            if material not in material_indices:
+                raise ValueError('Face {} uses undefined material {}'.format(face_id, material))
+            face_materials.append(material_indices[material])
+        return {
+            'point_ids': np.array(list(self.points), dtype=int),
+            'points': np.array(list(self.points.values()), dtype=np.float64).reshape(-1, 3),
+            'face_ids': np.array(list(self.faces), dtype=int),
+            'face_offsets': np.cumsum([0] + [len(points) for points in faces_points]),   # face points ranges
+            'face_points': np.array([point for points in faces_points for point in points], dtype=int),
+            'face_materials': np.array(face_materials, dtype=int),
+            'material_names': np.array(material_names, dtype=str),
+            'material_values': np.array([tuple(self.abs[name]) + (0,) * (MATERIAL_VALUES - len(self.abs[name]))
+                                         for name in material_names], dtype=np.float64).reshape(-1, MATERIAL_VALUES),
+        }
+
+    def _compute_derived_structures(self, geometry, progress=None):
+        '''
+        Method computing all structures used by the simulation from geometry arrays.
+        :param geometry: dictionary of arrays with GEOMETRY_ARRAYS keys
+        :param progress: function receiving progress of building the tree of triangles, or None
+        '''
+        self._geometry = {key: geometry[key] for key in GEOMETRY_ARRAYS}
+        self.face_ids = geometry['face_ids']   # faces ids, position in this array is the face index
+        vertices = self._compute_face_vertices()
+        self.boundaries = self._compute_boundaries()
+        self.face_normals = self._compute_face_normals(vertices)
+        self.reflection_levels = self._compute_reflection_levels()
+        self.face_scattering = self._compute_face_scattering()
+        self._triangles_faces, triangles = self._compute_triangles(vertices)
+        self.bvh = BoundingVolumeHierarchy(triangles, progress=progress)
+
+    def _compute_face_vertices(self):
+        '''
+        Method translating points ids of all faces into rows of the points array.
+        :return: array with points array row of each face point, faces ranges are given by face_offsets
+        '''
+        point_ids = self._geometry['point_ids']
+        face_points = self._geometry['face_points']
+        offsets = self._geometry['face_offsets']
+        counts = np.diff(offsets)
+        if (counts < 3).any():
+            raise ValueError('Face {} has less than 3 points'.format(self.face_ids[np.argmax(counts < 3)]))
+        order = np.argsort(point_ids, kind='stable')
+        vertices = np.searchsorted(point_ids, face_points, sorter=order).clip(max=len(order) - 1)
+        vertices = order[vertices]
+        missing = point_ids[vertices] != face_points
+        if missing.any():
+            face = np.searchsorted(offsets, np.argmax(missing), side='right') - 1
+            raise ValueError('Face {} uses undefined point {}'.format(self.face_ids[face],
+                                                                      face_points[np.argmax(missing)]))
+        return vertices
+
     def _compute_boundaries(self):
         '''
         Method computing room boundaries.
         :return: dictionary of maximum and minimum point in each axis {'min_x': ?.??, 'max_x': ?.??, 'min_y: ?.??, ...}
         '''
-        x = [self.points[point][0] for point in self.points]   # getting all X axis values
-        y = [self.points[point][1] for point in self.points]   # getting all Y axis values
-        z = [self.points[point][2] for point in self.points]   # getting all Z axis value
-        return {
-            'min_x': min(x),
-            'max_x': max(x),
-            'min_y': min(y),
-            'max_y': max(y),
-            'min_z': min(z),
-            'max_z': max(z)
-        }
+        points = self._geometry['points']
+        lower = points.min(axis=0).tolist()
+        upper = points.max(axis=0).tolist()
+        return dict(zip(BOUNDARIES, (lower[0], upper[0], lower[1], upper[1], lower[2], upper[2])))
+
+    def _compute_reflection_levels(self):
+        '''
+        Method computing energy level change on reflection from each face for each of 6 frequencies.
+        :return: array of shape (faces count, 6) with levels in dB (10 * log10(1 - alpha)) in face_ids order
+        '''
+        alphas = self._geometry['material_values'][self._geometry['face_materials'], :len(FREQUENCIES)]
+        with np.errstate(divide='ignore'):   # fully absorbing faces have level of -inf
+            return 10 * np.log10(1 - alphas)
+
+    def _compute_face_scattering(self):
+        '''
+        Method picking scattering coefficients of each face, i.e. parts of reflected energies reflected diffusely.
+        :return: array of shape (faces count, 6) with scattering coefficients in face_ids order
+        '''
+        return self._geometry['material_values'][self._geometry['face_materials'], len(FREQUENCIES) + 3:]
+
+    def _compute_face_normals(self, vertices):
+        '''
+        Method computing unit normal vector of each face using Newell's method.
+        :param vertices: array with points array row of each face point
+        :return: array of shape (faces count, 3) with faces normals in face_ids order
+        '''
+        offsets = self._geometry['face_offsets']
+        coordinates = self._geometry['points'][vertices]
+        following = np.arange(1, len(vertices) + 1)   # index of the next point of the same face
+        following[offsets[1:] - 1] = offsets[:-1]   # the last point of a face is followed by its first point
+        normals = np.add.reduceat(np.cross(coordinates, coordinates[following]), offsets[:-1], axis=0)
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        return normals / np.where(lengths > 0, lengths, 1)
+
+    def _compute_triangles(self, vertices):
+        '''
+        Method splitting each face into a fan of triangles, faces are expected to be convex.
+        :param vertices: array with points array row of each face point
+        :return: tuple of arrays with face index of each triangle and vertices of each triangle of shape (n, 3, 3)
+        '''
+        offsets = self._geometry['face_offsets']
+        counts = np.diff(offsets) - 2   # number of triangles of each face
+        triangles_faces = np.repeat(np.arange(len(counts)), counts)
+        first = np.repeat(offsets[:-1], counts)   # each triangle shares the first face vertex
+        second = first + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+        corners = np.stack((vertices[first], vertices[second], vertices[second + 1]), axis=1)
+        return triangles_faces, self._geometry['points'][corners]
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+
+'''
+Vertex data module for Ray Tracing Method 4-dimensional visualization, prepares arrays uploaded to OpenGL buffers.
+It doesn't import PyQt5 nor PyOpenGL, so vertex data can be prepared and measured without a display.
+'''
+
+import numpy as np
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+
+def particle_positions(positions):
+    '''
+    Function converting particles positions into a contiguous float32 vertex array.
+    :param positions: array of shape (n, 3) with particles positions
+    :return: float32 array of shape (n, 3)
+    '''
+    return np.ascontiguousarray(positions, dtype=np.float32)
+
+
+def particle_colors(energies, source_spl):
+    '''
+    Function computing colors of all particles at once, initially green, then turning red as the energy drops.
+    :param energies: array with particles energies in a single frequency [dB]
+    :param source_spl: source sound pressure level
+    :return: float32 array of shape (n, 3) with rgb colors
+    '''
+    colors = np.zeros((len(energies), 3), dtype=np.float32)
+    # green color share in rgb palette, the band may have already dropped far below the source level
+    np.clip(np.asarray(energies) / source_spl, 0, 1, out=colors[:, 1], casting='unsafe')
+    np.subtract(1, colors[:, 1], out=colors[:, 0])   # red color share in rgb palette
+    return colors
+
+
+def grid_lines(grid_range=10):
+    '''
+    Function computing vertices and colors of grid lines, with red and green lines along X and Z axes.
+    :param grid_range: grid lines range (meaning its grid lines number / 4)
+    :return: tuple of float32 arrays of shape (n, 3) with lines vertices and colors, each two vertices form a line
+    '''
+    steps = np.arange(-grid_range, grid_range + 1, dtype=np.float32)
+    vertices = np.zeros((len(steps) * 4 + 4, 3), dtype=np.float32)
+    vertices[0:-4:4, 0], vertices[0:-4:4, 2] = -grid_range, steps   # horizontal lines
+    vertices[1:-4:4, 0], vertices[1:-4:4, 2] = grid_range, steps
+    vertices[2:-4:4, 0], vertices[2:-4:4, 2] = steps, -grid_range   # vertical lines
+    vertices[3:-4:4, 0], vertices[3:-4:4, 2] = steps, grid_range
+    vertices[-4:, 0] = (-grid_range, grid_range, 0, 0)   # red and green lines
+    vertices[-4:, 2] = (0, 0, -grid_range, grid_range)
+    colors = np.empty_like(vertices)
+    colors[:] = (.29, .29, .29)   # color of a single grid line (gray)
+    colors[-4:-2] = (.52, .07, .07)   # red line color
+    colors[-2:] = (.07, .52, .07)   # green line color
+    return vertices, colors
+
+
+def room_wireframe(room):
+    '''
+    Function computing vertices of room points and indices of all distinct edges of room faces.
+    :param room: Room() instance
+    :return: tuple of float32 array of shape (n, 3) with vertices and uint32 array with edges vertices indices
+    '''
+    arrays = room.to_arrays()
+    point_ids, offsets = arrays['point_ids'], arrays['face_offsets']
+    order = np.argsort(point_ids, kind='stable')
+    vertices = order[np.searchsorted(point_ids, arrays['face_points'], sorter=order)]   # points rows of faces points
+    following = np.arange(1, len(vertices) + 1)   # index of the next point of the same face
+    following[offsets[1:] - 1] = offsets[:-1]   # the last point of a face is followed by its first point
+    edges = np.sort(np.stack((vertices, vertices[following]), axis=1), axis=1)
+    edges = np.unique(edges, axis=0)   # edges shared by neighbouring faces are drawn once
+    return np.ascontiguousarray(arrays['points'], dtype=np.float32), edges.astype(np.uint32).ravel()
+
+
+def heat_map_vertices(grid):
+    '''
+    Function computing vertices of a receiver grid heat map, two triangles per column of cells along Y axis,
+    drawn on the horizontal plane in the middle of the grid.
+    :param grid: ReceiverGrid() instance
+    :return: float32 array of shape (n, 3) with triangles vertices, six vertices of each column in cells order
+    '''
+    columns_x, _, columns_z = grid.shape
+    x = grid.lower[0] + np.arange(columns_x + 1) * grid.cell_sizes[0]
+    z = grid.lower[2] + np.arange(columns_z + 1) * grid.cell_sizes[2]
+    corners = ((0, 0), (1, 0), (1, 1), (0, 0), (1, 1), (0, 1))   # corners offsets of both triangles of a column
+    vertices = np.empty((columns_x, columns_z, len(corners), 3), dtype=np.float32)
+    vertices[..., 1] = (grid.lower[1] + grid.upper[1]) * .5
+    for corner, (offset_x, offset_z) in enumerate(corners):
+        vertices[:, :, corner, 0] = x[offset_x:len(x) - 1 + offset_x, None]
+        vertices[:, :, corner, 2] = z[None, offset_z:len(z) - 1 + offset_z]
+    return vertices.reshape(-1, 3)
+
+
+def heat_map_colors(energies, band, dynamic_range=30.):
+    '''
+    Function computing colors of a receiver grid heat map, from blue at dynamic_range below the loudest column to red.
+    :param energies: array of shape (x, y, z, 6) with ReceiverGrid.energies
+    :param band: column of energies the colors are computed from
+    :param dynamic_range: range of levels [dB] below the loudest column shown in colors, quieter columns are blue
+    :return: float32 array of shape (n, 3) with colors of heat_map_vertices()
+    '''
+    column_energies = energies[..., band].mean(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        levels = 10 * np.log10(column_energies / column_energies.max())
+    shares = np.clip(np.nan_to_num(levels, nan=-dynamic_range) / dynamic_range + 1, 0, 1)   # 1 for the loudest column
+    colors = np.zeros(column_energies.shape + (3,), dtype=np.float32)
+    colors[..., 0] = shares   # red color share in rgb palette
+    colors[..., 1] = 1 - np.abs(2 * shares - 1)   # green color share, brightest in the middle of the range
+    colors[..., 2] = 1 - shares   # blue color share
+    return np.repeat(colors.reshape(-1, 3), 6, axis=0)
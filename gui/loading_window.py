@@ -1,18 +1,65 @@
-#!/usr/bin/python3.4
+#!/usr/bin/python3
 
 '''
 Files loading window module for Ray Tracing Method 4-dimensional visualization.
 '''
 
-from PyQt5.QtWidgets import QFileDialog, QLabel, QLineEdit, QPushButton, QWidget
+import threading
+
+from PyQt5.QtCore import pyqtSignal, QThread
+from PyQt5.QtWidgets import QFileDialog, QLabel, QLineEdit, QProgressBar, QPushButton, QWidget
 from error_handler.error_handler import ErrorHandler
 from gui.visualization_window import VisualizationWindow
-from input.file_loader import FileLoader
+from input.file_loader import LoadingCancelled
+from input.room_cache import load_room
 
 __author__ = 'Norbert Mieczkowski'
 __copyright__ = 'Copyright 2015, Norbert Mieczkowski'
 __version__ = '1.0.0'
 
+STAGE_NAMES = {'hashing': 'Checking compiled rooms', 'parsing': 'Reading file', 'building': 'Building geometry'}
+
+
+class RoomLoader(QThread):
+
+    # signals emitted in the loading thread and received in the main thread
+    # stage, bytes processed and file size (tree levels built and all tree levels when building), records counts
+    # or None, 64-bit integers, as files may be larger than 2 GB
+    progressed = pyqtSignal(str, 'qint64', 'qint64', object)
+    loaded = pyqtSignal(object)   # Room() instance
+    failed = pyqtSignal(str)   # error message
+    cancelled = pyqtSignal()
+
+    def __init__(self, file_path):
+        '''
+        Class loading room geometry in a separate thread, so that the windows stay responsive.
+        :param file_path: path to file with room geometry
+        '''
+        super().__init__()
+        self._file_path = file_path
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        '''
+        Method requesting the loading to stop, cancelled signal is emitted once it does.
+        '''
+        self._cancel.set()
+
+    def run(self):
+        '''
+        An overridden method loading the room, using compiled room cache for files loaded before.
+        '''
+        try:
+            room_geometry = load_room(self._file_path, progress=self.progressed.emit, cancel=self._cancel)
+            if self._cancel.is_set():   # e.g. compiled room loaded in the meantime
+                raise LoadingCancelled('loading was cancelled')
+        except LoadingCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.loaded.emit(room_geometry)
+
 
 class LoadingWindow(QWidget):
 
@@ -31,7 +78,7 @@ class LoadingWindow(QWidget):
 
         # specifying window size
         self._width = 410
-        self._height = 220
+        self._height = 270
 
         # setting window parameters such as size, position and title
         screen_center = self._application.desktop().screen().rect().center()
@@ -64,6 +111,18 @@ class LoadingWindow(QWidget):
         self._load_btn.move((self._width - self._load_btn.width()) * .5, 90)
         self._load_btn.clicked[bool].connect(self._load_files)
 
+        # creating loading progress bar and label with numbers of read records
+        self._progress_bar = QProgressBar(self)
+        self._progress_bar.setFixedWidth(self._load_btn.width())
+        self._progress_bar.move(self._load_btn.x(), 160)
+        self._progress_lbl = QLabel(self)
+        self._progress_lbl.setFixedWidth(self._load_btn.width())
+        self._progress_lbl.move(self._load_btn.x() + 2, 185)
+        self._progress_bar.hide()
+
+        # room loading thread, None if nothing is being loaded
+        self._room_loader = None
+
         # creating close button
         self._close_btn = QPushButton('Close', self)
         self._close_btn.setFixedWidth(70)
@@ -90,12 +149,85 @@ class LoadingWindow(QWidget):
 
     def _load_files(self):
         '''
-        Creates FileLoader instance and loads files specified in text fields.
+        Starts loading files specified in text fields in a separate thread, or cancels the loading in progress.
         '''
-        file_loader = FileLoader()
-        try:
-            room_geometry = file_loader.load_master_file(self._master_file_path_text_field.text())
-            self.close()
-            self.visualization_window = VisualizationWindow(self._application, room_geometry)
-        except Exception as e:
-            self._error_handler.raise_dialog(str(e))
+        if self._room_loader is not None:
+            self._room_loader.cancel()
+            self._load_btn.setEnabled(False)   # enabled again once the thread stops
+            self._progress_lbl.setText('Cancelling...')
+            return
+        self._room_loader = RoomLoader(self._master_file_path_text_field.text())
+        self._room_loader.progressed.connect(self._show_progress)
+        self._room_loader.loaded.connect(self._open_visualization)
+        self._room_loader.failed.connect(self._loading_failed)
+        self._room_loader.cancelled.connect(self._loading_stopped)
+        self._master_file_path_text_field.setEnabled(False)
+        self._master_file_browse_btn.setEnabled(False)
+        self._load_btn.setText('Cancel loading')
+        self._progress_bar.setValue(0)
+        self._progress_bar.show()
+        self._progress_lbl.setText('Opening file...')
+        self._room_loader.start()
+
+    def _show_progress(self, stage, read_bytes, size, counts):
+        '''
+        Shows progress reported by the loading thread.
+        :param stage: name of the loading stage
+        :param read_bytes: number of bytes processed so far, or of tree levels built when building
+        :param size: file size, or number of all tree levels when building
+        :param counts: dictionary with numbers of read points, faces and materials, None if nothing is read yet
+        '''
+        self._progress_bar.setValue(100 * read_bytes // size if size else 100)
+        if stage == 'building':
+            text = '{}: level {} of {}'.format(STAGE_NAMES[stage], read_bytes, size)
+        else:
+            text = '{}: {:.1f} of {:.1f} MB'.format(STAGE_NAMES[stage], read_bytes / 2 ** 20, size / 2 ** 20)
+        if counts is not None:
+            text += ', {points} points, {faces} faces, {materials} materials'.format(**counts)
+        self._progress_lbl.setText(text)
+
+    def _open_visualization(self, room_geometry):
+        '''
+        Closes this window and opens visualization window of the loaded room.
+        :param room_geometry: Room() instance
+        '''
+        if self._room_loader is None:   # window closed in the meantime
+            return
+        self._loading_stopped()
+        self.close()
+        self.visualization_window = VisualizationWindow(self._application, room_geometry)
+
+    def _loading_failed(self, message):
+        '''
+        Shows error of the loading thread.
+        :param message: error message
+        '''
+        if self._room_loader is None:
+            return
+        self._loading_stopped()
+        self._error_handler.raise_dialog(message)
+
+    def _loading_stopped(self):
+        '''
+        Restores the window after the loading thread stops.
+        '''
+        if self._room_loader is None:
+            return
+        self._room_loader.wait()
+        self._room_loader = None
+        self._master_file_path_text_field.setEnabled(True)
+        self._master_file_browse_btn.setEnabled(True)
+        self._load_btn.setEnabled(True)
+        self._load_btn.setText('Load file')
+        self._progress_bar.hide()
+        self._progress_lbl.setText('')
+
+    def closeEvent(self, event):
+        '''
+        An overridden method cancelling the loading before the window is closed.
+        '''
+        if self._room_loader is not None:
+            self._room_loader.cancel()
+            self._room_loader.wait()
+            self._room_loader = None   # signals still queued for this window are ignored
+        super().closeEvent(event)
@@ -1,15 +1,23 @@
-#!/usr/bin/python3.4
+#!/usr/bin/python3
 
 '''
 Main window and basic GUI widgets module for Ray Tracing Method 4-dimensional visualization.
 '''
 
-from math import cos, log10, pi, sin
-
 from PyQt5.QtWidgets import QOpenGLWidget
 from PyQt5.QtCore import QBasicTimer
 from OpenGL.GL import *
 from OpenGL.GLU import *
+from error_handler.error_handler import ErrorHandler
+from geometry.room import FREQUENCIES
+from gui.buffers import (grid_lines, heat_map_colors, heat_map_vertices, particle_colors, particle_positions,
+                         room_wireframe)
+from simulation.air import air_attenuation
+from simulation.emitter import DEFAULT_RAYS_COUNT, fibonacci_directions
+from simulation.engine import SimulationEngine
+from simulation.profiler import Profiler
+from simulation.receiver_grid import ReceiverGrid
+from simulation.worker import SimulationWorker
 
 __author__ = 'Norbert Mieczkowski'
 __copyright__ = 'Copyright 2015, Norbert Mieczkowski'
@@ -26,6 +34,15 @@ class OpenGLWidget(QOpenGLWidget):
         self._room = self.parent().room   # assign room geometry to a variable
         self.setGeometry(self.parent()._width * .25, 0, self.parent()._width, self.parent()._height)   # window size/pos
         self._timer = QBasicTimer()   # create a timer
+        self._band = FREQUENCIES.index(1000)   # column of particles energies used for coloring
+        self._room_uploaded = False   # whether room buffers contain current room geometry
+        self._worker = None   # background thread stepping the simulation
+        self._receiver_grid = None   # energy map of the listener plane accumulated by the simulation
+        self._heat_map_visible = False
+        self._recording = None   # simulation.recording.Recording() replayed instead of the animation
+        self._replay_time = 0.
+        self.profiler = Profiler()   # measurements of drawing and simulation stages, disabled until switched on
+        self._error_handler = ErrorHandler()   # reports exceptions of the simulation thread
 
     def initializeGL(self):
         '''
@@ -49,19 +66,37 @@ class OpenGLWidget(QOpenGLWidget):
             -3, 0, 0,
             0, 1, 0
         )
+        self._particles_buffers = glGenBuffers(2)   # positions and colors vertex buffer objects of particles
+        self._particles_capacity = 0   # number of particles the buffers can store
+        self._grid_buffers = glGenBuffers(2)   # vertices and colors buffer objects of grid lines
+        vertices, colors = grid_lines()
+        self._grid_count = len(vertices)
+        for buffer, data in zip(self._grid_buffers, (vertices, colors)):   # grid never changes, uploading it once
+            glBindBuffer(GL_ARRAY_BUFFER, buffer)
+            glBufferData(GL_ARRAY_BUFFER, data.nbytes, data, GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self._room_buffers = glGenBuffers(2)   # vertices and edges indices buffer objects of room geometry
+        self._heat_map_buffers = glGenBuffers(2)   # vertices and colors buffer objects of the receiver grid heat map
+        self._heat_map_count = 0   # number of uploaded heat map vertices, 0 until the next animation starts
 
     def paintGL(self):
         '''
         A method to paint in OpenGL.
         '''
-        glClearColor(.22, .22, .22, 1)   # set background color to gray
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)   # clear everything before rendering next frame
+        with self.profiler.stage('frame'):
+            glClearColor(.22, .22, .22, 1)   # set background color to gray
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)   # clear everything before rendering next frame
 
-        self._draw_grid()   # drawing grid lines
-        self._draw_room()   # drawing room geometry
+            self._draw_grid()   # drawing grid lines
+            self._draw_room()   # drawing room geometry
 
-        if self._timer.isActive():   # if animation is initialized
-            self._draw_particles()   # draw sound waves represented by particles
+            if self._timer.isActive():   # if animation is initialized
+                if self._heat_map_visible:
+                    self._draw_heat_map()   # draw energy map of the listener plane
+                self._draw_particles()   # draw sound waves represented by particles
+            elif self._recording is not None:   # if a recording is replayed
+                self._draw_recording()   # draw recorded particles at the replay time
+        self.profiler.count('frames')
 
     def timerEvent(self, QTimerEvent):
         '''
@@ -69,135 +104,219 @@ class OpenGLWidget(QOpenGLWidget):
         Warning! This method should only be used by self.initialize_animation()!!
         :param QTimerEvent: should be ignored
         '''
+        if self._worker is not None and self._worker.error is not None:   # simulation thread stopped by an exception
+            error = self._worker.error
+            self.stop_animation()
+            self._error_handler.raise_dialog('Simulation failed: {}'.format(error))
         self.update()   # calling self.update() in order to refresh the widget
 
-    def initialize_animation(self, source_pos=(0,0,0), source_spl=80, source_freq=1000, fps=60):
+    def initialize_animation(self, source_pos=(0,0,0), source_spl=80, source_freq=1000, fps=60,
+                             rays_count=DEFAULT_RAYS_COUNT, listener_height=1.2, grid_cell_size=.5, temperature=20.,
+                             humidity=50.):
         '''
         A method to animate the ray tracing method in 4D.
         :param source_pos: source position tuple
         :param source_spl: source sound pressure level
-        :param source_freq: source sound frequency
+        :param source_freq: source sound frequency the particles are colored by, all frequencies are simulated
+        :param fps: number of frames drawn and simulation steps run per second
+        :param rays_count: number of particles emitted uniformly from the source
+        :param listener_height: height of the heat map plane above the room floor
+        :param grid_cell_size: size of the heat map cells
+        :param temperature: air temperature [degrees Celsius] of the air absorption
+        :param humidity: relative air humidity [%] of the air absorption
         '''
-        self._source_pos = source_pos
-        self._source_spl = source_spl
-        self._source_power = 10 ** (self._source_spl * .1)
-        self._source_freq = source_freq
-        self._calculate_particles_normals_positions_energies()
+        self.stop_animation()
+        self._recording = None
+        self.set_frequency(source_freq)
+        self._engine = SimulationEngine(self._room, source_pos=source_pos, source_spl=source_spl,
+                                        directions=fibonacci_directions(rays_count), profiler=self.profiler,
+                                        air_attenuation=air_attenuation(temperature, humidity))
+        boundaries = self._room.boundaries
+        height = min(boundaries['min_y'] + listener_height, boundaries['max_y'])
+        self._receiver_grid = ReceiverGrid((boundaries['min_x'], height, boundaries['min_z']),
+                                           (boundaries['max_x'], height, boundaries['max_z']), grid_cell_size)
+        if self._heat_map_visible:   # attached before the worker starts stepping, only while the map is shown
+            self._engine.observers.append(self._receiver_grid)
+        vertices = heat_map_vertices(self._receiver_grid)
+        self._heat_map_count = len(vertices)
+        self.makeCurrent()
+        glBindBuffer(GL_ARRAY_BUFFER, self._heat_map_buffers[0])   # cells never move, only colors are updated
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, self._heat_map_buffers[1])
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, None, GL_STREAM_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.doneCurrent()
+        self._worker = SimulationWorker(self._engine, steps_per_second=fps)   # stepping independently of drawing
+        self._worker.start()
         self._timer.start(1000 / fps, self)
 
+    def stop_animation(self):
+        '''
+        A method to stop the animation and the background thread stepping the simulation.
+        '''
+        self._timer.stop()
+        if self._worker is not None:
+            self._worker.stop()
+            self._worker = None
+
+    def open_recording(self, recording):
+        '''
+        A method to stop the animation and replay a recorded run instead, starting at its first event.
+        :param recording: simulation.recording.Recording() instance
+        '''
+        self.stop_animation()
+        self._recording = recording
+        self.set_replay_time(recording.start)
+
+    def set_replay_time(self, time):
+        '''
+        A method to choose the moment of the replayed recording which is drawn.
+        :param time: time since the emission [s]
+        '''
+        self._replay_time = time
+        self.update()
+
+    def set_room(self, room):
+        '''
+        A method to change the drawn room geometry, its buffers are uploaded again before the next frame.
+        :param room: Room() instance
+        '''
+        self._room = room
+        self._room_uploaded = False
+        self.update()
+
+    def set_frequency(self, freq):
+        '''
+        A method to choose the frequency the particles are colored by.
+        :param freq: one of geometry.room.FREQUENCIES
+        '''
+        self._band = FREQUENCIES.index(freq)
+
+    def set_heat_map_visible(self, visible):
+        '''
+        A method to show or hide the energy map of the listener plane, it is accumulated only while shown,
+        so the hidden map costs the simulation steps nothing.
+        :param visible: whether the heat map is drawn
+        '''
+        self._heat_map_visible = visible
+        if self._receiver_grid is not None:   # set together with the engine
+            # observers list is replaced rather than changed, the worker thread may be iterating over it
+            observers = [observer for observer in self._engine.observers if observer is not self._receiver_grid]
+            self._engine.observers = observers + [self._receiver_grid] if visible else observers
+        self.update()
+
     def _draw_grid(self):
         '''
-        A method to draw grid lines.
+        A method to draw grid lines from static buffer objects.
         '''
         glLineWidth(1)   # width of a single grid line
-        glColor3f(.29, .29, .29, 1)   # color of a single grid line (gray)
-        glBegin(GL_LINES)   # tell OpenGL to draw lines
-        grid_lines = 10   # grid lines range (meaning its gird lines number / 4)
-        for i in range(-grid_lines, grid_lines + 1):   # drawing grid lines
-            glVertex3f(-grid_lines, 0, i)   # draw a horizontal line
-            glVertex3f(grid_lines, 0, i)
-            glVertex3f(i, 0, -grid_lines)   # draw a vertical line
-            glVertex3f(i, 0, grid_lines)
-        glColor3f(.52, .07, .07, 1)   # change line color to red
-        glVertex3f(-grid_lines, 0, 0)   # draw red grid line
-        glVertex3f(grid_lines, 0, 0)
-        glColor3f(.07, .52, .07, 1)   # change line color to green
-        glVertex3f(0, 0, -grid_lines)   # draw green grid line
-        glVertex3f(0, 0, grid_lines)
-        glEnd()   # tell OpenGL to stop drawing
+        self._draw_buffers(GL_LINES, self._grid_count, self._grid_buffers[0], color_buffer=self._grid_buffers[1])
 
     def _draw_room(self):
         '''
-        A method to draw room geometry.
+        A method to draw room geometry edges from static buffer objects, uploaded only when the geometry changes.
+        '''
+        if not self._room_uploaded:
+            self._upload_room()
+        glColor3f(.59, .59, .62)   # color of an edge (light gray)
+        self._draw_buffers(GL_LINES, self._room_count, self._room_buffers[0], index_buffer=self._room_buffers[1])
+
+    def _upload_room(self):
+        '''
+        A method to upload room points and edges indices into static buffer objects.
         '''
-        faces = self._room.faces   # store room faces in a new variable
-        points = self._room.points   # store room points in a new variable
-        glColor3f(.59, .59, .62, 1)   # color of an edge (light gray)
-        for id in faces:   # iterate through all faces
-            glBegin(GL_POLYGON)   # tell OpenGL to draw a polygon
-            for point_id in faces[id][:-1]:   # iterate through all points in a single face
-                glVertex3fv(points[point_id])   # draw a single point
-            glEnd()   # tell OpenGL to stop drawing
+        vertices, indices = room_wireframe(self._room)
+        self._room_count = len(indices)
+        glBindBuffer(GL_ARRAY_BUFFER, self._room_buffers[0])
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self._room_buffers[1])
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        self._room_uploaded = True
 
     def _draw_particles(self):
         '''
-        A method to draw sound waves represented by particles.
-        '''
-        glBegin(GL_POINTS)   # tell OpenGL to draw points
-        for index, particle in enumerate(self._particles_positions):   # iterate through all particles
-            green = self._particles_energies[index] / self._source_spl   # computing green color share in rgb palette
-            red = 1 - green   # computing red color share in rgb palette
-            glColor3f(red, green, 0, 1)   # color of a particle (initially green, then turning red)
-            glVertex3f(particle[0], particle[1], particle[2])   # draw each particle
-        self._recalculate_particles_normals()   # recalculate particles normals
-        self._recalculate_particles_positions()   # recalculate particles positions
-        glEnd()   # stop drawing
-
-    def _calculate_particles_normals_positions_energies(self):
-        '''
-        A method to calculate normal vectors of all particles.
-        Warning! This method should be used only after initialize_animation()!
-        '''
-        particles_count = 15   # not the exact particles count, number of particles in a single ring
-        radius = .5   # radius of starting sphere
-        self._particles_normals = []   # list of all particles normals
-        self._particles_positions = []   # list of all particles current positions
-        self._particles_energies = []   # list of all particles energies that reduce each time a particle reflects
-        for i in range(0, particles_count):   # iterate through each ring of particles
-            for j in range(0, particles_count):   # iterate through each particle in the current ring
-                x = cos(2*pi * j / (particles_count-1)) * sin(pi * i / (particles_count-1))   # x position of particle
-                y = sin(-pi/2 + pi * i / (particles_count-1))   # y position of particle
-                z = sin(2*pi * j / (particles_count-1)) * sin(pi * i / (particles_count-1))   # z position of particle
-                self._particles_normals.append([x, y, z])   # add normal vector of each particle to the list
-                self._particles_positions.append([x*radius+self._source_pos[0],   # add position of each particle
-                                                  y*radius+self._source_pos[1],   # to the list
-                                                  z*radius+self._source_pos[2]])
-                self._particles_energies.append(self._source_spl)   # each particle has energy equal to source spl
-
-    def _recalculate_particles_normals(self):
-        '''
-        A method to recalculate all particles normals in each frame.
-        Recalculates particles energies within each reflection and removes the particles with energy level below 60dB.
-        '''
-        self._particles_to_delete = []   # a list with indexes of particles with energy level below 60dB
-        for index, particle in enumerate(self._particles_positions):   # iterate through all particles
-            if particle[0] <= self._room.boundaries['min_x'] or particle[0] >= self._room.boundaries['max_x']:
-                self._compute_new_particle_normal_and_reduce_energy('x', index)   # react to particle reflection
-            elif particle[1] <= self._room.boundaries['min_y'] or particle[1] >= self._room.boundaries['max_y']:
-                self._compute_new_particle_normal_and_reduce_energy('y', index)   # react to particle reflection
-            elif particle[2] <= self._room.boundaries['min_z'] or particle[2] >= self._room.boundaries['max_z']:
-                self._compute_new_particle_normal_and_reduce_energy('z', index)   # react to particle reflection
-        for particle in sorted(self._particles_to_delete, reverse=True):   # deleting particles with energy below 60dB
-            del self._particles_normals[particle]
-            del self._particles_positions[particle]
-            del self._particles_energies[particle]
-
-    def _recalculate_particles_positions(self):
-        '''
-        A method to recalculate all particles positions in each frame.
-        '''
-        for index, particle in enumerate(self._particles_positions):   # iterate through all particles
-            normal = self._particles_normals[index]   # assign a particle normal vector to a variable
-            self._particles_positions[index] = [   # override previous particle position with a new position
-                particle[0]+normal[0]*.1,
-                particle[1]+normal[1]*.1,
-                particle[2]+normal[2]*.1
-            ]
-
-    def _compute_new_particle_normal_and_reduce_energy(self, axis, index):
-        '''
-        A method to compute new particle normals and reduce its energy level after reflection.
-        :param axis: either 'x', 'y' or 'z' based on which axis does the particle reflects
-        :param index: index of particle in all global lists
-        '''
-        normal = self._particles_normals[index]   # assign a particle normal vector to a variable
-        if axis == 'x':
-            self._particles_normals[index] = ([-normal[0], normal[1], normal[2]])   # reflecting the particle
-        elif axis == 'y':
-            self._particles_normals[index] = ([normal[0], -normal[1], normal[2]])   # reflecting the particle
+        A method to draw sound waves represented by particles from vertex buffer objects updated in bulk.
+        Particles are moved by the background worker, only its latest snapshot is drawn here.
+        '''
+        with self._worker.snapshot() as snapshot, self.profiler.stage('upload_particles'):   # kept until uploaded
+            count = snapshot.count
+            if count:
+                self._upload_particles(particle_positions(snapshot.positions),
+                                       particle_colors(snapshot.energies[:, self._band], self._engine.source_spl))
+        if count:
+            self._draw_buffers(GL_POINTS, count, self._particles_buffers[0],
+                               color_buffer=self._particles_buffers[1])
+
+    def _draw_heat_map(self):
+        '''
+        A method to draw energy map of the listener plane accumulated so far, colored relative to its loudest cell.
+        Energies are read while the worker may add to them, a frame can show a partially added step.
+        '''
+        with self.profiler.stage('upload_heat_map'):
+            colors = heat_map_colors(self._receiver_grid.energies, self._band)
+            glBindBuffer(GL_ARRAY_BUFFER, self._heat_map_buffers[1])
+            glBufferSubData(GL_ARRAY_BUFFER, 0, colors.nbytes, colors)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)   # cells are filled, while the rest is drawn as wireframe
+        self._draw_buffers(GL_TRIANGLES, self._heat_map_count, self._heat_map_buffers[0],
+                           color_buffer=self._heat_map_buffers[1])
+        glPolygonMode(GL_FRONT_AND_BACK, GL_LINE)
+
+    def _draw_recording(self):
+        '''
+        A method to draw particles of the replayed recording, only events around the replay time are read from disk.
+        '''
+        with self.profiler.stage('upload_particles'):
+            _, positions, energies = self._recording.positions_at(self._replay_time)
+            count = len(positions)
+            if count:
+                self._upload_particles(particle_positions(positions),
+                                       particle_colors(energies[:, self._band], self._recording.source_spl))
+        if count:
+            self._draw_buffers(GL_POINTS, count, self._particles_buffers[0],
+                               color_buffer=self._particles_buffers[1])
+
+    def _upload_particles(self, positions, colors):
+        '''
+        A method to update particles vertex buffer objects, reallocating them only when they are too small.
+        :param positions: float32 array of shape (n, 3) with particles positions
+        :param colors: float32 array of shape (n, 3) with particles colors
+        '''
+        if len(positions) > self._particles_capacity:   # growing the buffers at least twice to rarely reallocate
+            self._particles_capacity = max(len(positions), 2 * self._particles_capacity)
+            for buffer in self._particles_buffers:
+                glBindBuffer(GL_ARRAY_BUFFER, buffer)
+                glBufferData(GL_ARRAY_BUFFER, self._particles_capacity * positions.itemsize * 3, None, GL_STREAM_DRAW)
+        for buffer, data in zip(self._particles_buffers, (positions, colors)):
+            glBindBuffer(GL_ARRAY_BUFFER, buffer)
+            glBufferSubData(GL_ARRAY_BUFFER, 0, data.nbytes, data)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def _draw_buffers(self, mode, count, vertex_buffer, color_buffer=None, index_buffer=None):
+        '''
+        A method to draw primitives from float32 vertex buffer objects with a single draw call.
+        :param mode: OpenGL primitive type, e.g. GL_POINTS
+        :param count: number of vertices (or indices if index_buffer is given) to draw
+        :param vertex_buffer: buffer object with vertices positions
+        :param color_buffer: buffer object with vertices colors, current color is used if None
+        :param index_buffer: buffer object with uint32 vertices indices, vertices are drawn in order if None
+        '''
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, vertex_buffer)
+        glVertexPointer(3, GL_FLOAT, 0, None)
+        if color_buffer is not None:
+            glEnableClientState(GL_COLOR_ARRAY)
+            glBindBuffer(GL_ARRAY_BUFFER, color_buffer)
+            glColorPointer(3, GL_FLOAT, 0, None)
+        if index_buffer is not None:
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, index_buffer)
+            glDrawElements(mode, count, GL_UNSIGNED_INT, None)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
         else:
-            self._particles_normals[index] = ([normal[0], normal[1], -normal[2]])   # reflecting the particle
-        # reducing particle energy
-        self._particles_energies[index] = 10 * log10(10 ** (self._particles_energies[index] * .1) * (1 - self._room.average_alpha[self._source_freq]))
-        if self._particles_energies[index] < self._source_spl - 60:
-            self._particles_to_delete.append(index)   # queueing the particle to removal when its energy is below 60dB
+            glDrawArrays(mode, 0, count)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        if color_buffer is not None:
+            glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
@@ -1,12 +1,16 @@
-#!/usr/bin/python3.4
+#!/usr/bin/python3
 
 '''
 Main window and basic GUI widgets module for Ray Tracing Method 4-dimensional visualization.
 '''
 
-from PyQt5.QtWidgets import QComboBox, QLabel, QLineEdit, QPushButton, QWidget
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import QCheckBox, QComboBox, QFileDialog, QLabel, QLineEdit, QPushButton, QSlider, QWidget
 from error_handler.error_handler import ErrorHandler
 from gui.opengl_widget import OpenGLWidget
+from simulation.emitter import DEFAULT_RAYS_COUNT
+from simulation.profiler import rates
+from simulation.recording import Recording
 
 __author__ = 'Norbert Mieczkowski'
 __copyright__ = 'Copyright 2015, Norbert Mieczkowski'
@@ -85,18 +89,153 @@ class VisualizationWindow(QWidget):
         self._source_freq_dropdown.addItems(['125', '250', '500', '1000', '2000', '4000'])
         self._source_freq_dropdown.setFixedWidth(146)
         self._source_freq_dropdown.move(131, 106)
+        self._source_freq_dropdown.currentIndexChanged[str].connect(self._change_frequency)
+
+        # creating rays count label and text field
+        self._rays_lbl = QLabel('Rays:', self)
+        self._rays_lbl.move(22, 140)
+        self._rays_text = QLineEdit(str(DEFAULT_RAYS_COUNT), self)
+        self._rays_text.setFixedWidth(190)
+        self._rays_text.move(87, 136)
 
         # creating simulation button
         self._simulation_button = QPushButton('Start simulation', self)
         self._simulation_button.setFixedSize(257, 60)
-        self._simulation_button.move(20, 160)
+        self._simulation_button.move(20, 180)
         self._simulation_button.clicked[bool].connect(self._start_simulation)
 
+        # creating profiling checkbox and overlay label drawn over the OpenGL widget
+        self._profiling_checkbox = QCheckBox('Show profiling', self)
+        self._profiling_checkbox.move(22, 255)
+        self._profiling_checkbox.toggled[bool].connect(self._toggle_profiling)
+        self._profiling_lbl = QLabel(self._opengl_widget)
+        self._profiling_lbl.move(10, 10)
+        self._profiling_lbl.setStyleSheet('background-color: rgba(0, 0, 0, 150); color: white; padding: 4px;')
+        self._profiling_lbl.hide()
+        self._profiling_timer = QTimer(self)   # refreshing the overlay with measurements of the last interval
+        self._profiling_timer.timeout.connect(self._update_profiling)
+        self._profiling_snapshot = None
+
+        # creating profile dump checkbox appending the measurements to a JSON lines file
+        self._profile_dump_checkbox = QCheckBox('Dump profile', self)
+        self._profile_dump_checkbox.move(150, 255)
+        self._profile_dump_checkbox.toggled[bool].connect(self._toggle_profile_dump)
+
+        # creating heat map checkbox showing energy map of the listener plane
+        self._heat_map_checkbox = QCheckBox('Show heat map', self)
+        self._heat_map_checkbox.move(22, 280)
+        self._heat_map_checkbox.toggled[bool].connect(self._opengl_widget.set_heat_map_visible)
+
+        # creating recording button, replay time slider and label
+        self._recording_button = QPushButton('Open recording', self)
+        self._recording_button.setFixedSize(257, 30)
+        self._recording_button.move(20, 315)
+        self._recording_button.clicked[bool].connect(self._open_recording)
+        self._replay_slider = QSlider(Qt.Horizontal, self)
+        self._replay_slider.setRange(0, 1000)
+        self._replay_slider.setFixedWidth(257)
+        self._replay_slider.move(20, 355)
+        self._replay_slider.setDisabled(True)
+        self._replay_slider.valueChanged[int].connect(self._change_replay_time)
+        self._replay_lbl = QLabel('Time: 0.000 s', self)
+        self._replay_lbl.setFixedWidth(257)
+        self._replay_lbl.move(22, 380)
+        self._recording = None
+
         self.show()
 
+    def _change_frequency(self, text):
+        '''
+        Method coloring particles by the frequency selected in the dropdown list, all frequencies are simulated at once.
+        :param text: selected frequency
+        '''
+        self._opengl_widget.set_frequency(int(text))
+
+    def _open_recording(self):
+        '''
+        Method choosing a recording directory written by cli.py --record and replaying it instead of the animation.
+        '''
+        directory = QFileDialog.getExistingDirectory(self, 'Open recording')
+        if not directory:   # dialog was cancelled
+            return
+        try:   # exception handling in case of a wrong directory
+            recording = Recording(directory)
+        except Exception as e:
+            self._error_handler.raise_dialog(str(e))
+            return
+        self._recording = recording
+        self._opengl_widget.open_recording(recording)
+        self._replay_slider.setDisabled(False)
+        self._replay_slider.setValue(0)
+        self._change_replay_time(0)
+
+    def _change_replay_time(self, value):
+        '''
+        Method drawing the replayed recording at the time selected with the slider.
+        :param value: slider position, 0 at the first recorded event and 1000 when the last particle dies
+        '''
+        if self._recording is None:
+            return
+        start = self._recording.start
+        time = start + (self._recording.duration - start) * value / self._replay_slider.maximum()
+        self._replay_lbl.setText('Time: {:.3f} s'.format(time))
+        self._opengl_widget.set_replay_time(time)
+
+    def _toggle_profiling(self, checked):
+        '''
+        Method switching profiling of the simulation and drawing on or off, with the overlay showing its results.
+        :param checked: whether the checkbox is checked
+        '''
+        profiler = self._opengl_widget.profiler
+        profiler.enabled = checked or self._profile_dump_checkbox.isChecked()
+        if checked:
+            self._profiling_snapshot = profiler.snapshot()
+            self._profiling_lbl.setText('Profiling...')
+            self._profiling_lbl.adjustSize()
+            self._profiling_lbl.show()
+            self._profiling_timer.start(500)
+        else:
+            self._profiling_timer.stop()
+            self._profiling_lbl.hide()
+
+    def _toggle_profile_dump(self, checked):
+        '''
+        Method choosing a JSON lines file and appending measurements to it every second, or stopping the dumps.
+        :param checked: whether the checkbox is checked
+        '''
+        profiler = self._opengl_widget.profiler
+        if not checked:
+            profiler.stop_dump()
+            profiler.enabled = self._profiling_checkbox.isChecked()
+            return
+        path = QFileDialog.getSaveFileName(self, 'Dump profile', 'profile.jsonl', 'JSON lines (*.jsonl)')[0]
+        if not path:   # dialog was cancelled
+            self._profile_dump_checkbox.setChecked(False)
+            return
+        profiler.enabled = True
+        profiler.start_dump(path)
+
+    def _update_profiling(self):
+        '''
+        Method showing frame time, simulation rates and mean stage times of the last interval in the overlay.
+        '''
+        snapshot = self._opengl_widget.profiler.snapshot()
+        interval = rates(self._profiling_snapshot, snapshot)
+        self._profiling_snapshot = snapshot
+        lines = [
+            'Frames per second: {:.1f}'.format(interval['per_second'].get('frames', 0)),
+            'Steps per second: {:.1f}'.format(interval['per_second'].get('steps', 0)),
+            'Reflections per step: {:.1f}'.format(interval['per_step'].get('reflections', 0)),
+            'Rays alive: {}'.format(snapshot['gauges'].get('particles', '-')),
+        ]
+        lines += ['{}: {:.3f} ms'.format(name.replace('_', ' ').capitalize(), stage['mean'] * 1000)
+                  for name, stage in sorted(interval['stages'].items()) if stage['calls']]
+        self._profiling_lbl.setText('\n'.join(lines))
+        self._profiling_lbl.adjustSize()
+
     def _start_simulation(self):
         '''
-        Method disabling all Qt widgets and starting OpenGL animation.
+        Method disabling source parameters Qt widgets and starting OpenGL animation.
         '''
         try:   # exception handling in case of wrong input values
             source_pos = (   # source position tuple
@@ -107,6 +246,9 @@ class VisualizationWindow(QWidget):
             source_spl = float(self._source_spl_text.text()),   # source sound pressure level
             source_spl = source_spl[0] if type(source_spl) == type(tuple()) else source_spl
             source_freq = int(self._source_freq_dropdown.currentText())   # source frequency
+            rays_count = int(self._rays_text.text())   # number of emitted rays
+            if rays_count < 1:
+                raise ValueError('Number of rays has to be positive.')
         except Exception as e:   # in case of exception
             self._error_handler.raise_dialog(str(e))   # raise dialog window with exception description
             return   # and return to prevent function from proceeding
@@ -121,9 +263,22 @@ class VisualizationWindow(QWidget):
         self._source_z_text.setDisabled(True)
         self._source_spl_lbl.setDisabled(True)
         self._source_spl_text.setDisabled(True)
-        self._source_freq_lbl.setDisabled(True)
-        self._source_freq_dropdown.setDisabled(True)
+        self._rays_lbl.setDisabled(True)
+        self._rays_text.setDisabled(True)
         self._simulation_button.setDisabled(True)
+        self._recording = None
+        self._replay_slider.setDisabled(True)
 
         # initializing OpenGL animation
-        self._opengl_widget.initialize_animation(source_pos=source_pos, source_spl=source_spl, source_freq=source_freq)
+        self._opengl_widget.initialize_animation(source_pos=source_pos, source_spl=source_spl, source_freq=source_freq,
+                                                rays_count=rays_count)
+
+    def closeEvent(self, event):
+        '''
+        Overridden method stopping the simulation thread and profiling before the window is closed.
+        :param event: QCloseEvent
+        '''
+        self._profiling_timer.stop()
+        self._opengl_widget.profiler.stop_dump()
+        self._opengl_widget.stop_animation()
+        super(VisualizationWindow, self).closeEvent(event)
@@ -1,119 +1,186 @@
-#!/usr/bin/python3.4
+#!/usr/bin/python3
 
 '''
 Room geometry file loader module for Ray Tracing Method 4-dimensional visualization.
 '''
 
-from geometry.room import Room
+import os
+import re
+from array import array
+
+import numpy as np
+
+from geometry.room import MATERIAL_VALUES, Room
 
 __author__ = 'Norbert Mieczkowski'
 __copyright__ = 'Copyright 2015, Norbert Mieczkowski'
 __version__ = '1.0.0'
 
+# single pass patterns of each record type, e.g. '1 0.0 2.5 3.0', '[1 / 1 2 3 4 / concrete]' and
+# 'abs concrete <1 1 2 2 2 3> {150 150 157} [10 10 10 20 30 40]' with optional color and scattering coefficients
+POINT_PATTERN = re.compile(r'(\d+)\s+(\S+)\s+(\S+)\s+(\S+)')
+FACE_PATTERN = re.compile(r'\[\s*(\d+)\s*/([^/]*)/\s*([^\s\]]+)')
+ABS_PATTERN = re.compile(r'abs\s+([^\s<]+)\s*<([^>]*)>\s*(?:\{([^}]*)\})?\s*(?:\[([^\]]*)\])?', re.IGNORECASE)
+DEFAULT_COLOR = (150 / 255, 150 / 255, 157 / 255)   # color of materials without specified color
+PROGRESS_LINES = 4096   # number of lines between progress reports and cancellation checks
+
+
+class LoadingCancelled(Exception):
+    '''
+    Exception raised when loading is cancelled before the room is ready.
+    '''
+    pass
+
 
 class FileLoader():
 
     def __init__(self):
         '''
-        Creates empty dictionaries of values yet to read.
+        Creates empty typed arrays of values yet to read, records are appended to them without any intermediate lists.
         '''
-        self._points = {}
-        self._faces = {}
+        self._point_ids = array('q')
+        self._points = array('d')   # x, y, z of each point
+        self._face_ids = array('q')
+        self._face_offsets = array('q', [0])   # ranges of each face in _face_points
+        self._face_points = array('q')
+        self._face_materials = []   # material name of each face, resolved after all materials are read
+        self._face_lines = array('q')   # line number of each face, for errors reported after reading
         self._abs = {}
 
-    def load_master_file(self, file_path):
+    def load_master_file(self, file_path, progress=None, cancel=None):
         '''
-        Loads file with room geometry into three lists of points, faces and abs (materials).
+        Loads file with room geometry in a single streaming pass, line by line.
         :param file_path: path to file with room geometry
+        :param progress: function called periodically with stage name ('parsing' or 'building'), bytes read so far
+                         and file size, or tree levels built and all tree levels when building,
+                         and dictionary with numbers of 'points', 'faces' and 'materials' read so far
+        :param cancel: threading.Event() stopping the loading with LoadingCancelled once it is set
+        :return: Room() instance
         '''
+        size = os.path.getsize(file_path)
         with open(file_path) as master_file:   # opening specified file
-            lines = master_file.readlines()   # reading each line of opened file
-            for line in lines:   # iterating over the lines
-                # reading points
-                if line[0].isdigit():
-                    self._read_point(line)
-                # reading faces
-                elif line.startswith('['):
-                    self._read_face(line)
-                # reading materials
-                elif line.lower().startswith('abs'):
-                    self._read_abs(line)
-            master_file.close()
-        return Room(self._points, self._faces, self._abs)
+            for line_number, line in enumerate(master_file, 1):   # iterating over the lines without reading them all
+                if not line_number % PROGRESS_LINES:
+                    # position of the underlying binary file, ahead of the line by at most its read buffer
+                    self._report(progress, cancel, 'parsing', master_file.buffer.tell(), size)
+                try:
+                    # reading points
+                    if line[:1].isdigit():
+                        self._read_point(line)
+                    # reading faces
+                    elif line.startswith('['):
+                        self._read_face(line, line_number)
+                    # reading materials
+                    elif line[:3].lower() == 'abs':
+                        self._read_abs(line)
+                except ValueError as e:
+                    raise ValueError('{}, line {}: {}'.format(file_path, line_number, e)) from None
+        # building the tree of triangles reports each of its levels, so it can be cancelled in between
+        return Room.from_arrays(self._geometry_arrays(file_path),
+                                lambda built, levels: self._report(progress, cancel, 'building', built, levels))
+
+    def _report(self, progress, cancel, stage, read_bytes, size):
+        '''
+        Reports loading progress and raises LoadingCancelled if the loading is cancelled.
+        :param progress: function receiving the progress, see load_master_file(), nothing is reported if None
+        :param cancel: threading.Event() set to cancel the loading, or None
+        :param stage: name of the loading stage
+        :param read_bytes: number of bytes read so far, or of tree levels built when building
+        :param size: file size, or number of all tree levels when building
+        '''
+        if cancel is not None and cancel.is_set():
+            raise LoadingCancelled('loading was cancelled')
+        if progress is not None:
+            progress(stage, min(read_bytes, size), size, {'points': len(self._point_ids), 'faces': len(self._face_ids),
+                                                          'materials': len(self._abs)})
 
     def _read_point(self, text_line):
         '''
         Reads line of text and picks the point id and coordinates.
         :param text_line: string with point data
         '''
-        # splitting the line into separate elements and deleting '\n' at its end
-        data = [sth for sth in text_line.split(' ') if sth != '']
-        if data[-1].endswith('\n'):
-            data[-1] = data[-1][:-1]
-        self._points[int(data[0])] = (float(data[1]), float(data[3]), float(data[2]))   # adding new point to the list
+        match = POINT_PATTERN.match(text_line)
+        if match is None:
+            raise ValueError('invalid point record {!r}'.format(text_line.strip()))
+        point_id, x, y, z = match.groups()
+        self._point_ids.append(int(point_id))
+        self._points.extend((float(x), float(z), float(y)))   # swapping Y and Z, so that Y axis points up
 
-    def _read_face(self, text_line):
+    def _read_face(self, text_line, line_number):
         '''
         Reads line of text and picks the face id, points and material.
         :param text_line: string with face data
+        :param line_number: number of the line in the file
         '''
-        # splitting the line into separate elements and deleting '\n' at its end and '[' ']' if glued to data samples
-        data = [sth for sth in text_line.split(' ') if sth != '']
-        if data[0].startswith('['):
-            data[0] = data[0][1:]
-        if data[-1].endswith('\n'):
-            data[-1] = data[-1][:-1]
-        if data[-1].endswith(']'):
-            data[-1] = data[-1][:-1]
-        for i in range(len(data)):
-            if data[i].startswith('/') and (data[i] != '/'):
-                data[i] = data[i][1:]
-                data.insert(i, '/')
-        face = []   # creating empty list to fill with face information
-        beginning_index = data.index('/')   # finding first '/' tag index
-        data[beginning_index] = 'X'   # replacing the '/' tag with 'X' to find the second '/' tag
-        ending_index = data.index('/')   # finding second '/' tag index
-        for i in range(ending_index - beginning_index - 1):   # loop to iterate over each element between '/' tags
-            face.append(int(data[beginning_index + i + 1]))   # appending each point between '/' tags to face list
-        face.append(data[ending_index + 1])   # finally appending abs name
-        self._faces[int(data[0])] = tuple(face)   # adding new face to the faces list
+        match = FACE_PATTERN.match(text_line)
+        if match is None:
+            raise ValueError('invalid face record {!r}'.format(text_line.strip()))
+        face_id, points, material = match.groups()
+        self._face_ids.append(int(face_id))
+        self._face_points.extend(map(int, points.split()))
+        self._face_offsets.append(len(self._face_points))
+        self._face_materials.append(material)
+        self._face_lines.append(line_number)
 
     def _read_abs(self, text_line):
         '''
-        Reads line of text and picks the material name, sound absorption coefficient for certain frequencies and color.
+        Reads line of text and picks the material name, sound absorption coefficient for certain frequencies, color
+        and scattering coefficients for the same frequencies.
         :param text_line: string with material data
         '''
-        # splitting the line into separate elements and deleting '\n' at its end
-        data = [sth for sth in text_line.split(' ') if sth != '']
-        if data[-1].endswith('\n'):
-            data[-1] = data[-1][:-1]
-        # inefficient but necessary set of loops for cutting out '<', '>', '{' and '}' from data samples
-        for i in range(len(data)):
-            if data[i].startswith('<') and (data[i] != '<'):
-                data[i] = data[i][1:]
-                data.insert(i, '<')
-        for i in range(len(data)):
-            if (data[i].endswith('>')) and (data[i] != '>'):
-                data[i] = data[i][:-1]
-                data.insert(i + 1, '>')
-        for i in range(len(data)):
-            if data[i].startswith('{') and (data[i] != '{'):
-                data[i] = data[i][1:]
-                data.insert(i, '{')
-        for i in range(len(data)):
-            if (data[i].endswith('}')) and (data[i] != '}'):
-                data[i] = data[i][:-1]
-                data.insert(i + 1, '}')
-        abs = []   # creating empty list to fill with material information
-        beginning_index = data.index('<')   # finding '<' tag index
-        ending_index = data.index('>')   # finding '>' tag index
-        for i in range(ending_index - beginning_index - 1):   # loop to iterate over each element between '<' '>' tags
-            abs.append(int(data[beginning_index + i + 1]) / 100)   # appending each coefficient between '<' '>' tags
-        try:   # material color is optional so exception handler is called
-            beginning_index = data.index('{')   # finding '}' tag index
-            ending_index = data.index('}')   # finding '{' tag index
-            for i in range(ending_index - beginning_index - 1):   # loop to iterate over elements between '{' '}' tags
-                abs.append(int(data[beginning_index + i + 1]) / 255)   # appending each rgb value between '{' '}' tags
-        except ValueError:   # if material color wasn't specified
-            abs.extend((150 / 255, 150 / 255, 157 / 255))   # setting material color to default
-        self._abs[data[1]] = tuple(abs)   # adding new abs to the abs list
+        match = ABS_PATTERN.match(text_line)
+        if match is None:
+            raise ValueError('invalid material record {!r}'.format(text_line.strip()))
+        name, alphas, color, scattering = match.groups()
+        abs = [float(alpha) / 100 for alpha in alphas.split()]   # coefficients are given in percents
+        if len(abs) != 6:
+            raise ValueError('material {} has {} sound absorption coefficients instead of 6'.format(name, len(abs)))
+        if color is None:   # material color is optional
+            abs.extend(DEFAULT_COLOR)
+        else:
+            color = [float(value) / 255 for value in color.split()]
+            if len(color) != 3:
+                raise ValueError('material {} color has {} values instead of 3'.format(name, len(color)))
+            abs.extend(color)
+        if scattering is None:   # scattering coefficients are optional, reflections are specular by default
+            abs.extend([0.] * 6)
+        else:
+            scattering = [float(value) / 100 for value in scattering.split()]   # given in percents as well
+            if len(scattering) != 6:
+                raise ValueError('material {} has {} scattering coefficients instead of 6'.format(name,
+                                                                                                  len(scattering)))
+            if not all(0 <= value <= 1 for value in scattering):
+                raise ValueError('material {} scattering coefficients have to be within 0-100%'.format(name))
+            abs.extend(scattering)
+        self._abs[name] = tuple(abs)   # adding new abs to the abs dictionary
+
+    def _geometry_arrays(self, file_path):
+        '''
+        Converts read records into geometry arrays, resolving materials of faces.
+        :param file_path: path to file with room geometry, for error messages
+        :return: dictionary of arrays with geometry.room.GEOMETRY_ARRAYS keys
+        '''
+        material_names = list(self._abs)
+        material_indices = {name: index for index, name in enumerate(material_names)}
+        face_materials = array('q')
+        for index, material in enumerate(self._face_materials):   # resolving materials defined anywhere in the file
+            if material not in material_indices:
+                raise ValueError('{}, line {}: face uses undefined material {}'.format(
+                    file_path, self._face_lines[index], material))
+            face_materials.append(material_indices[material])
+        for name, ids in (('point', self._point_ids), ('face', self._face_ids)):
+            unique, counts = np.unique(ids, return_counts=True)
+            if (counts > 1).any():
+                raise ValueError('{}: {} {} is defined more than once'.format(file_path, name,
+                                                                             unique[np.argmax(counts > 1)]))
+        return {
+            'point_ids': np.array(self._point_ids, dtype=np.int64),
+            'points': np.array(self._points, dtype=np.float64).reshape(-1, 3),
+            'face_ids': np.array(self._face_ids, dtype=np.int64),
+            'face_offsets': np.array(self._face_offsets, dtype=np.int64),
+            'face_points': np.array(self._face_points, dtype=np.int64),
+            'face_materials': np.array(face_materials, dtype=np.int64),
+            'material_names': np.array(material_names, dtype=str),
+            'material_values': np.array([self._abs[name] for name in material_names],
+                                        dtype=np.float64).reshape(-1, MATERIAL_VALUES),
+        }
@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+
+'''
+Compiled room geometry cache module for Ray Tracing Method 4-dimensional visualization.
+'''
+
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+
+from geometry.room import Room
+from input.file_loader import FileLoader, LoadingCancelled
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+COMPILED_FORMAT_VERSION = 2   # has to be increased whenever Room.to_arrays() output changes
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'ray_tracing_method')
+DEFAULT_CACHE_SIZE = 1 << 30   # maximum size of compiled rooms [B]
+COMPILED_NAME = re.compile(r'[0-9a-f]{40}-\d+-v(\d+)$')   # name of a compiled room directory, see compiled_path()
+
+
+def save_compiled(room, path):
+    '''
+    Saves room geometry with all derived structures as a directory of .npy files, which can be memory-mapped.
+    The directory is written under a temporary name and renamed, so readers never see a partial one.
+    :param room: Room() instance
+    :param path: path of the compiled room directory
+    '''
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    temporary_path = tempfile.mkdtemp(dir=parent)
+    try:
+        for key, array in room.to_arrays().items():
+            np.save(os.path.join(temporary_path, key + '.npy'), array)
+        os.rename(temporary_path, path)
+    except OSError:
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        if not os.path.isdir(path):   # another process may have compiled the same room in the meantime
+            raise
+
+
+def load_compiled(path):
+    '''
+    Loads room geometry saved by save_compiled(), arrays are memory-mapped instead of read.
+    :param path: path of the compiled room directory
+    :return: Room() instance
+    '''
+    arrays = {name[:-4]: np.load(os.path.join(path, name), mmap_mode='r')
+              for name in os.listdir(path) if name.endswith('.npy')}
+    room = Room.from_arrays(arrays)
+    room.compiled_path = path
+    return room
+
+
+def compiled_path(file_path, cache_dir=DEFAULT_CACHE_DIR, progress=None, cancel=None):
+    '''
+    Computes path of the compiled room for a room file, keyed by the file content hash and modification time.
+    :param file_path: path to file with room geometry
+    :param cache_dir: directory with compiled rooms
+    :param progress: function called after each hashed megabyte with stage name 'hashing', bytes hashed so far,
+                     file size and None
+    :param cancel: threading.Event() stopping the hashing with LoadingCancelled once it is set
+    :return: path of the compiled room directory
+    '''
+    digest = hashlib.sha1()
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as master_file:
+        for chunk in iter(lambda: master_file.read(1 << 20), b''):
+            digest.update(chunk)
+            if cancel is not None and cancel.is_set():
+                raise LoadingCancelled('loading was cancelled')
+            if progress is not None:
+                progress('hashing', master_file.tell(), size, None)
+    modification_time = os.stat(file_path).st_mtime_ns
+    return os.path.join(cache_dir, '{}-{}-v{}'.format(digest.hexdigest(), modification_time,
+                                                      COMPILED_FORMAT_VERSION))
+
+
+def evict_compiled(cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE, kept_path=None):
+    '''
+    Removes compiled rooms of other format versions, and the least recently used ones until the compiled rooms fit
+    the maximum size. Other files in the cache directory, e.g. cached sweep results, are left alone.
+    :param cache_dir: directory with compiled rooms
+    :param max_size: maximum size of all compiled rooms [B], 0 removes all of them
+    :param kept_path: path of the compiled room which is never removed, e.g. the one just loaded, or None
+    '''
+    entries = []   # tuples (last use time, size, path)
+    for name in os.listdir(cache_dir):
+        match = COMPILED_NAME.match(name)
+        path = os.path.join(cache_dir, name)
+        if match is None or path == kept_path:
+            continue
+        if int(match.group(1)) != COMPILED_FORMAT_VERSION:   # never loaded again
+            shutil.rmtree(path, ignore_errors=True)
+            continue
+        try:
+            entries.append((os.stat(path).st_mtime, _directory_size(path), path))
+        except FileNotFoundError:   # removed by another process
+            continue
+    size = sum(entry[1] for entry in entries) + (_directory_size(kept_path) if kept_path is not None else 0)
+    for _, entry_size, path in sorted(entries):
+        if size <= max_size:
+            break
+        shutil.rmtree(path, ignore_errors=True)   # memory-mapped arrays of rooms still in use stay readable
+        size -= entry_size
+
+
+def _directory_size(path):
+    '''
+    Computes size of all files of a compiled room.
+    :param path: path of the compiled room directory
+    :return: size [B]
+    '''
+    return sum(entry.stat().st_size for entry in os.scandir(path))
+
+
+def load_room(file_path, cache_dir=DEFAULT_CACHE_DIR, progress=None, cancel=None, cache_size=DEFAULT_CACHE_SIZE):
+    '''
+    Loads room geometry from the compiled room cache, parsing and compiling the room file only on a cache miss.
+    Compiled rooms are removed, least recently used first, when they exceed the cache size.
+    :param file_path: path to file with room geometry
+    :param cache_dir: directory with compiled rooms, caching is disabled if None
+    :param progress: function called periodically with stage name, bytes processed so far, file size and dictionary
+                     with numbers of read records or None, see FileLoader.load_master_file()
+    :param cancel: threading.Event() stopping the loading with LoadingCancelled once it is set
+    :param cache_size: maximum size of all compiled rooms [B], the loaded one is kept even if it is larger
+    :return: Room() instance
+    '''
+    if cache_dir is None:
+        return FileLoader().load_master_file(file_path, progress, cancel)
+    path = compiled_path(file_path, cache_dir, progress, cancel)
+    if os.path.isdir(path):
+        os.utime(path)   # modification time orders compiled rooms by their last use
+        return load_compiled(path)
+    room = FileLoader().load_master_file(file_path, progress, cancel)
+    if cancel is not None and cancel.is_set():   # not caching a room nobody waits for
+        raise LoadingCancelled('loading was cancelled')
+    save_compiled(room, path)
+    evict_compiled(cache_dir, cache_size, path)
+    room.compiled_path = path
+    return room
@@ -1,4 +1,4 @@
-#!/usr/bin/python3.4
+#!/usr/bin/python3
 
 '''
 Main module for Ray Tracing Method 4-dimensional visualization.
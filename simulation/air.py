@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+
+'''
+Air sound absorption module for Ray Tracing Method 4-dimensional visualization.
+'''
+
+import functools
+
+import numpy as np
+
+from geometry.room import FREQUENCIES
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+REFERENCE_PRESSURE = 101.325   # reference atmospheric pressure [kPa]
+REFERENCE_TEMPERATURE = 293.15   # reference air temperature [K]
+TRIPLE_POINT_TEMPERATURE = 273.16   # triple point isotherm temperature of water [K]
+
+
+@functools.lru_cache(maxsize=None)
+def air_attenuation(temperature=20., humidity=50., pressure=REFERENCE_PRESSURE):
+    '''
+    Function computing pure-tone air attenuation coefficients of all frequencies according to ISO 9613-1.
+    Tables are computed once for each setting and shared, so particles only multiply them by travelled distances.
+    :param temperature: air temperature [degrees Celsius]
+    :param humidity: relative humidity [%]
+    :param pressure: atmospheric pressure [kPa]
+    :return: read-only array with attenuation [dB/m] of each of geometry.room.FREQUENCIES
+    '''
+    if not 0 <= humidity <= 100:
+        raise ValueError('relative humidity has to be within 0-100%, not {}'.format(humidity))
+    if temperature <= -273.15 or pressure <= 0:
+        raise ValueError('air temperature {} and pressure {} are not physical'.format(temperature, pressure))
+    temperature += 273.15
+    relative_pressure = pressure / REFERENCE_PRESSURE
+    relative_temperature = temperature / REFERENCE_TEMPERATURE
+    saturation = 10 ** (-6.8346 * (TRIPLE_POINT_TEMPERATURE / temperature) ** 1.261 + 4.6151)   # relative to pressure
+    concentration = humidity * saturation / relative_pressure   # molar concentration of water vapour [%]
+    # relaxation frequencies of oxygen and nitrogen
+    oxygen = relative_pressure * (24 + 4.04e4 * concentration * (.02 + concentration) / (.391 + concentration))
+    nitrogen = relative_pressure * relative_temperature ** -.5 * (
+        9 + 280 * concentration * np.exp(-4.170 * (relative_temperature ** (-1 / 3) - 1)))
+    frequencies = np.array(FREQUENCIES, dtype=np.float64)
+    squares = frequencies ** 2
+    attenuation = 8.686 * squares * (
+        1.84e-11 / relative_pressure * relative_temperature ** .5 + relative_temperature ** -2.5 * (
+            .01275 * np.exp(-2239.1 / temperature) / (oxygen + squares / oxygen) +
+            .1068 * np.exp(-3352 / temperature) / (nitrogen + squares / nitrogen)))
+    attenuation.setflags(write=False)   # the same table is returned to all callers
+    return attenuation
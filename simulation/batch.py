@@ -0,0 +1,348 @@
+#!/usr/bin/python3
+
+'''
+Multiprocess batch tracing module for Ray Tracing Method 4-dimensional visualization.
+'''
+
+import hashlib
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from multiprocessing import Pool
+
+import numpy as np
+
+from geometry.room import FREQUENCIES
+from input.room_cache import load_compiled
+from simulation.checkpoint import CheckpointWriter, load_checkpoint
+from simulation.echogram import add_to_histogram, Echogram
+from simulation.engine import EngineObserver, SimulationEngine
+from simulation.profiler import Profiler
+from simulation.receiver_grid import ReceiverGrid
+from simulation.recording import TrajectoryRecorder, write_metadata
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+_room = None   # room geometry of a worker process, shared read-only between all its shards
+
+
+def _initialize_worker(room):
+    '''
+    Function assigning room geometry to a worker process once, instead of sending it with every shard.
+    :param room: Room() instance or path of a compiled room, which is memory-mapped by each worker
+    '''
+    global _room
+    _room = load_compiled(room) if isinstance(room, str) else room
+
+
+def _trace_shard(arguments):
+    '''
+    Function tracing a single shard of rays in a worker process.
+    With a state, the engine and the results of the shard in progress are saved periodically in the background,
+    and a shard interrupted after a save resumes from it, giving exactly the same results.
+    :param arguments: tuple of (directions, source_pos, source_spl, bin_width, duration, max_reflections,
+                      receivers, receiver_radius, min_order, air_attenuation, seed, record, state, profile, grid),
+                      state is a tuple (path, interval, digest) of the shard state file, the minimum time between
+                      saves [s] and the run digest, or None
+    :return: BatchResult() instance of the shard
+    '''
+    (directions, source_pos, source_spl, bin_width, duration, max_reflections, receivers, receiver_radius,
+     min_order, air_attenuation, seed, record, state, profile, grid) = arguments
+    profiler = Profiler(enabled=True) if profile else None   # snapshot is sent back with the results
+    saved = None   # state of the shard saved by an interrupted run
+    if state is not None:
+        state_path, state_interval, digest = state
+        if os.path.exists(state_path):
+            saved = load_checkpoint(state_path)
+            if str(saved['digest']) != digest:
+                raise ValueError('{}: shard state was saved by a run with different rays or parameters'.format(
+                    state_path))
+    if saved is None:
+        engine = SimulationEngine(_room, source_pos=source_pos, source_spl=source_spl, directions=directions,
+                                  profiler=profiler, air_attenuation=air_attenuation, seed=seed)
+        result = BatchResult(len(directions), len(_room.face_ids), bin_width, duration, receivers, receiver_radius,
+                             min_order, grid)
+        reflections = 0
+    else:
+        engine = SimulationEngine.from_state(_room, {key[7:]: array for key, array in saved.items()
+                                                     if key.startswith('engine_')}, profiler)
+        result = BatchResult.from_arrays({key[7:]: array for key, array in saved.items()
+                                          if key.startswith('result_')})
+        reflections = int(saved['reflections'])
+    engine.observers.append(result)
+    engine.observers.extend(result.echograms)
+    if result.grid is not None:
+        engine.observers.append(result.grid)
+    recorder = None
+    if record is not None:
+        directory, part, ray_stride, first_id = record
+        recorder = TrajectoryRecorder(engine, directory, part, ray_stride, id_offset=first_id,
+                                      resume=None if saved is None else (int(saved['recorded_events']),
+                                                                         int(saved['recorded_chunks'])))
+        engine.observers.append(recorder)
+    writer = None if state is None else CheckpointWriter(state_path)
+    saved_time = time.perf_counter()
+    try:
+        while engine.particles_count and (max_reflections is None or reflections < max_reflections):
+            reflections += engine.run_reflections(1)
+            if writer is not None and time.perf_counter() - saved_time >= state_interval:
+                arrays = {'engine_' + key: array for key, array in engine.state().items()}
+                arrays.update({'result_' + key: array for key, array in result.to_arrays().items()})
+                recorded = (0, 0) if recorder is None else recorder.written()
+                writer.submit(dict(arrays, digest=np.array(digest), reflections=np.array(reflections),
+                                   recorded_events=np.array(recorded[0]), recorded_chunks=np.array(recorded[1])))
+                saved_time = time.perf_counter()
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if writer is not None:
+            writer.close()
+    if state is not None and os.path.exists(state_path):   # the shard result is merged into the run checkpoint
+        os.remove(state_path)
+    if profiler is not None:
+        result.profile = profiler.snapshot()
+    return result
+
+
+class BatchResult(EngineObserver):
+
+    def __init__(self, rays_count, faces_count, bin_width, duration, receivers=(), receiver_radius=.5, min_order=0,
+                 grid=None):
+        '''
+        Class accumulating results of traced rays: reflected energy histogram, reflections count of each face,
+        echograms of receivers and energy map of a receiver grid.
+        :param rays_count: number of traced rays
+        :param faces_count: number of room faces
+        :param bin_width: width of a single histogram time bin [s]
+        :param duration: length of the histogram [s], later reflections are not accumulated
+        :param receivers: list of receivers positions tuples
+        :param receiver_radius: radius of each receiver
+        :param min_order: minimum number of reflections of particles accumulated in echograms
+        :param grid: tuple (lower, upper, cell_size) of ReceiverGrid() arguments, no grid if None
+        '''
+        self.rays_count = rays_count
+        self.bin_width = bin_width
+        # energy reflected in each time bin for each frequency, relative to the source energy
+        self.histogram = np.zeros((int(np.ceil(duration / bin_width)), len(FREQUENCIES)))
+        self.face_hits = np.zeros(faces_count, dtype=np.int64)   # number of reflections from each face
+        self.echograms = [Echogram(receiver, receiver_radius, bin_width, duration, min_order)
+                          for receiver in receivers]
+        self.grid = None if grid is None else ReceiverGrid(*grid)
+        self.profile = None   # Profiler.snapshot() of a profiled shard, not merged with other results or exported
+
+    def particles_reflected(self, engine, indices, faces):
+        '''
+        An overridden method adding the reflected particles to the histogram and the faces reflections counts.
+        '''
+        self.face_hits += np.bincount(faces, minlength=len(self.face_hits))
+        add_to_histogram(self.histogram, self.bin_width, engine.times[indices], engine.relative_energies(indices))
+
+    def to_arrays(self):
+        '''
+        Method exporting the results, e.g. to store them in a checkpoint.
+        :return: dictionary of arrays
+        '''
+        arrays = {
+            'rays_count': np.array(self.rays_count),
+            'bin_width': np.array(self.bin_width),
+            'histogram': self.histogram,
+            'face_hits': self.face_hits,
+            'receivers': np.array([echogram.receiver_pos for echogram in self.echograms]).reshape(-1, 3),
+            'receiver_radius': np.array(self.echograms[0].radius if self.echograms else np.nan),
+            'min_order': np.array(self.echograms[0].min_order if self.echograms else 0),
+            'echograms': np.array([echogram.histogram for echogram in self.echograms]).reshape(
+                (len(self.echograms),) + self.histogram.shape),
+        }
+        if self.grid is not None:
+            arrays.update({'grid_' + key: array for key, array in self.grid.to_arrays().items()})
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''
+        Creates the results from arrays exported by to_arrays().
+        :param arrays: dictionary of arrays
+        :return: BatchResult() instance
+        '''
+        result = cls(int(arrays['rays_count']), len(arrays['face_hits']), float(arrays['bin_width']), 0,
+                     arrays['receivers'], float(arrays['receiver_radius']), int(arrays['min_order']))
+        result.histogram = arrays['histogram'].copy()
+        result.face_hits = arrays['face_hits'].copy()
+        for echogram, histogram in zip(result.echograms, arrays['echograms']):
+            echogram.histogram = histogram.copy()
+        if 'grid_energies' in arrays:
+            result.grid = ReceiverGrid.from_arrays({key[5:]: array for key, array in arrays.items()
+                                                    if key.startswith('grid_')})
+        return result
+
+    def merge(self, other):
+        '''
+        Method adding results of another shard to this one.
+        :param other: BatchResult() instance with the same bins and faces
+        '''
+        self.rays_count += other.rays_count
+        self.histogram += other.histogram
+        self.face_hits += other.face_hits
+        for echogram, other_echogram in zip(self.echograms, other.echograms):
+            echogram.merge(other_echogram)
+        if self.grid is not None:
+            self.grid.merge(other.grid)
+
+
+class BatchRunner():
+
+    def __init__(self, room, processes=None, shards_count=64):
+        '''
+        Class splitting emitted rays into shards and tracing them in a pool of processes.
+        Results depend only on the shards count, never on the processes count or the order shards finish in.
+        Each run starts its own pool, while within a `with runner:` block a single pool is kept for all runs.
+        :param room: Room() instance, sent to each worker process once or memory-mapped if loaded from a compiled room
+        :param processes: number of worker processes, all CPU cores if None, no pool at all if 1
+        :param shards_count: number of shards the rays are split into
+        '''
+        self._room = room
+        self._processes = processes
+        self._shards_count = shards_count
+        self._keep_pool = False   # whether the pool is kept between runs
+        self._pool = None   # pool kept between runs, started by the first one
+
+    def __enter__(self):
+        '''
+        Keeps the pool started by the next run for all runs until the end of the with block.
+        '''
+        self._keep_pool = True
+        return self
+
+    def __exit__(self, *exception):
+        '''
+        Stops the kept pool, if any run started it.
+        '''
+        self._keep_pool = False
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def run(self, directions, source_pos=(0, 0, 0), source_spl=80, bin_width=.001, duration=2.,
+            max_reflections=None, receivers=(), receiver_radius=.5, min_order=0, grid=None, air_attenuation=None,
+            seed=None, record_path=None, record_stride=1, checkpoint_path=None, checkpoint_interval=60., profiler=None):
+        '''
+        Method tracing all rays and merging shard results in shards order.
+        With a checkpoint path, merged results of the finished shards are saved periodically in the background,
+        together with the engine state of each shard in progress, and a run with the same rays and parameters
+        resumes from them, giving exactly the same results.
+        :param directions: array of shape (n, 3) with rays unit directions, e.g. from emitter.emit_directions()
+        :param source_pos: source position tuple
+        :param source_spl: source sound pressure level
+        :param bin_width: width of a single histogram time bin [s]
+        :param duration: length of the histogram [s]
+        :param max_reflections: maximum number of reflections of each ray, unlimited if None
+        :param receivers: list of receivers positions tuples echograms are accumulated for
+        :param receiver_radius: radius of each receiver
+        :param min_order: minimum number of reflections of particles accumulated in echograms, e.g. for hybrid runs
+                          with earlier reflections computed by simulation.image_sources
+        :param grid: tuple (lower, upper, cell_size) of receiver_grid.ReceiverGrid() arguments, no grid if None
+        :param air_attenuation: array with air attenuation [dB/m] of each frequency, e.g. from
+                                simulation.air.air_attenuation(), no air absorption if None
+        :param seed: integer seed of diffuse reflections, each shard gets its own stream derived from it,
+                     diffuse reflections are not reproducible if None
+        :param record_path: directory the emission and reflections of rays are recorded to for a replay with
+                            recording.Recording(), each shard writes its own files, no recording if None
+        :param record_stride: only every record_stride-th ray is recorded
+        :param checkpoint_path: path of the checkpoint file, no checkpoints if None
+        :param checkpoint_interval: minimum time between checkpoints [s]
+        :param profiler: Profiler() instance measurements of the shards engines are merged into as shards finish,
+                         shards are not profiled if None
+        :return: BatchResult() instance with merged results
+        '''
+        directions = np.asarray(directions, dtype=np.float64)
+        split = np.array_split(directions, self._shards_count)
+        first_ids = np.cumsum([0] + [len(shard) for shard in split])   # emission index of the first ray of each shard
+        shards = [(shard, source_pos, source_spl, bin_width, duration, max_reflections, receivers, receiver_radius,
+                   min_order, air_attenuation, None if seed is None else (seed, index),
+                   None if record_path is None else (record_path, 'shard{:05d}'.format(index), record_stride,
+                                                     int(first_ids[index])), None, profiler is not None, grid)
+                  for index, shard in enumerate(split) if len(shard)]
+        result = BatchResult(0, len(self._room.face_ids), bin_width, duration, receivers, receiver_radius, min_order,
+                             grid)
+        finished = 0   # number of shards already merged into the result
+        if checkpoint_path is not None:
+            digest = self._run_digest(shards)
+            if os.path.exists(checkpoint_path):
+                checkpoint = load_checkpoint(checkpoint_path)
+                if str(checkpoint['digest']) != digest:
+                    raise ValueError('{}: checkpoint was saved by a run with different rays or parameters'.format(
+                        checkpoint_path))
+                result, finished = BatchResult.from_arrays(checkpoint), int(checkpoint['finished_shards'])
+            # shards in progress are saved by the workers next to the checkpoint, so they resume halfway as well
+            states_directory = checkpoint_path + '.shards'
+            shards = [shard[:12] + ((os.path.join(states_directory, 'shard{:05d}.npz'.format(index)),
+                                     checkpoint_interval, digest),) + shard[13:] for index, shard in enumerate(shards)]
+            writer = CheckpointWriter(checkpoint_path)
+            saved_time = time.perf_counter()
+        if record_path is not None:   # recordings of the shards finished or saved in progress before resuming are kept
+            parts = [shard[11][1] for shard in shards]
+            kept_parts = [shard[11][1] for index, shard in enumerate(shards)
+                          if index < finished or shard[12] is not None and os.path.exists(shard[12][0])]
+            write_metadata(record_path, source_pos, source_spl, len(directions), record_stride, parts, kept_parts)
+        try:
+            with self._traced_shards(shards[finished:]) as results:
+                for shard_result in results:   # merging in shards order keeps floating point sums deterministic
+                    result.merge(shard_result)
+                    finished += 1
+                    if profiler is not None:
+                        profiler.merge(shard_result.profile)
+                        profiler.count('shards')
+                    if checkpoint_path is not None and (time.perf_counter() - saved_time >= checkpoint_interval or
+                                                        finished == len(shards)):
+                        writer.submit(dict(result.to_arrays(), digest=np.array(digest),
+                                           finished_shards=np.array(finished)))
+                        saved_time = time.perf_counter()
+        finally:
+            if checkpoint_path is not None:
+                writer.close()
+        if checkpoint_path is not None:   # states of the shards are removed with the shards merged
+            shutil.rmtree(states_directory, ignore_errors=True)
+        return result
+
+    @contextmanager
+    def _traced_shards(self, shards):
+        '''
+        Context manager tracing shards in this process, in the kept pool or in a pool stopped at the end of the block.
+        :param shards: list of _trace_shard() arguments of each shard
+        :return: iterator over results of the shards, in shards order
+        '''
+        room = self._room.compiled_path or self._room
+        if self._processes == 1:
+            _initialize_worker(self._room)
+            yield map(_trace_shard, shards)
+        elif self._keep_pool or self._pool is not None:
+            if self._pool is None:   # stopped in __exit__()
+                self._pool = Pool(self._processes, initializer=_initialize_worker, initargs=(room,))
+            yield self._pool.imap(_trace_shard, shards, chunksize=1)   # yielded in shards order
+        else:
+            with Pool(self._processes, initializer=_initialize_worker, initargs=(room,)) as pool:
+                try:
+                    yield pool.imap(_trace_shard, shards, chunksize=1)   # yielded in shards order
+                finally:
+                    pool.terminate()   # shards still traced when the run is interrupted are dropped
+                    pool.join()
+
+    def _run_digest(self, shards):
+        '''
+        Method computing digest of all rays and parameters of a run, to resume only the same run from a checkpoint.
+        :param shards: list of _trace_shard() arguments tuples
+        :return: hexadecimal digest string
+        '''
+        digest = hashlib.sha1()
+        for shard in shards:
+            digest.update(shard[0].tobytes())
+            grid = shard[-1]
+            # shard state and profiling don't change results, grid parts are added one by one
+            arguments = shard[1:-3] + (('grid',) + tuple(grid) if grid is not None else ())
+            digest.update(repr([np.asarray(argument).tolist() for argument in arguments]).encode())
+        digest.update(repr((len(shards), len(self._room.face_ids))).encode())
+        return digest.hexdigest()
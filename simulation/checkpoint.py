@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+
+'''
+Simulation checkpoint module for Ray Tracing Method 4-dimensional visualization.
+'''
+
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+CHECKPOINT_FORMAT_VERSION = 5   # has to be increased whenever checkpoint arrays change
+
+
+def save_checkpoint(path, arrays):
+    '''
+    Saves arrays as a single uncompressed .npz file, written under a temporary name and renamed,
+    so an interrupted write never replaces the previous checkpoint.
+    :param path: path of the checkpoint file
+    :param arrays: dictionary of arrays
+    '''
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix='.npz')
+    try:
+        with os.fdopen(descriptor, 'wb') as checkpoint_file:
+            np.savez(checkpoint_file, format_version=CHECKPOINT_FORMAT_VERSION, **arrays)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def load_checkpoint(path):
+    '''
+    Loads arrays saved by save_checkpoint().
+    :param path: path of the checkpoint file
+    :return: dictionary of arrays
+    '''
+    with np.load(path) as checkpoint:
+        arrays = {key: checkpoint[key] for key in checkpoint.files}
+    if arrays.pop('format_version', None) != CHECKPOINT_FORMAT_VERSION:
+        raise ValueError('{}: checkpoint format is not supported, version {} is expected'.format(
+            path, CHECKPOINT_FORMAT_VERSION))
+    return arrays
+
+
+class CheckpointWriter():
+
+    def __init__(self, path):
+        '''
+        Class saving checkpoints in a background thread, so that tracing is not stalled by disk writes.
+        Only the latest submitted checkpoint is kept, older ones waiting for the disk are dropped.
+        :param path: path of the checkpoint file
+        '''
+        self.path = path
+        self._pending = None   # arrays waiting to be written
+        self._condition = threading.Condition()
+        self._closed = False
+        self.error = None   # exception raised by the last write, if any
+        self._thread = threading.Thread(target=self._run, name='CheckpointWriter', daemon=True)
+        self._thread.start()
+
+    def submit(self, arrays):
+        '''
+        Method queueing a checkpoint, arrays are copied at once so they can be changed right after.
+        :param arrays: dictionary of arrays
+        '''
+        if self.error is not None:
+            raise self.error
+        arrays = {key: np.array(value) for key, value in arrays.items()}
+        with self._condition:
+            self._pending = arrays
+            self._condition.notify()
+
+    def close(self):
+        '''
+        Method writing the queued checkpoint, if any, and stopping the background thread.
+        '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        '''
+        Thread loop writing the latest queued checkpoint.
+        '''
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                arrays, self._pending = self._pending, None
+                if arrays is None:   # closed with nothing left to write
+                    return
+            try:
+                save_checkpoint(self.path, arrays)
+            except Exception as e:   # keeping the exception for the owner of the writer
+                self.error = e
@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+
+'''
+Receiver echogram and reverberation time module for Ray Tracing Method 4-dimensional visualization.
+'''
+
+import numpy as np
+
+from geometry.room import FREQUENCIES
+from simulation.engine import EngineObserver, SPEED_OF_SOUND
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+
+def add_to_histogram(histogram, bin_width, times, energies):
+    '''
+    Function adding energies to time bins of a histogram with a single bincount for all frequencies.
+    :param histogram: array of shape (bins count, 6) updated in place, energies after its last bin are dropped
+    :param bin_width: width of a single time bin [s]
+    :param times: array with arrival times [s]
+    :param energies: array of shape (n, 6) with arriving energies
+    '''
+    bins = (times / bin_width).astype(int)
+    inside = bins < len(histogram)
+    cells = bins[inside, None] * histogram.shape[1] + np.arange(histogram.shape[1])
+    histogram += np.bincount(cells.ravel(), energies[inside].ravel(), minlength=histogram.size).reshape(
+        histogram.shape)
+
+
+class Echogram(EngineObserver):
+
+    def __init__(self, receiver_pos, radius=.5, bin_width=.001, duration=2., min_order=0):
+        '''
+        Class accumulating energy of particles crossing a spherical receiver in time bins of each frequency.
+        Each crossing adds particle energy relative to the source, weighted by the chord length inside the receiver
+        divided by the receiver volume, at the time the particle enters the receiver.
+        :param receiver_pos: receiver center position tuple
+        :param radius: receiver radius
+        :param bin_width: width of a single time bin [s]
+        :param duration: length of the echogram [s]
+        :param min_order: minimum number of reflections of accumulated particles, e.g. when earlier reflections
+                          come from image sources, diffusely reflected particles are accumulated regardless
+        '''
+        self.receiver_pos = np.asarray(receiver_pos, dtype=np.float64)
+        self.radius = radius
+        self.bin_width = bin_width
+        self.min_order = min_order
+        self.histogram = np.zeros((int(np.ceil(duration / bin_width)), len(FREQUENCIES)))
+
+    def particles_moving(self, engine, indices, distances):
+        '''
+        An overridden method adding energy of the particles segments crossing the receiver.
+        '''
+        if self.min_order:
+            ordered = (engine.reflections[indices] >= self.min_order) | engine.scattered[indices]
+            indices, distances = indices[ordered], distances[ordered]
+        offsets = self.receiver_pos - engine.positions[indices]
+        normals = engine.normals[indices]
+        closest = np.einsum('ij,ij->i', offsets, normals)   # distance along the segment closest to the receiver
+        half_chords = self.radius ** 2 - (np.einsum('ij,ij->i', offsets, offsets) - closest ** 2)
+        crossing = half_chords > 0
+        half_chords = np.sqrt(half_chords[crossing])
+        entries = np.maximum(closest[crossing] - half_chords, 0)
+        chords = np.minimum(closest[crossing] + half_chords, distances[crossing]) - entries
+        crossing[crossing] = chords > 0
+        if not crossing.any():
+            return
+        chords, entries = chords[chords > 0], entries[chords > 0]
+        indices = indices[crossing]
+        weights = chords / (4 / 3 * np.pi * self.radius ** 3)
+        energies = engine.relative_energies(indices, entries + chords * .5) * weights[:, None]
+        add_to_histogram(self.histogram, self.bin_width, engine.times[indices] + entries / SPEED_OF_SOUND, energies)
+
+    def merge(self, other):
+        '''
+        Method adding energies of another echogram of the same receiver, e.g. from another shard of rays.
+        :param other: Echogram() instance with the same bins
+        '''
+        self.histogram += other.histogram
+
+    def decay_curves(self):
+        '''
+        Method computing Schroeder backward integration of the echogram.
+        :return: array of shape (bins count, 6) with decay levels in dB relative to the total energy
+        '''
+        remaining = np.cumsum(self.histogram[::-1], axis=0)[::-1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return 10 * np.log10(remaining / remaining[0])
+
+    def reverberation_times(self, start=-5, end=-35):
+        '''
+        Method estimating reverberation time by a linear fit of the decay curve between two levels, extrapolated
+        to a 60dB decay, e.g. T20 for levels -5 and -25 dB and T30 for -5 and -35 dB.
+        :param start: decay level the fit starts at [dB]
+        :param end: decay level the fit ends at [dB]
+        :return: array with reverberation time of each of 6 frequencies [s], nan if the curve doesn't decay enough
+        '''
+        curves = self.decay_curves()
+        times = (np.arange(len(curves)) + .5) * self.bin_width   # bins centers
+        reverberation_times = np.full(len(FREQUENCIES), np.nan)
+        for band in range(len(FREQUENCIES)):
+            curve = curves[:, band]
+            if not curve[-1] < end:   # the decay curve never reaches the end level
+                continue
+            fitted = (curve <= start) & (curve >= end)
+            if fitted.sum() < 2:
+                continue
+            slope = np.polyfit(times[fitted], curve[fitted], 1)[0]
+            reverberation_times[band] = -60 / slope
+        return reverberation_times
+
+    def t20(self):
+        '''
+        Method estimating T20 reverberation time of each of 6 frequencies [s].
+        '''
+        return self.reverberation_times(-5, -25)
+
+    def t30(self):
+        '''
+        Method estimating T30 reverberation time of each of 6 frequencies [s].
+        '''
+        return self.reverberation_times(-5, -35)
+
+    def rt60(self):
+        '''
+        Method estimating RT60 reverberation time of each of 6 frequencies [s], T30 where the decay curve reaches
+        -35 dB and T20 otherwise.
+        '''
+        t30 = self.t30()
+        return np.where(np.isnan(t30), self.t20(), t30)
@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+
+'''
+Sound source emitter module for Ray Tracing Method 4-dimensional visualization.
+'''
+
+import numpy as np
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+DEFAULT_RAYS_COUNT = 225   # number of rays emitted when it is not specified
+GOLDEN_ANGLE = np.pi * (3 - np.sqrt(5))   # azimuth increment of consecutive Fibonacci lattice points [rad]
+# relative pressure of directional sources as function of the cosine of the angle to the source axis
+PATTERNS = {
+    'omnidirectional': lambda cosine: np.ones_like(cosine),
+    'cardioid': lambda cosine: .5 + .5 * cosine,
+    'supercardioid': lambda cosine: .37 + .63 * cosine,
+    'hypercardioid': lambda cosine: .25 + .75 * cosine,
+    'figure-eight': lambda cosine: cosine,
+}
+
+
+def _check_rays_count(rays_count):
+    '''
+    Function validating number of rays to emit.
+    :param rays_count: number of rays
+    '''
+    if rays_count < 1:
+        raise ValueError('number of rays has to be positive, got {}'.format(rays_count))
+
+
+def _spherical_directions(cosines, azimuths):
+    '''
+    Function converting spherical coordinates to unit direction vectors, the polar axis is the Y axis.
+    :param cosines: array with cosines of polar angles
+    :param azimuths: array with azimuths [rad]
+    :return: array of shape (n, 3) with unit directions
+    '''
+    sines = np.sqrt(np.clip(1 - cosines ** 2, 0, None))
+    return np.stack((sines * np.cos(azimuths), cosines, sines * np.sin(azimuths)), axis=1)
+
+
+def fibonacci_directions(rays_count=DEFAULT_RAYS_COUNT):
+    '''
+    Function computing directions of rays on a Fibonacci sphere lattice, each ray covers the same solid angle
+    and no two rays coincide, unlike on latitude/longitude rings.
+    :param rays_count: number of rays
+    :return: array of shape (rays_count, 3) with unit directions
+    '''
+    _check_rays_count(rays_count)
+    indices = np.arange(rays_count)
+    return _spherical_directions(1 - 2 * (indices + .5) / rays_count, GOLDEN_ANGLE * indices)
+
+
+def stratified_directions(rays_count=DEFAULT_RAYS_COUNT, seed=None):
+    '''
+    Function computing random directions of rays, one in each of rays_count cells of equal solid angle.
+    Cells are laid out in bands of polar angle cosine, sized so that cells are roughly square.
+    :param rays_count: number of rays
+    :param seed: seed of the random generator, directions differ on each call if None
+    :return: array of shape (rays_count, 3) with unit directions
+    '''
+    _check_rays_count(rays_count)
+    random = np.random.default_rng(seed)
+    bands_count = max(1, int(round(np.sqrt(rays_count / np.pi))))
+    counts = np.full(bands_count, rays_count // bands_count)   # cells of each band
+    counts[:rays_count % bands_count] += 1
+    edges = -1 + 2 * np.concatenate(([0], np.cumsum(counts))) / rays_count   # band heights proportional to counts
+    bands = np.repeat(np.arange(bands_count), counts)
+    cells = np.arange(rays_count) - np.repeat(np.cumsum(counts) - counts, counts)   # cell index within its band
+    cosines = edges[bands] + (edges[bands + 1] - edges[bands]) * random.random(rays_count)
+    azimuths = 2 * np.pi * (cells + random.random(rays_count)) / counts[bands]
+    return _spherical_directions(cosines, azimuths)
+
+
+def directional_directions(rays_count=DEFAULT_RAYS_COUNT, axis=(1, 0, 0), pattern='cardioid'):
+    '''
+    Function computing directions of rays of a directional source, with density proportional to the radiated power.
+    A Fibonacci lattice is warped along the source axis, so all rays still carry the same energy.
+    :param rays_count: number of rays
+    :param axis: direction tuple the source points to
+    :param pattern: one of PATTERNS names or function of the cosine of the angle to the axis returning pressure
+    :return: array of shape (rays_count, 3) with unit directions
+    '''
+    _check_rays_count(rays_count)
+    if not callable(pattern):
+        if pattern not in PATTERNS:
+            raise ValueError('unknown directivity pattern {}, expected one of {}'.format(pattern, ', '.join(PATTERNS)))
+        pattern = PATTERNS[pattern]
+    axis = np.asarray(axis, dtype=np.float64)
+    axis /= np.linalg.norm(axis)
+    # cumulative radiated power over the cosine of the angle to the axis, which is uniform in solid angle
+    grid = np.linspace(-1, 1, 4097)
+    power = pattern(grid) ** 2
+    cumulative = np.concatenate(([0], np.cumsum((power[1:] + power[:-1]) * .5)))
+    if cumulative[-1] <= 0:
+        raise ValueError('directivity pattern radiates no power')
+    indices = np.arange(rays_count)
+    cosines = np.interp((rays_count - indices - .5) / rays_count * cumulative[-1], cumulative, grid)
+    directions = _spherical_directions(cosines, GOLDEN_ANGLE * indices)
+    # rotating the Y polar axis onto the source axis with an orthonormal basis around it
+    helper = np.array([0., 1., 0.]) if abs(axis[1]) < .9 else np.array([1., 0., 0.])
+    tangent = np.cross(helper, axis)
+    tangent /= np.linalg.norm(tangent)
+    bitangent = np.cross(axis, tangent)
+    return directions[:, [0]] * tangent + directions[:, [1]] * axis + directions[:, [2]] * bitangent
+
+
+EMITTERS = {   # emission methods by name, each takes rays count as the first argument
+    'fibonacci': fibonacci_directions,
+    'stratified': stratified_directions,
+    'directional': directional_directions,
+}
+
+
+def emit_directions(rays_count=DEFAULT_RAYS_COUNT, method='fibonacci', **options):
+    '''
+    Function computing directions of rays with one of EMITTERS.
+    :param rays_count: number of rays
+    :param method: one of EMITTERS names
+    :param options: keyword arguments of the emission method, e.g. seed or pattern
+    :return: array of shape (rays_count, 3) with unit directions
+    '''
+    if method not in EMITTERS:
+        raise ValueError('unknown emission method {}, expected one of {}'.format(method, ', '.join(EMITTERS)))
+    return EMITTERS[method](rays_count, **options)
+
+
+def lambertian_directions(normals, rng):
+    '''
+    Function drawing diffusely reflected directions, cosine-weighted around each face normal (Lambert's law).
+    :param normals: array of shape (n, 3) with unit normals of faces pointing to the side the rays leave to
+    :param rng: numpy.random.Generator() instance
+    :return: array of shape (n, 3) with unit directions
+    '''
+    samples = rng.random((len(normals), 2))
+    directions = _spherical_directions(np.sqrt(samples[:, 0]), 2 * np.pi * samples[:, 1])
+    # orthonormal basis around each normal, with a helper axis far enough from it
+    helpers = np.zeros_like(normals)
+    helpers[np.arange(len(normals)), (np.abs(normals[:, 0]) > .9).astype(int)] = 1
+    tangents = np.cross(helpers, normals)
+    tangents /= np.linalg.norm(tangents, axis=1)[:, None]
+    bitangents = np.cross(normals, tangents)
+    return directions[:, [0]] * tangents + directions[:, [1]] * normals + directions[:, [2]] * bitangents
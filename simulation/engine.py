@@ -0,0 +1,427 @@
+#!/usr/bin/python3
+
+'''
+Headless particle simulation engine module for Ray Tracing Method 4-dimensional visualization.
+'''
+
+import json
+
+import numpy as np
+
+from geometry.room import FREQUENCIES
+from simulation.emitter import fibonacci_directions, lambertian_directions
+from simulation.events import ReflectionEvents
+from simulation.particles import ParticleStore
+from simulation.profiler import Profiler
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+SPEED_OF_SOUND = 343   # speed of sound in the air [m/s]
+ENGINE_VERSION = 1   # has to be increased whenever traced results change, e.g. invalidating cached sweep results
+
+
+class EngineObserver():
+    '''
+    Base class of objects notified by SimulationEngine about particles moves and reflections, e.g. to sum results.
+    '''
+
+    def particles_moving(self, engine, indices, distances):
+        '''
+        Called before particles move along straight segments, their positions and times are segments beginnings.
+        :param engine: SimulationEngine() instance
+        :param indices: indices of the moving particles in engine arrays
+        :param distances: array with segments lengths
+        '''
+        pass
+
+    def particles_reflected(self, engine, indices, faces):
+        '''
+        Called after particles reflected, their positions are reflection points, normals are already reflected
+        and their next reflections are already found.
+        :param engine: SimulationEngine() instance
+        :param indices: indices of the reflected particles in engine arrays
+        :param faces: array with indices of faces the particles reflected from
+        '''
+        pass
+
+
+class EventsRecorder(EngineObserver):
+
+    def __init__(self, engine):
+        '''
+        Class storing the emission and every reflection of the engine particles as chunks of events.
+        :param engine: SimulationEngine() instance, its current particles are stored as emission events
+        '''
+        self.chunks = []
+        self.particles_reflected(engine, np.arange(engine.particles_count), np.full(engine.particles_count, -1))
+
+    def particles_reflected(self, engine, indices, faces):
+        '''
+        An overridden method storing the reflected particles as a new chunk of events.
+        '''
+        self.chunks.append((engine.ids[indices], engine.times[indices], engine.next_event_times(indices),
+                            engine.positions[indices], engine.normals[indices], faces, engine.energies[indices]))
+
+
+def _scattering_tables(room):
+    '''
+    Function computing per face tables of diffuse reflections. A reflecting particle carries all frequencies, so it
+    reflects diffusely with probability of the mean scattering coefficient of the face, and energies of each
+    frequency are corrected, so that their expected diffuse and specular parts are s and 1 - s of the reflected ones.
+    :param room: Room() instance
+    :return: tuple of arrays (probabilities, specular levels, diffuse levels) with probability of a diffuse reflection
+             and levels [dB] added to energies of each frequency on a specular and diffuse reflection from each face,
+             None if all faces reflect specularly
+    '''
+    scattering = room.face_scattering
+    if not scattering.any():
+        return None
+    probabilities = scattering.mean(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):   # levels of impossible choices are never used
+        specular_levels = 10 * np.log10((1 - scattering) / (1 - probabilities[:, None]))
+        diffuse_levels = 10 * np.log10(scattering / probabilities[:, None])
+    return probabilities, specular_levels, diffuse_levels
+
+
+class SimulationEngine():
+
+    def __init__(self, room, source_pos=(0, 0, 0), source_spl=80, directions=None, radius=.5,
+                 step_length=.1, profiler=None, air_attenuation=None, seed=None):
+        '''
+        Class simulating sound waves represented by particles, without any dependency on Qt or OpenGL.
+        Particles are stored in a ParticleStore() allocated once and advanced in place with vectorized steps.
+        Ray paths do not depend on frequency, so each particle carries energies of all 6 frequencies at once.
+        Air absorption of the path travelled since the previous reflection is subtracted in bulk at each reflection,
+        the part pending on the current segment is given by relative_energies().
+        Faces with scattering coefficients reflect particles either specularly or diffusely, chosen at random.
+        :param room: Room() instance the particles are reflected in
+        :param source_pos: source position tuple
+        :param source_spl: source sound pressure level
+        :param directions: array of shape (n, 3) with particles unit directions, Fibonacci sphere lattice if not specified
+        :param radius: radius of starting sphere
+        :param step_length: distance each particle travels in a single step
+        :param profiler: Profiler() instance measuring engine stages, a disabled one if not specified
+        :param air_attenuation: array with air attenuation [dB/m] of each frequency, e.g. from
+                                simulation.air.air_attenuation(), no air absorption if None
+        :param seed: seed of the random generator of diffuse reflections, anything numpy.random.default_rng() accepts
+        '''
+        self._room = room
+        self.profiler = Profiler() if profiler is None else profiler
+        self.source_pos = np.asarray(source_pos, dtype=np.float64)
+        self.source_spl = source_spl
+        self.step_length = step_length
+        self.steps = 0   # number of steps already simulated
+        self.air_attenuation = np.zeros(len(FREQUENCIES)) if air_attenuation is None else np.array(
+            air_attenuation, dtype=np.float64)
+        self._rng = np.random.default_rng(seed)
+        self._scattering = _scattering_tables(room)
+        if directions is None:
+            directions = fibonacci_directions()
+        directions = np.asarray(directions)
+        self._particles = ParticleStore(len(directions), len(FREQUENCIES))
+        self.normals[:] = directions   # copied, as particles directions change
+        # distance left to the next wall along the particle normal, with the face and face normal found there
+        self._hit_faces[:], self._hit_distances[:], self._hit_normals[:] = self._room.intersect(
+            np.tile(self.source_pos, (len(self.normals), 1)), self.normals)
+        # particles start on the starting sphere, or on a wall closer to the source than its radius
+        starts = np.minimum(self._hit_distances, radius)
+        self.positions[:] = self.source_pos + self.normals * starts[:, None]
+        self.energies[:] = source_spl   # one column for each of geometry.room.FREQUENCIES
+        self.times[:] = starts / SPEED_OF_SOUND
+        self.path_lengths[:] = starts   # air absorption is counted from the source center, like by image sources
+        self._hit_distances[:] -= starts
+        self._lengths = np.empty(len(directions))   # buffer of distances particles travel in a single step
+        self.observers = []   # EngineObserver() instances notified about moves and reflections
+        self._remove_dead_particles()
+
+    def state(self):
+        '''
+        Method exporting the whole simulation state, so that it can be resumed bit for bit with from_state().
+        :return: dictionary of arrays with particles arrays and simulation parameters
+        '''
+        state = self._particles.to_arrays()
+        state.update(source_pos=self.source_pos.copy(), source_spl=np.array(self.source_spl),
+                     step_length=np.array(self.step_length), steps=np.array(self.steps),
+                     air_attenuation=self.air_attenuation.copy(),
+                     rng_state=np.array(json.dumps(self._rng.bit_generator.state)))
+        return state
+
+    @classmethod
+    def from_state(cls, room, state, profiler=None):
+        '''
+        Creates the engine from a state exported by state(), e.g. loaded from a checkpoint.
+        :param room: Room() instance the state was simulated in
+        :param state: dictionary of arrays with particles arrays and simulation parameters
+        :param profiler: Profiler() instance measuring engine stages, a disabled one if not specified
+        :return: SimulationEngine() instance
+        '''
+        engine = cls.__new__(cls)
+        engine._room = room
+        engine.profiler = Profiler() if profiler is None else profiler
+        engine.source_pos = np.array(state['source_pos'], dtype=np.float64)
+        engine.source_spl = state['source_spl'].item()
+        engine.step_length = state['step_length'].item()
+        engine.steps = int(state['steps'])
+        engine.air_attenuation = np.array(state['air_attenuation'], dtype=np.float64)
+        engine._rng = np.random.default_rng()
+        engine._rng.bit_generator.state = json.loads(str(state['rng_state']))
+        engine._scattering = _scattering_tables(room)
+        engine._particles = ParticleStore.from_arrays(state)
+        engine._lengths = np.empty(engine.particles_count)
+        engine.observers = []
+        return engine
+
+    @property
+    def particles_count(self):
+        '''
+        Number of particles still alive.
+        '''
+        return self._particles.count
+
+    @property
+    def normals(self):
+        '''
+        Array of shape (n, 3) with alive particles unit direction vectors.
+        '''
+        return self._particles.normals
+
+    @property
+    def positions(self):
+        '''
+        Array of shape (n, 3) with alive particles current positions.
+        '''
+        return self._particles.positions
+
+    @property
+    def energies(self):
+        '''
+        Float32 array of shape (n, 6) with alive particles energies in dB, one column for each frequency.
+        '''
+        return self._particles.energies
+
+    @property
+    def times(self):
+        '''
+        Array with alive particles times of flight [s].
+        '''
+        return self._particles.times
+
+    @property
+    def scattered(self):
+        '''
+        Array with flags of alive particles reflected diffusely at least once, i.e. not following image sources.
+        '''
+        return self._particles.scattered
+
+    @property
+    def path_lengths(self):
+        '''
+        Array with distances alive particles travelled from the source center.
+        '''
+        return self._particles.path_lengths
+
+    @property
+    def air_lengths(self):
+        '''
+        Array with parts of alive particles path lengths their energies are already reduced by air absorption for.
+        '''
+        return self._particles.air_lengths
+
+    @property
+    def ids(self):
+        '''
+        Array with alive particles emission indices, kept when other particles are removed.
+        '''
+        return self._particles.ids
+
+    @property
+    def reflections(self):
+        '''
+        Array with numbers of reflections of alive particles so far, i.e. their reflection orders.
+        '''
+        return self._particles.reflections
+
+    @property
+    def _hit_faces(self):
+        return self._particles.hit_faces
+
+    @property
+    def _hit_normals(self):
+        return self._particles.hit_normals
+
+    @property
+    def _hit_distances(self):
+        return self._particles.hit_distances
+
+    def relative_energies(self, indices, offsets=0):
+        '''
+        Method computing energies of particles relative to the source energy, including air absorption of the path
+        travelled since their last reflection, which is not subtracted from energies yet.
+        :param indices: indices of the particles
+        :param offsets: distances further along the particles normals the energies are computed at, e.g. where moving
+                        particles enter a receiver
+        :return: array of shape (n, 6) with energies of each frequency, 1 for the source energy
+        '''
+        pending = self.path_lengths[indices] - self.air_lengths[indices] + offsets
+        return 10 ** ((self.energies[indices] - self.source_spl - pending[:, None] * self.air_attenuation) * .1)
+
+    def next_event_times(self, indices):
+        '''
+        Method computing times particles reach their next reflection, or their current times for particles dying
+        on the current event, i.e. too quiet or leaving room geometry.
+        :param indices: indices of the particles
+        :return: array with times [s]
+        '''
+        times = self.times[indices]
+        distances = self._hit_distances[indices]
+        alive = (self.energies[indices].max(axis=1) >= self.source_spl - 60) & np.isfinite(distances)
+        return np.where(alive, times + np.where(alive, distances, 0) / SPEED_OF_SOUND, times)
+
+    def step(self):
+        '''
+        Advances the simulation by a single step, moving particles forward and reflecting them on room faces.
+        '''
+        with self.profiler.stage('step'):
+            lengths = self._lengths[:self.particles_count]
+            lengths.fill(self.step_length)
+            self._move_particles(lengths)
+        self.steps += 1
+        self.profiler.count('steps')
+
+    def run(self, max_steps=None):
+        '''
+        Advances the simulation until all particles die out or the steps limit is reached.
+        :param max_steps: maximum number of steps to simulate, unlimited if None
+        :return: number of steps simulated
+        '''
+        steps = 0
+        while self.particles_count and (max_steps is None or steps < max_steps):
+            self.step()
+            steps += 1
+        return steps
+
+    def run_reflections(self, max_reflections=None):
+        '''
+        Advances the simulation by jumping each particle straight to its next reflection point,
+        until all particles die out or the reflections limit is reached.
+        :param max_reflections: maximum number of reflections of each particle, unlimited if None
+        :return: number of reflections simulated
+        '''
+        reflections = 0
+        while self.particles_count and (max_reflections is None or reflections < max_reflections):
+            with self.profiler.stage('reflection_pass'):
+                self._move_particles(self._hit_distances.copy())
+            reflections += 1
+        return reflections
+
+    def run_events(self, max_reflections=None):
+        '''
+        Advances the simulation like run_reflections() and records the particles on the way.
+        :param max_reflections: maximum number of reflections of each particle, unlimited if None
+        :return: ReflectionEvents() instance with the emission and all reflections ordered by time
+        '''
+        recorder = EventsRecorder(self)
+        self.observers.append(recorder)
+        try:
+            self.run_reflections(max_reflections)
+        finally:
+            self.observers.remove(recorder)
+        return ReflectionEvents(recorder.chunks, SPEED_OF_SOUND)
+
+    def _move_particles(self, lengths):
+        '''
+        Moves particles forward along their normals, reflecting them on each face they reach on the way.
+        :param lengths: array with distance each particle has to travel, it is modified in place
+        '''
+        reflecting = self._hit_distances <= lengths
+        distances = np.minimum(lengths, self._hit_distances)
+        self._advance_particles(self._particles.indices, distances)   # moving all particles at most to the next face
+        lengths -= distances
+        while reflecting.any():   # particles may reflect more than once within a single step, e.g. in corners
+            indices = np.flatnonzero(reflecting)
+            self._reflect_particles(indices)
+            reflecting[indices] = self._hit_distances[indices] <= lengths[indices]
+            rest = indices[~reflecting[indices]]
+            self._advance_particles(rest, lengths[rest])   # travelling the remaining distance
+            indices = indices[reflecting[indices]]
+            distances = self._hit_distances[indices]
+            self._advance_particles(indices, distances)   # moving to the next reflection point
+            lengths[indices] -= distances
+        self._remove_dead_particles()
+
+    def _remove_dead_particles(self):
+        '''
+        Removes the particles 60dB below the source in all frequencies and the ones leaving room geometry.
+        '''
+        with self.profiler.stage('compact'):
+            alive = (self.energies.max(axis=1) >= self.source_spl - 60) & np.isfinite(self._hit_distances)
+            if not alive.all():
+                # swap-remove, so only the dead particles rows are overwritten
+                self.profiler.count('removed', self._particles.compact(alive))
+        self.profiler.set_gauge('particles', self.particles_count)
+
+    def _advance_particles(self, indices, distances):
+        '''
+        Moves particles forward along their normals without any reflection checks.
+        :param indices: indices of the moving particles
+        :param distances: array with distance each particle travels
+        '''
+        with self.profiler.stage('observers'):
+            for observer in self.observers:
+                observer.particles_moving(self, indices, distances)
+        with self.profiler.stage('advance'):
+            self._update_positions(indices, distances)
+
+    def _update_positions(self, indices, distances):
+        '''
+        Updates positions, times and distances to the next face of moving particles.
+        :param indices: indices of the moving particles
+        :param distances: array with distance each particle travels
+        '''
+        if len(indices) == self.particles_count:   # all particles, updated in place without temporary arrays
+            np.add(self.positions, np.multiply(self.normals, distances[:, None], out=self._particles.products),
+                   out=self.positions)
+            np.add(self.times, distances / SPEED_OF_SOUND, out=self.times)
+            np.add(self.path_lengths, distances, out=self.path_lengths)
+            np.subtract(self._hit_distances, distances, out=self._hit_distances)
+        else:
+            self.positions[indices] += self.normals[indices] * distances[:, None]
+            self.times[indices] += distances / SPEED_OF_SOUND
+            self.path_lengths[indices] += distances
+            self._hit_distances[indices] -= distances
+
+    def _reflect_particles(self, indices):
+        '''
+        Reflects particles placed on a face specularly or diffusely, reduces their energies and finds their next
+        reflection point.
+        :param indices: indices of the reflecting particles
+        '''
+        with self.profiler.stage('reflect'):
+            normals = self.normals[indices]
+            hit_normals = self._hit_normals[indices]
+            normals -= 2 * np.einsum('ij,ij->i', normals, hit_normals)[:, None] * hit_normals   # reflecting them
+            faces = self._hit_faces[indices]
+            path_lengths = self.path_lengths[indices]
+            # reducing energies by faces levels and by air absorption of the path since the previous reflection
+            levels = self._room.reflection_levels[faces] - (
+                path_lengths - self.air_lengths[indices])[:, None] * self.air_attenuation
+            if self._scattering is not None:   # a single draw for all reflecting particles
+                probabilities, specular_levels, diffuse_levels = self._scattering
+                diffuse = self._rng.random(len(indices)) < probabilities[faces]
+                levels += np.where(diffuse[:, None], diffuse_levels[faces], specular_levels[faces])
+                normals[diffuse] = lambertian_directions(hit_normals[diffuse], self._rng)
+                self.scattered[indices[diffuse]] = True
+                self.profiler.count('diffuse_reflections', int(np.count_nonzero(diffuse)))
+            self.normals[indices] = normals
+            self.energies[indices] += levels
+            self.air_lengths[indices] = path_lengths
+            self.reflections[indices] += 1
+        self.profiler.count('reflections', len(indices))
+        with self.profiler.stage('intersect'):
+            hits = self._room.intersect(self.positions[indices], normals)
+            self._hit_faces[indices], self._hit_distances[indices], self._hit_normals[indices] = hits
+        with self.profiler.stage('observers'):
+            for observer in self.observers:
+                observer.particles_reflected(self, indices, faces)
@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+
+'''
+Reflection events module for Ray Tracing Method 4-dimensional visualization.
+'''
+
+import numpy as np
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+
+class ReflectionEvents():
+
+    def __init__(self, chunks, speed_of_sound):
+        '''
+        Class storing particles reflection events ordered by time, produced by SimulationEngine.run_events().
+        Each event starts a straight segment of a particle, which ends at its next event, or at the end time
+        of the event if the particle dies or the simulation stops.
+        :param chunks: list of tuples (particles, times, ends, positions, normals, faces, energies) with events arrays
+        :param speed_of_sound: speed of sound in the air [m/s]
+        '''
+        self.speed_of_sound = speed_of_sound
+        if chunks:
+            columns = [np.concatenate(column) for column in zip(*chunks)]
+        else:
+            columns = [np.empty(0, dtype=int), np.empty(0), np.empty(0), np.empty((0, 3)), np.empty((0, 3)),
+                       np.empty(0, dtype=int), np.empty((0, 6))]
+        order = np.argsort(columns[1], kind='stable')   # ordering events by time
+        self.particles, self.times, self.ends, self.positions, self.normals, self.faces, self.energies = (
+            column[order] for column in columns)
+
+    def __len__(self):
+        '''
+        Number of stored events.
+        '''
+        return len(self.times)
+
+    def positions_at(self, time):
+        '''
+        Method interpolating positions of particles alive at the given time along their segments.
+        :param time: time since the emission [s]
+        :return: tuple of arrays (particles, positions, energies) of the particles alive at the given time,
+                 energies have a column for each of 6 frequencies, all of them are empty before the emission
+        '''
+        started = np.searchsorted(self.times, time, side='right')   # events that already happened
+        indices = np.flatnonzero(self.ends[:started] > time)   # segments still flown, one per alive particle
+        flight = (time - self.times[indices]) * self.speed_of_sound   # distance travelled since the last event
+        positions = self.positions[indices] + self.normals[indices] * flight[:, None]
+        return self.particles[indices], positions, self.energies[indices]
@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+
+'''
+Image source method module for Ray Tracing Method 4-dimensional visualization, exact early specular reflections.
+'''
+
+import numpy as np
+
+from geometry.room import BOUNDARIES, FREQUENCIES
+from simulation.echogram import add_to_histogram
+from simulation.engine import SPEED_OF_SOUND
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+
+class ImageSources():
+
+    def __init__(self, room, source_pos=(0, 0, 0), max_order=3, max_distance=np.inf, air_attenuation=None):
+        '''
+        Class mirroring the source in room faces planes up to a reflection order, independently of receivers.
+        Images which can't produce a valid path are pruned: mirrored in the same face twice in a row, mirrored
+        in a plane they lie on, or farther from the room bounding box than max_distance, as all paths through them
+        are longer than that. Remaining images are checked for each receiver by arrivals().
+        Images carry only the specular part of reflected energies, the diffuse one is left to traced rays.
+        :param room: Room() instance
+        :param source_pos: source position tuple
+        :param max_order: maximum number of reflections
+        :param max_distance: maximum path length, e.g. speed of sound multiplied by echogram duration
+        :param air_attenuation: array with air attenuation [dB/m] of each frequency, e.g. from
+                                simulation.air.air_attenuation(), no air absorption if None
+        '''
+        self._room = room
+        self.source_pos = np.asarray(source_pos, dtype=np.float64)
+        self.max_order = max_order
+        self.air_attenuation = np.zeros(len(FREQUENCIES)) if air_attenuation is None else np.array(
+            air_attenuation, dtype=np.float64)
+        arrays = room.to_arrays()
+        point_ids = arrays['point_ids']
+        order = np.argsort(point_ids, kind='stable')
+        # the first point of each face, giving the face plane together with its normal
+        first_points = arrays['points'][order[np.searchsorted(
+            point_ids, arrays['face_points'][arrays['face_offsets'][:-1]], sorter=order)]]
+        self._normals = room.face_normals
+        self._offsets = np.einsum('ij,ij->i', self._normals, first_points)   # planes are normal . x = offset
+        lower = np.array([room.boundaries[key] for key in BOUNDARIES[::2]])
+        upper = np.array([room.boundaries[key] for key in BOUNDARIES[1::2]])
+        # images of each order as tuple of arrays (positions, parent images indices, faces, reflection levels [dB])
+        self.orders = [(self.source_pos[None], np.array([-1]), np.array([-1]), np.zeros((1, len(FREQUENCIES))))]
+        faces_range = np.arange(len(self._offsets))
+        with np.errstate(divide='ignore'):
+            reflection_levels = room.reflection_levels + 10 * np.log10(1 - room.face_scattering)
+        for _ in range(max_order):
+            positions, _, faces, levels = self.orders[-1]
+            distances = positions @ self._normals.T - self._offsets   # signed distance of each image to each plane
+            parents, children_faces = np.nonzero((np.abs(distances) > 1e-9) & (faces[:, None] != faces_range))
+            offsets = distances[parents, children_faces][:, None] * self._normals[children_faces]
+            children = positions[parents] - 2 * offsets   # mirroring the parents in the faces planes
+            outside = np.maximum(np.maximum(lower - children, children - upper), 0)
+            kept = np.einsum('ij,ij->i', outside, outside) <= max_distance ** 2
+            parents, children_faces, children = parents[kept], children_faces[kept], children[kept]
+            self.orders.append((children, parents, children_faces,
+                                levels[parents] + reflection_levels[children_faces]))
+
+    @property
+    def count(self):
+        '''
+        Number of images of all orders, including the source itself.
+        '''
+        return sum(len(positions) for positions, _, _, _ in self.orders)
+
+    def arrivals(self, receiver_pos):
+        '''
+        Method finding valid reflection paths from the source to a receiver, each path is traced back from the receiver
+        through the images and has to hit exactly the faces the images were mirrored in, without any obstruction.
+        :param receiver_pos: receiver position tuple
+        :return: tuple of arrays (orders, times, energies) with reflection order and arrival time [s] of each path
+                 and its energies of each of 6 frequencies, relative to the source power, per square meter
+        '''
+        receiver_pos = np.asarray(receiver_pos, dtype=np.float64)
+        orders, lengths, levels = [], [], []
+        for order, (positions, _, _, image_levels) in enumerate(self.orders):
+            valid = np.ones(len(positions), dtype=bool)
+            images = np.arange(len(positions))   # image of the current order of each path
+            points = np.tile(receiver_pos, (len(positions), 1))   # current point of each path traced back
+            for level in range(order, 0, -1):
+                level_positions, parents, faces, _ = self.orders[level]
+                faces, points, hits = self._trace(points, level_positions[images], faces[images])
+                valid &= hits
+                images = parents[images]
+            _, _, visible = self._trace(points, np.tile(self.source_pos, (len(positions), 1)), None)
+            valid &= visible
+            orders.append(np.full(valid.sum(), order))
+            lengths.append(np.linalg.norm(positions[valid] - receiver_pos, axis=1))
+            levels.append(image_levels[valid])
+        orders, lengths, levels = np.concatenate(orders), np.concatenate(lengths), np.concatenate(levels)
+        levels -= lengths[:, None] * self.air_attenuation   # air absorption along the whole path
+        with np.errstate(divide='ignore'):
+            energies = 10 ** (levels * .1) / (4 * np.pi * lengths[:, None] ** 2)
+        return orders, lengths / SPEED_OF_SOUND, energies
+
+    def add_to(self, echogram, weight=1.):
+        '''
+        Method adding arrivals of all valid paths to an echogram, e.g. to build a hybrid echogram with rays traced
+        only for higher orders (Echogram(min_order=max_order + 1)).
+        :param echogram: Echogram() instance
+        :param weight: factor of added energies, the number of rays for echograms accumulated from traced rays
+        '''
+        _, times, energies = self.arrivals(echogram.receiver_pos)
+        add_to_histogram(echogram.histogram, echogram.bin_width, times, energies * weight)
+
+    def _trace(self, origins, targets, faces):
+        '''
+        Method checking segments from origins towards targets, they have to hit the given faces before reaching
+        the targets, or nothing if faces is None.
+        :param origins: array of shape (n, 3) with segments beginnings
+        :param targets: array of shape (n, 3) with segments ends
+        :param faces: array with indices of faces the segments have to hit, or None
+        :return: tuple of arrays (faces, hit points, valid)
+        '''
+        directions = targets - origins
+        lengths = np.linalg.norm(directions, axis=1)
+        directions /= np.where(lengths > 0, lengths, 1)[:, None]
+        hit_faces, distances, _ = self._room.intersect(origins, directions)
+        if faces is None:
+            return hit_faces, targets, distances >= lengths * (1 - 1e-9)
+        valid = (hit_faces == faces) & (distances < lengths)
+        return hit_faces, origins + directions * np.where(valid, distances, 0)[:, None], valid
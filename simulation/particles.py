@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+
+'''
+Particle storage module for Ray Tracing Method 4-dimensional visualization.
+'''
+
+import numpy as np
+
+from geometry.room import FREQUENCIES
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+
+def _field(name, doc):
+    '''
+    Function creating a read-only property with the view of alive particles of a ParticleStore array.
+    :param name: key of the array in ParticleStore._arrays
+    :param doc: property docstring
+    :return: property instance
+    '''
+    return property(lambda self: self._arrays[name][:self.count], doc=doc)
+
+
+class ParticleStore():
+
+    def __init__(self, count, bands=len(FREQUENCIES), dtype=np.float64, energy_dtype=np.float32):
+        '''
+        Class storing particles state as a structure of arrays allocated once for all emitted particles.
+        Alive particles always occupy the first count rows, dead ones are overwritten by swap-remove compaction,
+        so views of the arrays can be updated in place without any allocation.
+        :param count: number of emitted particles, all of them are alive at first
+        :param bands: number of frequencies of particles energies
+        :param dtype: float type of particles geometry, i.e. positions, normals and distances
+        :param energy_dtype: float type of particles energies
+        '''
+        self.capacity = count
+        self.count = count   # number of alive particles
+        self._arrays = {
+            'normals': np.zeros((count, 3), dtype=dtype),
+            'positions': np.zeros((count, 3), dtype=dtype),
+            'energies': np.zeros((count, bands), dtype=energy_dtype),
+            'times': np.zeros(count, dtype=dtype),
+            'path_lengths': np.zeros(count, dtype=dtype),
+            'air_lengths': np.zeros(count, dtype=dtype),
+            'ids': np.arange(count),
+            'reflections': np.zeros(count, dtype=np.int32),
+            'scattered': np.zeros(count, dtype=bool),
+            'hit_faces': np.full(count, -1),
+            'hit_normals': np.zeros((count, 3), dtype=dtype),
+            'hit_distances': np.zeros(count, dtype=dtype),
+        }
+        self._indices = np.arange(count)   # indices of all particles, its views are passed to observers
+        self._products = np.zeros((count, 3), dtype=dtype)   # scratch buffer of in place vector updates
+
+    normals = _field('normals', 'Array of shape (count, 3) with particles unit direction vectors.')
+    positions = _field('positions', 'Array of shape (count, 3) with particles current positions.')
+    energies = _field('energies', 'Array of shape (count, bands) with particles energies in dB.')
+    times = _field('times', 'Array with particles times of flight [s].')
+    path_lengths = _field('path_lengths', 'Array with distances particles travelled from the source center.')
+    air_lengths = _field('air_lengths', 'Array with parts of path lengths energies are already reduced by air for.')
+    ids = _field('ids', 'Array with particles emission indices, kept when other particles are removed.')
+    reflections = _field('reflections', 'Array with numbers of reflections of particles so far.')
+    scattered = _field('scattered', 'Array with flags of particles reflected diffusely at least once.')
+    hit_faces = _field('hit_faces', 'Array with indices of faces particles reach next, -1 if none.')
+    hit_normals = _field('hit_normals', 'Array of shape (count, 3) with normals of faces particles reach next.')
+    hit_distances = _field('hit_distances', 'Array with distances left to the faces particles reach next.')
+
+    @property
+    def indices(self):
+        '''
+        Array with indices of all alive particles, i.e. 0 to count - 1.
+        '''
+        return self._indices[:self.count]
+
+    @property
+    def products(self):
+        '''
+        Scratch array of shape (count, 3) for vector products computed in place.
+        '''
+        return self._products[:self.count]
+
+    def to_arrays(self):
+        '''
+        Method copying state of alive particles, e.g. to store it on disk.
+        :return: dictionary of arrays of alive particles
+        '''
+        return {name: array[:self.count].copy() for name, array in self._arrays.items()}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''
+        Creates the store from arrays exported by to_arrays(), with capacity for exactly these particles.
+        :param arrays: dictionary of arrays of alive particles
+        :return: ParticleStore() instance
+        '''
+        store = cls(len(arrays['ids']), arrays['energies'].shape[1], arrays['positions'].dtype,
+                    arrays['energies'].dtype)
+        for name, array in store._arrays.items():
+            array[:] = arrays[name]
+        return store
+
+    def compact(self, alive):
+        '''
+        Method removing dead particles by moving alive particles from the end of the arrays into their rows.
+        Only rows of removed particles are written, so the cost does not depend on the number of alive particles,
+        but the order of alive particles changes.
+        :param alive: boolean array with a value for each alive particle
+        :return: number of removed particles
+        '''
+        count = int(np.count_nonzero(alive))
+        holes = np.flatnonzero(~alive[:count])   # rows of dead particles which stay within the alive rows
+        movers = np.flatnonzero(alive[count:]) + count   # rows of alive particles which are out of the alive rows
+        if len(holes):
+            for array in self._arrays.values():
+                array[holes] = array[movers]
+        removed = self.count - count
+        self.count = count
+        return removed
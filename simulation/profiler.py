@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+
+'''
+Profiling instrumentation module for Ray Tracing Method 4-dimensional visualization.
+'''
+
+import json
+import threading
+import time
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+
+class _DisabledStage():
+    '''
+    Context manager doing nothing, returned for all stages while profiling is disabled.
+    '''
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exception):
+        pass
+
+
+_DISABLED_STAGE = _DisabledStage()
+
+
+class _Stage():
+
+    def __init__(self, profiler, name):
+        '''
+        Context manager adding its duration to a stage of the profiler.
+        :param profiler: Profiler() instance
+        :param name: stage name
+        '''
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exception):
+        self._profiler.add_time(self._name, time.perf_counter() - self._start)
+
+
+class Profiler():
+
+    def __init__(self, enabled=False):
+        '''
+        Class collecting cumulative stage timers, counters and gauges of the simulation and drawing.
+        It is shared between threads, all methods return at once while it is disabled.
+        :param enabled: whether measurements are collected, it can be switched at any time
+        '''
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stages = {}   # stage name to [calls, total time, maximum time]
+        self._counters = {}
+        self._gauges = {}
+        self._start_time = time.perf_counter()
+        self._dump_stop = threading.Event()
+        self._dump_thread = None
+
+    def stage(self, name):
+        '''
+        Method measuring a stage, used as `with profiler.stage('intersect'):`.
+        :param name: stage name
+        :return: context manager
+        '''
+        if not self.enabled:
+            return _DISABLED_STAGE
+        return _Stage(self, name)
+
+    def add_time(self, name, duration):
+        '''
+        Method adding a single call of a stage.
+        :param name: stage name
+        :param duration: call duration [s]
+        '''
+        if self.enabled:
+            with self._lock:
+                stage = self._stages.setdefault(name, [0, 0., 0.])
+                stage[0] += 1
+                stage[1] += duration
+                stage[2] = max(stage[2], duration)
+
+    def count(self, name, value=1):
+        '''
+        Method increasing a counter, e.g. number of reflections.
+        :param name: counter name
+        :param value: increment
+        '''
+        if self.enabled:
+            with self._lock:
+                self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        '''
+        Method storing the current value of a gauge, e.g. number of alive particles.
+        :param name: gauge name
+        :param value: current value
+        '''
+        if self.enabled:
+            self._gauges[name] = value
+
+    def merge(self, snapshot):
+        '''
+        Method adding measurements of another profiler, e.g. of a batch shard traced in a worker process.
+        :param snapshot: Profiler.snapshot() dictionary, its gauges replace the current ones
+        '''
+        if self.enabled:
+            with self._lock:
+                for name, other in snapshot['stages'].items():
+                    stage = self._stages.setdefault(name, [0, 0., 0.])
+                    stage[0] += other['calls']
+                    stage[1] += other['total']
+                    stage[2] = max(stage[2], other['max'])
+                for name, value in snapshot['counters'].items():
+                    self._counters[name] = self._counters.get(name, 0) + value
+                self._gauges.update(snapshot['gauges'])
+
+    def reset(self):
+        '''
+        Method removing all measurements.
+        '''
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+            self._gauges.clear()
+            self._start_time = time.perf_counter()
+
+    def snapshot(self):
+        '''
+        Method copying all cumulative measurements.
+        :return: dictionary with 'time' since the profiler creation or reset [s], 'stages' with calls count,
+                 total and maximum time [s] of each stage, 'counters' and 'gauges'
+        '''
+        with self._lock:
+            return {
+                'time': time.perf_counter() - self._start_time,
+                'stages': {name: {'calls': calls, 'total': total, 'max': maximum}
+                           for name, (calls, total, maximum) in self._stages.items()},
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+            }
+
+    def start_dump(self, path, interval=1.):
+        '''
+        Method appending a snapshot with rates since the previous one to a JSON lines file periodically,
+        in a background thread until stop_dump() is called.
+        :param path: path of the JSON lines file
+        :param interval: time between lines [s]
+        '''
+        self.stop_dump()
+        self._dump_stop.clear()
+        self._dump_thread = threading.Thread(target=self._dump, args=(path, interval), name='ProfilerDump',
+                                             daemon=True)
+        self._dump_thread.start()
+
+    def stop_dump(self):
+        '''
+        Method stopping periodic dumps, the last line is written before it returns.
+        '''
+        if self._dump_thread is not None:
+            self._dump_stop.set()
+            self._dump_thread.join()
+            self._dump_thread = None
+
+    def _dump(self, path, interval):
+        '''
+        Thread loop of periodic dumps.
+        '''
+        previous = self.snapshot()
+        with open(path, 'a') as dump_file:
+            while True:
+                stopping = self._dump_stop.wait(interval)
+                current = self.snapshot()
+                current['interval'] = rates(previous, current)
+                dump_file.write(json.dumps(current) + '\n')
+                dump_file.flush()   # lines can be followed while the application runs
+                previous = current
+                if stopping:
+                    break
+
+
+def rates(previous, current):
+    '''
+    Function computing measurements over the interval between two snapshots of a profiler.
+    :param previous: earlier Profiler.snapshot() dictionary
+    :param current: later Profiler.snapshot() dictionary
+    :return: dictionary with interval 'duration' [s], 'stages' with calls count and mean time [s] of each stage,
+             'per_second' rates of counters and 'per_step' counters divided by 'steps' counter if it increased
+    '''
+    duration = max(current['time'] - previous['time'], 1e-9)
+    stages = {}
+    for name, stage in current['stages'].items():
+        before = previous['stages'].get(name, {'calls': 0, 'total': 0.})
+        calls = stage['calls'] - before['calls']
+        stages[name] = {'calls': calls, 'mean': (stage['total'] - before['total']) / calls if calls else 0.}
+    counters = {name: value - previous['counters'].get(name, 0) for name, value in current['counters'].items()}
+    steps = counters.get('steps', 0)
+    return {
+        'duration': duration,
+        'stages': stages,
+        'per_second': {name: value / duration for name, value in counters.items()},
+        'per_step': {name: value / steps for name, value in counters.items() if name != 'steps'} if steps else {},
+    }
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+
+'''
+Receiver grid module for Ray Tracing Method 4-dimensional visualization, energy maps over listener areas.
+'''
+
+import numpy as np
+
+from geometry.room import FREQUENCIES
+from simulation.engine import EngineObserver
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+
+class ReceiverGrid(EngineObserver):
+
+    def __init__(self, lower, upper, cell_size=.5):
+        '''
+        Class accumulating energy of particles crossing each cell of a uniform grid over a box or a plane,
+        for each frequency. Particles segments walk only through the cells they cross (3D DDA), each cell gets
+        particle energy relative to the source weighted by the segment length inside the cell divided by the cell
+        volume, like Echogram does for a single receiver.
+        :param lower: lower corner tuple of the grid, e.g. within Room.boundaries
+        :param upper: upper corner tuple of the grid, an axis with the same lower and upper coordinate makes a plane
+                      one cell thick, centered on that coordinate
+        :param cell_size: maximum size of a cell, cells are resized to fit the grid exactly
+        '''
+        lower = np.asarray(lower, dtype=np.float64)
+        upper = np.asarray(upper, dtype=np.float64)
+        if (upper < lower).any():
+            raise ValueError('grid upper corner {} is below its lower corner {}'.format(tuple(upper), tuple(lower)))
+        flat = upper - lower < cell_size * 1e-6   # plane axes
+        self.lower = np.where(flat, (lower + upper) * .5 - cell_size * .5, lower)
+        self.upper = np.where(flat, (lower + upper) * .5 + cell_size * .5, upper)
+        self.shape = tuple(int(count) for count in np.maximum(np.ceil((self.upper - self.lower) / cell_size - 1e-9), 1))
+        self.cell_sizes = (self.upper - self.lower) / self.shape
+        # energy of particles crossing each cell for each frequency, relative to the source energy, per cubic meter
+        self.energies = np.zeros(self.shape + (len(FREQUENCIES),))
+
+    def particles_moving(self, engine, indices, distances):
+        '''
+        An overridden method adding energy of the particles segments to the cells they cross.
+        '''
+        attenuation = engine.air_attenuation if engine.air_attenuation.any() else None
+        if len(indices) == engine.particles_count:   # all particles, clipped without gathering them first
+            inside, near, far = self._clip(engine.positions, engine.normals, distances)
+        else:
+            inside, near, far = self._clip(engine.positions[indices], engine.normals[indices], distances)
+        indices = indices[inside]   # energies are computed only for segments crossing the grid
+        self._walk(engine.positions[indices], engine.normals[indices], near, far, engine.relative_energies(indices),
+                   attenuation)
+
+    def add_segments(self, origins, directions, lengths, energies, attenuation=None):
+        '''
+        Method adding energy of straight segments to the cells they cross, all segments walk the grid at once.
+        :param origins: array of shape (n, 3) with segments beginnings
+        :param directions: array of shape (n, 3) with segments unit directions
+        :param lengths: array with segments lengths
+        :param energies: array of shape (n, 6) with segments energies relative to the source energy
+        :param attenuation: array with air attenuation [dB/m] of each frequency applied along the segments from their
+                            beginnings, none if None
+        '''
+        inside, near, far = self._clip(origins, directions, lengths)
+        self._walk(origins[inside], directions[inside], near, far, energies[inside], attenuation)
+
+    def _clip(self, origins, directions, lengths):
+        '''
+        Method clipping straight segments to the grid box.
+        :param origins: array of shape (n, 3) with segments beginnings
+        :param directions: array of shape (n, 3) with segments unit directions
+        :param lengths: array with segments lengths
+        :return: tuple (inside, near, far) of a boolean array of segments crossing the grid and arrays with distances
+                 along the crossing segments, where they enter and leave the grid
+        '''
+        # cheap test of segments bounding boxes first, axis by axis, most segments usually miss a listener plane
+        ends = origins + directions * lengths[:, None]
+        candidates = np.ones(len(origins), dtype=bool)
+        for axis in range(3):
+            starts_axis, ends_axis = origins[:, axis], ends[:, axis]
+            candidates &= ((np.maximum(starts_axis, ends_axis) >= self.lower[axis]) &
+                           (np.minimum(starts_axis, ends_axis) <= self.upper[axis]))
+        indices = np.flatnonzero(candidates)
+        origins, directions = origins[indices], directions[indices]
+        near, far = np.zeros(len(indices)), lengths[indices]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for axis in range(3):   # segment part within the grid slabs
+                inverse = 1 / directions[:, axis]
+                t0 = (self.lower[axis] - origins[:, axis]) * inverse
+                t1 = (self.upper[axis] - origins[:, axis]) * inverse
+                # NaN appears only for directions parallel to and lying on a grid side, it is ignored
+                near = np.fmax(near, np.fmin(t0, t1))
+                far = np.fmin(far, np.fmax(t0, t1))
+        crossing = near < far
+        inside = np.zeros(len(candidates), dtype=bool)
+        inside[indices[crossing]] = True
+        return inside, near[crossing], far[crossing]
+
+    def _walk(self, origins, directions, near, far, energies, attenuation):
+        '''
+        Method adding energy of straight segments to the cells they cross, walking from where they enter the grid.
+        :param origins: array of shape (n, 3) with segments beginnings
+        :param directions: array of shape (n, 3) with segments unit directions
+        :param near: array with distances along the segments where they enter the grid
+        :param far: array with distances along the segments where they leave the grid or end
+        :param energies: array of shape (n, 6) with segments energies relative to the source energy
+        :param attenuation: array with air attenuation [dB/m] of each frequency, none if None
+        '''
+        energies = energies / np.prod(self.cell_sizes)
+        if attenuation is not None:   # natural exponent of the air factor per meter from the middle, exp() is faster
+            attenuation = np.asarray(attenuation) * (-.05 * np.log(10))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverse = 1 / directions
+            shape = np.array(self.shape)
+            cells = np.clip(np.floor((origins + directions * near[:, None] - self.lower) / self.cell_sizes).astype(int),
+                            0, shape - 1)
+            steps = np.where(directions > 0, 1, -1)
+            # distance along each segment to the next cell boundary on each axis, and between boundaries
+            boundaries = self.lower + (cells + (steps > 0)) * self.cell_sizes
+            exits = np.where(directions != 0, (boundaries - origins) * inverse, np.inf)
+            deltas = np.where(directions != 0, self.cell_sizes * np.abs(inverse), np.inf)
+        flat_energies = self.energies.reshape(-1, len(FREQUENCIES))
+        rows = np.arange(len(cells))
+        bands = np.arange(len(FREQUENCIES))
+        while len(cells):
+            axes = np.argmin(exits, axis=1)
+            ends = np.minimum(exits[rows, axes], far)
+            weights = energies * (ends - near)[:, None]
+            if attenuation is not None:   # air absorption up to the middle of the part within the cell
+                weights *= np.exp((near + ends)[:, None] * attenuation)
+            flat = np.ravel_multi_index(cells.T, self.shape)
+            flat_energies += np.bincount((flat[:, None] * len(FREQUENCIES) + bands).ravel(), weights.ravel(),
+                                         minlength=flat_energies.size).reshape(flat_energies.shape)
+            cells[rows, axes] += steps[rows, axes]   # stepping into the next cell along the nearest boundary
+            exits[rows, axes] += deltas[rows, axes]
+            near = ends
+            stepped = cells[rows, axes]   # only the stepped axis may leave the grid
+            walking = (ends < far) & (stepped >= 0) & (stepped < shape[axes])
+            cells, exits, deltas, steps, near, far, energies = (
+                cells[walking], exits[walking], deltas[walking], steps[walking], near[walking], far[walking],
+                energies[walking])
+            rows = rows[:len(cells)]
+
+    def merge(self, other):
+        '''
+        Method adding energies of another grid with the same cells, e.g. from another shard of rays.
+        :param other: ReceiverGrid() instance
+        '''
+        self.energies += other.energies
+
+    def levels(self, rays_count):
+        '''
+        Method computing level of each cell relative to the free field level 1 m from the source.
+        :param rays_count: number of traced rays the energies were accumulated from
+        :return: array of shape (grid shape + (6,)) with levels in dB, -inf for cells no ray crossed
+        '''
+        with np.errstate(divide='ignore'):
+            return 10 * np.log10(self.energies * 4 * np.pi / rays_count)
+
+    def to_arrays(self):
+        '''
+        Method exporting the grid, e.g. to store it on disk.
+        :return: dictionary of arrays
+        '''
+        return {'lower': self.lower, 'upper': self.upper, 'energies': self.energies}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''
+        Creates the grid from arrays exported by to_arrays().
+        :param arrays: dictionary of arrays
+        :return: ReceiverGrid() instance
+        '''
+        grid = cls.__new__(cls)
+        grid.lower, grid.upper = np.array(arrays['lower']), np.array(arrays['upper'])
+        grid.energies = np.array(arrays['energies'])
+        grid.shape = grid.energies.shape[:3]
+        grid.cell_sizes = (grid.upper - grid.lower) / grid.shape
+        return grid
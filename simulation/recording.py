@@ -0,0 +1,222 @@
+#!/usr/bin/python3
+
+'''
+Trajectory recording module for Ray Tracing Method 4-dimensional visualization, streams particles events to disk
+and replays them from memory-mapped files.
+'''
+
+import glob
+import json
+import os
+
+import numpy as np
+
+from geometry.room import FREQUENCIES
+from simulation.engine import EngineObserver, SPEED_OF_SOUND
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+RECORDING_FORMAT_VERSION = 3   # has to be increased whenever recording files change
+METADATA_FILE = 'recording.json'
+DEFAULT_WINDOW = .01   # length of time windows events are grouped into [s]
+# a particle leaving its event position along its normal, until the next event (or death) at the end time
+EVENT_DTYPE = np.dtype([('particle', '<i8'), ('time', '<f8'), ('end', '<f8'), ('position', '<f4', 3),
+                        ('normal', '<f4', 3), ('energies', '<f4', len(FREQUENCIES))])
+# range of events in the events file, ordered by time, flown during a time window from start to end,
+# the end is earlier than the end of the window if all the events end earlier
+CHUNK_DTYPE = np.dtype([('offset', '<i8'), ('count', '<i8'), ('start', '<f8'), ('end', '<f8')])
+
+
+def write_metadata(directory, source_pos, source_spl, rays_count, ray_stride=1, parts=('part',), kept_parts=()):
+    '''
+    Function creating a recording directory and describing the run recorded into it.
+    Files of all parts except the kept ones are removed, so nothing of an earlier recording is replayed.
+    :param directory: path of the recording directory
+    :param source_pos: source position tuple
+    :param source_spl: source sound pressure level
+    :param rays_count: number of traced rays
+    :param ray_stride: only every ray_stride-th ray is recorded
+    :param parts: names of the parts of the run, see TrajectoryRecorder(), only they are replayed
+    :param kept_parts: names of the parts already recorded by the same run, e.g. of shards finished before it resumed
+    '''
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, '*.chunks')) + glob.glob(os.path.join(directory, '*.events')):
+        if os.path.splitext(os.path.basename(path))[0] not in kept_parts:
+            os.remove(path)
+    metadata = {'format_version': RECORDING_FORMAT_VERSION, 'source_pos': [float(value) for value in source_pos],
+                'source_spl': float(source_spl), 'rays_count': int(rays_count), 'ray_stride': int(ray_stride),
+                'speed_of_sound': SPEED_OF_SOUND, 'parts': list(parts)}
+    with open(os.path.join(directory, METADATA_FILE), 'w') as metadata_file:
+        json.dump(metadata, metadata_file)
+
+
+class TrajectoryRecorder(EngineObserver):
+
+    def __init__(self, engine, directory, part='part', ray_stride=1, chunk_size=65536, id_offset=0,
+                 window=DEFAULT_WINDOW, resume=None):
+        '''
+        Class appending the emission and every reflection of the engine particles to an events file.
+        Events are buffered and written grouped by fixed time windows, an event is written to each window
+        its segment is flown during, so replaying any moment reads only the chunks of a single window.
+        Each chunk is described in an index file appended only after the chunk is written,
+        so an interrupted recording stays readable.
+        :param engine: SimulationEngine() instance, its current particles are stored as emission events
+        :param directory: path of the recording directory, see write_metadata()
+        :param part: name of the files of this recorder, e.g. of a single batch shard, existing ones are replaced
+        :param ray_stride: only particles with recorded indices divisible by ray_stride are recorded
+        :param chunk_size: number of buffered events written at once, as a chunk for each of their windows
+        :param id_offset: added to emission indices of particles, e.g. index of the first ray of a batch shard
+        :param window: length of time windows [s], longer ones write less events more than once
+        :param resume: tuple (events, chunks) of written() numbers of an interrupted recorder of the same part,
+                       its files are truncated to them and appended to, instead of storing the emission, or None
+        '''
+        self._ray_stride = ray_stride
+        self._id_offset = id_offset
+        self._chunk_size = chunk_size
+        self._window = window
+        self._buffer = []   # arrays of EVENT_DTYPE not written yet
+        self._buffered = 0
+        self._offset = 0   # number of events already written
+        self._chunks_count = 0   # number of chunks already written
+        base = os.path.join(directory, part)
+        if resume is None:
+            self._events_file = open(base + '.events', 'wb')
+            self._chunks_file = open(base + '.chunks', 'wb')
+            self.particles_reflected(engine, np.arange(engine.particles_count), None)
+        else:   # events written after the interrupted recorder was saved are dropped
+            self._offset, self._chunks_count = resume
+            self._events_file = open(base + '.events', 'r+b')
+            self._events_file.truncate(self._offset * EVENT_DTYPE.itemsize)
+            self._events_file.seek(0, os.SEEK_END)
+            self._chunks_file = open(base + '.chunks', 'r+b')
+            self._chunks_file.truncate(self._chunks_count * CHUNK_DTYPE.itemsize)
+            self._chunks_file.seek(0, os.SEEK_END)
+
+    def particles_reflected(self, engine, indices, faces):
+        '''
+        An overridden method buffering the reflected particles as events.
+        '''
+        ids = engine.ids[indices] + self._id_offset
+        if self._ray_stride > 1:
+            recorded = ids % self._ray_stride == 0
+            indices, ids = indices[recorded], ids[recorded]
+        ends = engine.next_event_times(indices)
+        flown = ends > engine.times[indices]   # particles dying on the event are never drawn
+        indices, ids, ends = indices[flown], ids[flown], ends[flown]
+        events = np.empty(len(indices), dtype=EVENT_DTYPE)
+        events['particle'] = ids
+        events['time'] = engine.times[indices]
+        events['end'] = ends
+        events['position'] = engine.positions[indices]
+        events['normal'] = engine.normals[indices]
+        events['energies'] = engine.energies[indices]
+        self._buffer.append(events)
+        self._buffered += len(events)
+        if self._buffered >= self._chunk_size:
+            self.flush()
+
+    def flush(self):
+        '''
+        Method writing buffered events as a chunk for each time window they are flown during, ordered by time.
+        '''
+        if not self._buffered:
+            return
+        events = np.concatenate(self._buffer)
+        first = np.floor(events['time'] / self._window).astype(np.int64)
+        last = np.maximum(np.ceil(events['end'] / self._window).astype(np.int64) - 1, first)
+        repeats = last - first + 1   # an event flown during several windows is written to each of them
+        windows = np.repeat(first, repeats)
+        windows += np.arange(len(windows)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        events = np.repeat(events, repeats)
+        order = np.lexsort((events['time'], windows))
+        events, windows = events[order], windows[order]
+        self._events_file.write(events.tobytes())
+        self._events_file.flush()
+        starts = np.flatnonzero(np.append(True, windows[1:] != windows[:-1]))   # first event of each window
+        counts = np.diff(np.append(starts, len(events)))
+        chunks = np.empty(len(starts), dtype=CHUNK_DTYPE)
+        chunks['offset'] = self._offset + starts
+        chunks['count'] = counts
+        chunks['start'] = windows[starts] * self._window
+        chunks['end'] = np.minimum((windows[starts] + 1) * self._window,
+                                   np.maximum.reduceat(events['end'], starts))
+        self._chunks_file.write(chunks.tobytes())
+        self._chunks_file.flush()
+        self._offset += len(events)
+        self._chunks_count += len(chunks)
+        self._buffer, self._buffered = [], 0
+
+    def written(self):
+        '''
+        Method writing buffered events, so that the recorder can be resumed from the files, see __init__().
+        :return: tuple (events, chunks) with numbers of written events and chunks
+        '''
+        self.flush()
+        return self._offset, self._chunks_count
+
+    def close(self):
+        '''
+        Method writing the remaining events and closing the files.
+        '''
+        self.flush()
+        self._events_file.close()
+        self._chunks_file.close()
+
+
+class Recording():
+
+    def __init__(self, directory):
+        '''
+        Class replaying a recording directory, events files are memory-mapped and only chunks of the time window
+        of the requested time are read, so recordings may be much larger than memory.
+        Only the parts listed in the metadata are replayed, parts not written yet are skipped.
+        :param directory: path of the recording directory
+        '''
+        with open(os.path.join(directory, METADATA_FILE)) as metadata_file:
+            self.metadata = json.load(metadata_file)
+        if self.metadata.get('format_version') != RECORDING_FORMAT_VERSION:
+            raise ValueError('{}: recording format is not supported, version {} is expected'.format(
+                directory, RECORDING_FORMAT_VERSION))
+        self.source_spl = self.metadata['source_spl']
+        self._parts = []   # tuples (memory-mapped events, chunks) of each part
+        for part in self.metadata['parts']:
+            chunks_path = os.path.join(directory, part + '.chunks')
+            if not os.path.exists(chunks_path):   # e.g. a shard of an interrupted run
+                continue
+            chunks = np.fromfile(chunks_path, dtype=CHUNK_DTYPE)
+            if not len(chunks):
+                continue
+            count = int((chunks['offset'] + chunks['count']).max())   # events written after the last chunk are ignored
+            events = np.memmap(chunks_path[:-len('.chunks')] + '.events', dtype=EVENT_DTYPE, mode='r', shape=(count,))
+            self._parts.append((events, chunks))
+        ends = [chunks['end'].max() for _, chunks in self._parts]
+        self.duration = max(ends) if ends else 0.   # time the last particle dies [s]
+        # time of the first event, the emission reaches the radius of the source a little after 0
+        starts = [events['time'][chunks['offset']].min() for events, chunks in self._parts]
+        self.start = min(starts) if starts else 0.
+
+    def __len__(self):
+        '''
+        Number of recorded events, events flown during several time windows are counted for each of them.
+        '''
+        return sum(len(events) for events, _ in self._parts)
+
+    def positions_at(self, time):
+        '''
+        Method interpolating positions of particles alive at the given time from their last events.
+        :param time: time since the emission [s]
+        :return: tuple of arrays (particles, positions, energies) of the particles alive at the given time,
+                 energies have a column for each of 6 frequencies
+        '''
+        results = []
+        for events, chunks in self._parts:
+            for offset, count, _, _ in chunks[(chunks['start'] <= time) & (chunks['end'] > time)]:
+                chunk = events[offset:offset + count]   # view of the mapped file, nothing is read yet
+                started = chunk[:np.searchsorted(chunk['time'], time, side='right')]
+                results.append(started[started['end'] > time])   # copying only the particles alive at the time
+        alive = np.concatenate(results) if results else np.empty(0, dtype=EVENT_DTYPE)
+        flight = (time - alive['time']) * self.metadata['speed_of_sound']   # distance travelled since the event
+        positions = alive['position'] + alive['normal'] * flight[:, None].astype(np.float32)
+        return alive['particle'], positions, alive['energies']
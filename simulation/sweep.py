@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+
+'''
+Parameter sweep module for Ray Tracing Method 4-dimensional visualization, traces a grid of source parameters
+and caches results of each configuration on disk.
+'''
+
+import hashlib
+import itertools
+import os
+
+import numpy as np
+
+from geometry.room import GEOMETRY_ARRAYS
+from input.room_cache import DEFAULT_CACHE_DIR
+from simulation.batch import BatchResult, BatchRunner
+from simulation.checkpoint import load_checkpoint, save_checkpoint
+from simulation.engine import ENGINE_VERSION
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+DEFAULT_RESULTS_DIR = os.path.join(DEFAULT_CACHE_DIR, 'results')
+DEFAULT_RESULTS_SIZE = 1 << 30   # maximum size of cached results [B]
+TRACED_SPL = 80   # source level all positions are traced with, the same as the default level of single runs
+
+
+def room_digest(room):
+    '''
+    Function computing digest of room geometry content, equal for rooms loaded from equal files in any way.
+    :param room: Room() instance
+    :return: hexadecimal digest string
+    '''
+    digest = hashlib.sha1()
+    arrays = room.to_arrays()
+    for key in GEOMETRY_ARRAYS:   # derived structures depend only on these
+        array = np.ascontiguousarray(arrays[key])
+        digest.update(repr((key, array.dtype.str, array.shape)).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+class ResultsCache():
+
+    def __init__(self, directory=DEFAULT_RESULTS_DIR, max_size=DEFAULT_RESULTS_SIZE):
+        '''
+        Class storing BatchResult() instances on disk as .npz files named by their keys.
+        When the files exceed the maximum size, the least recently used ones are removed.
+        :param directory: directory with cached results
+        :param max_size: maximum size of all cached results [B], the latest result is kept even if it is larger
+        '''
+        self.directory = directory
+        self.max_size = max_size
+
+    def _path(self, key):
+        '''
+        Method computing path of a cached result.
+        :param key: hexadecimal key string
+        :return: path of the result file
+        '''
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        '''
+        Method loading a cached result and marking it as recently used.
+        :param key: hexadecimal key string, e.g. from SweepRunner.key()
+        :return: BatchResult() instance, None if the result is not cached
+        '''
+        path = self._path(key)
+        try:
+            arrays = load_checkpoint(path)
+            os.utime(path)   # modification time orders results by their last use
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):   # written by an older version or damaged, traced again
+            os.remove(path)
+            return None
+        return BatchResult.from_arrays(arrays)
+
+    def put(self, key, result):
+        '''
+        Method storing a result and removing the least recently used ones if the cache is too large.
+        :param key: hexadecimal key string
+        :param result: BatchResult() instance
+        '''
+        save_checkpoint(self._path(key), result.to_arrays())
+        self._evict(key)
+
+    def _evict(self, kept_key):
+        '''
+        Method removing the least recently used results until the cache fits its maximum size.
+        :param kept_key: key of the result which is never removed
+        '''
+        entries = []   # tuples (last use time, size, path)
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.npz') and name != kept_key + '.npz':
+                try:
+                    status = os.stat(path)
+                except FileNotFoundError:   # removed by another process
+                    continue
+                entries.append((status.st_mtime, status.st_size, path))
+        size = os.path.getsize(self._path(kept_key)) + sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+
+class SweepRunner():
+
+    def __init__(self, room, cache=None, processes=None, shards_count=64):
+        '''
+        Class tracing rays of each configuration of a source parameters grid, configurations traced before
+        with the same room, rays and parameters are loaded from the cache instead.
+        :param room: Room() instance
+        :param cache: ResultsCache() instance, nothing is cached if None
+        :param processes: number of worker processes, see BatchRunner()
+        :param shards_count: number of shards the rays are split into, results depend on it
+        '''
+        self._cache = cache
+        self._batch_runner = BatchRunner(room, processes, shards_count)
+        self._shards_count = shards_count
+        self._room_digest = room_digest(room) if cache is not None else None
+
+    def key(self, directions, source_pos, seed=None, **parameters):
+        '''
+        Method computing the cache key of a single source position, results of all source levels are the same.
+        :param directions: array of shape (n, 3) with rays unit directions
+        :param source_pos: source position tuple
+        :param seed: integer seed of diffuse reflections
+        :param parameters: other keyword arguments of BatchRunner.run()
+        :return: hexadecimal key string
+        '''
+        digest = hashlib.sha1()
+        digest.update(np.ascontiguousarray(directions, dtype=np.float64).tobytes())
+        grid = parameters.pop('grid', None)   # grid parts one by one, like in the checkpoint digest
+        grid = None if grid is None else [np.asarray(part).tolist() for part in grid]
+        digest.update(repr([ENGINE_VERSION, self._room_digest, self._shards_count, len(directions),
+                            [float(value) for value in source_pos], seed, grid,
+                            sorted((name, np.asarray(value).tolist()) for name, value in parameters.items())]).encode())
+        return digest.hexdigest()
+
+    def run(self, directions, sources, source_spls=(TRACED_SPL,), seed=None, **parameters):
+        '''
+        Method tracing every source position once with all processes of a single pool, and giving its results to all
+        source levels. Results are relative to the source energy, so they don't depend on the level, which only
+        offsets absolute levels, e.g. level of a grid cell is its relative level plus the source level.
+        :param directions: array of shape (n, 3) with rays unit directions, the same for all configurations
+        :param sources: list of source positions tuples
+        :param source_spls: list of source sound pressure levels
+        :param seed: integer seed of diffuse reflections, see BatchRunner.run()
+        :param parameters: other keyword arguments of BatchRunner.run(), e.g. receivers, without recording
+                           and checkpoints
+        :return: list of tuples (source_pos, source_spl, result, cached) in the order of sources and then levels,
+                 result is a BatchResult() instance and cached is True if it was not traced
+        '''
+        if 'record_path' in parameters or 'checkpoint_path' in parameters:
+            raise ValueError('sweep configurations can not be recorded or checkpointed')
+        directions = np.asarray(directions, dtype=np.float64)
+        traced = {}   # results of source positions traced or loaded during this sweep
+        results = []
+        with self._batch_runner:   # worker processes started once, by the first traced position
+            for source_pos, source_spl in itertools.product(sources, source_spls):
+                source_pos = tuple(float(value) for value in source_pos)
+                key = source_pos if self._cache is None else self.key(directions, source_pos, seed, **parameters)
+                if key in traced:   # a copy, so that results can be changed independently, e.g. by image sources
+                    results.append((source_pos, source_spl, BatchResult.from_arrays(traced[key].to_arrays()), True))
+                    continue
+                result = None if self._cache is None else self._cache.get(key)
+                cached = result is not None
+                if not cached:
+                    result = self._batch_runner.run(directions, source_pos, TRACED_SPL, seed=seed, **parameters)
+                    if self._cache is not None:
+                        self._cache.put(key, result)
+                traced[key] = result
+                results.append((source_pos, source_spl, result, cached))
+        return results
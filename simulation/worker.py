@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+
+'''
+Background simulation worker module for Ray Tracing Method 4-dimensional visualization.
+'''
+
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+
+class Snapshot():
+
+    def __init__(self, capacity, bands):
+        '''
+        Class storing a copy of particles state for drawing, its arrays are allocated once and reused.
+        :param capacity: maximum number of particles
+        :param bands: number of frequencies of particles energies
+        '''
+        self._positions = np.zeros((capacity, 3), dtype=np.float32)
+        self._energies = np.zeros((capacity, bands), dtype=np.float32)
+        self.count = 0   # number of particles in the snapshot
+        self.steps = 0   # number of steps simulated when the snapshot was taken
+
+    @property
+    def positions(self):
+        '''
+        Float32 array of shape (count, 3) with particles positions.
+        '''
+        return self._positions[:self.count]
+
+    @property
+    def energies(self):
+        '''
+        Float32 array of shape (count, 6) with particles energies in dB.
+        '''
+        return self._energies[:self.count]
+
+    def copy_from(self, engine):
+        '''
+        Method copying current particles state of the engine into the snapshot arrays.
+        :param engine: SimulationEngine() instance
+        '''
+        self.count = engine.particles_count
+        self.steps = engine.steps
+        np.copyto(self._positions[:self.count], engine.positions, casting='same_kind')
+        np.copyto(self._energies[:self.count], engine.energies, casting='same_kind')
+
+
+class SimulationWorker():
+
+    def __init__(self, engine, steps_per_second=60):
+        '''
+        Class stepping the simulation in a background thread with a fixed timestep, independently of drawing.
+        The engine state is published through two snapshots: the worker fills the back one while the front one
+        is drawn and swaps them afterwards, so readers never see a half-written state.
+        :param engine: SimulationEngine() instance, it must not be used by other threads while the worker runs
+        :param steps_per_second: number of simulation steps per second of real time, as fast as possible if None
+        '''
+        self._engine = engine
+        self.steps_per_second = steps_per_second
+        self._front = Snapshot(engine.particles_count, engine.energies.shape[1])
+        self._back = Snapshot(engine.particles_count, engine.energies.shape[1])
+        self._front.copy_from(engine)
+        self._lock = threading.Lock()   # held while the front snapshot is read and while the snapshots are swapped
+        self._stop = threading.Event()
+        self._thread = None
+        self.error = None   # exception which stopped the worker, if any
+
+    @property
+    def running(self):
+        '''
+        Whether the worker thread is running.
+        '''
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        '''
+        Starts stepping the simulation in a background thread.
+        '''
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='SimulationWorker', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stops the background thread and waits for it to finish.
+        '''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    @contextmanager
+    def snapshot(self):
+        '''
+        Context manager giving access to the latest published snapshot, which is not swapped until the block ends.
+        :return: Snapshot() instance
+        '''
+        with self._lock:
+            yield self._front
+
+    def _run(self):
+        '''
+        Thread loop running as many steps as the fixed timestep requires and publishing a snapshot after them.
+        '''
+        try:
+            start_time = time.perf_counter()
+            steps = 0   # steps simulated by this thread
+            while not self._stop.is_set() and self._engine.particles_count:
+                if self.steps_per_second is None:
+                    due_steps = steps + 1
+                else:
+                    due_steps = int((time.perf_counter() - start_time) * self.steps_per_second)
+                    if due_steps <= steps:   # waiting for the next step to be due
+                        self._stop.wait((steps + 1) / self.steps_per_second - (time.perf_counter() - start_time))
+                        continue
+                    due_steps = min(due_steps, steps + max(1, self.steps_per_second // 10))   # catching up gradually
+                while steps < due_steps:
+                    self._engine.step()
+                    steps += 1
+                self._publish()
+            self._publish()
+        except Exception as e:   # keeping the exception for the owner of the worker
+            self.error = e
+
+    def _publish(self):
+        '''
+        Copies the engine state into the back snapshot and swaps it with the front one.
+        '''
+        with self._engine.profiler.stage('publish'):
+            self._back.copy_from(self._engine)
+            with self._lock:
+                self._front, self._back = self._back, self._front
@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+
+'''
+Command-line module for headless Ray Tracing Method parameter sweeps, results of each source position are cached,
+so repeated or overlapping sweeps trace only positions never traced before.
+'''
+
+import argparse
+import sys
+
+import numpy as np
+
+from cli import add_simulation_arguments, prepare_simulation, print_rt60, result_arrays, to_simulation_axes
+from simulation.sweep import DEFAULT_RESULTS_DIR, DEFAULT_RESULTS_SIZE, ResultsCache, SweepRunner
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+# output arrays with a value of each configuration, stacked along the first axis, other ones are the same for all
+SWEPT_ARRAYS = ('source_pos', 'source_spl', 'histogram', 'face_hits', 'echograms', 'decay_curves', 't20', 't30',
+                'rt60', 'grid_levels')
+
+
+def parse_arguments(arguments=None):
+    '''
+    Parses command-line arguments.
+    :param arguments: list of arguments, sys.argv if None
+    :return: argparse.Namespace with parsed arguments
+    '''
+    parser = argparse.ArgumentParser(description='Headless ray tracing method simulation of every combination of '
+                                                 'source positions and levels.')
+    add_simulation_arguments(parser)
+    parser.add_argument('output', help='path of the .npz file the results of all configurations are written to')
+    parser.add_argument('--source', type=float, nargs=3, action='append', default=[], metavar=('X', 'Y', 'Z'),
+                        help='source position in room file coordinates, may be repeated (default: 0 0 0)')
+    parser.add_argument('--spl', type=float, nargs='+', default=[80],
+                        help='source sound pressure levels [dB] (default: 80)')
+    parser.add_argument('--results-cache', default=DEFAULT_RESULTS_DIR,
+                        help='directory with cached results (default: {})'.format(DEFAULT_RESULTS_DIR))
+    parser.add_argument('--results-cache-size', type=float, default=DEFAULT_RESULTS_SIZE / 2 ** 20,
+                        help='cached results are removed, least recently used first, beyond this size [MB] '
+                             '(default: {:.0f})'.format(DEFAULT_RESULTS_SIZE / 2 ** 20))
+    parser.add_argument('--no-results-cache', action='store_true', help='trace every configuration, cache nothing')
+    parsed = parser.parse_args(arguments)
+    if not parsed.source:
+        parsed.source = [[0., 0., 0.]]
+    return parsed
+
+
+def main(arguments=None):
+    '''
+    Loads room geometry, traces or loads from the cache every configuration and writes the results to disk.
+    :param arguments: list of arguments, sys.argv if None
+    '''
+    arguments = parse_arguments(arguments)
+    room, directions, parameters = prepare_simulation(arguments)
+    cache = None
+    if not arguments.no_results_cache:
+        cache = ResultsCache(arguments.results_cache, int(arguments.results_cache_size * 2 ** 20))
+    runner = SweepRunner(room, cache, processes=arguments.processes, shards_count=arguments.shards)
+    sources = [to_simulation_axes(source) for source in arguments.source]
+    configurations = runner.run(directions, sources, arguments.spl, **parameters)
+    outputs = []
+    for source_pos, source_spl, result, cached in configurations:
+        source = to_simulation_axes(source_pos)   # back to room file coordinates
+        outputs.append(result_arrays(arguments, room, result, source, source_spl, parameters['air_attenuation']))
+        print('Source {}, {} dB: {}'.format(source, source_spl, 'cached' if cached else 'traced'))
+        print_rt60(arguments, result)
+    arrays = {key: np.array([output[key] for output in outputs]) if key in SWEPT_ARRAYS else array
+              for key, array in outputs[0].items()}
+    np.savez(arguments.output, cached=np.array([cached for _, _, _, cached in configurations]), **arrays)
+    print('{} configurations, {} traced, results written to {}'.format(
+        len(configurations), sum(not cached for _, _, _, cached in configurations), arguments.output))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,28 @@
+#!/usr/bin/python3
+
+'''
+Regression tests of Ray Tracing Method 4-dimensional visualization, run them from the project directory
+with `python -m unittest` or `python -m pytest`, they never import PyQt5 or PyOpenGL.
+'''
+
+import os
+import tempfile
+
+from input.file_loader import FileLoader
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+
+def load_text_room(text):
+    '''
+    Function loading a room from the content of a room file, e.g. from benchmarks.rooms.
+    :param text: string with the room file content
+    :return: Room() instance
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'room.txt')
+        with open(path, 'w') as room_file:
+            room_file.write(text)
+        return FileLoader().load_master_file(path)
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+
+'''
+Tests of multiprocess batch tracing, its checkpoints and resuming.
+'''
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from benchmarks.rooms import box_room
+from simulation.batch import BatchRunner
+from simulation.checkpoint import load_checkpoint
+from simulation.emitter import fibonacci_directions
+from simulation.engine import SimulationEngine
+from tests import load_text_room
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+SOURCE_POS = (5, 1.5, 4)   # source position inside the box room, in simulation coordinates
+# materials with scattering coefficients, so that resumed shards need the random generator state as well
+SCATTERING = 'abs wall <5 5 6 7 8 9> [10 20 30 40 50 60]'
+
+
+class BatchRunnerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.room = load_text_room(box_room().replace('abs wall <5 5 6 7 8 9>', SCATTERING))
+        cls.directions = fibonacci_directions(400)
+
+    def run_batch(self, processes=1, **parameters):
+        '''
+        Method tracing the rays in the box room with a receiver and a grid.
+        :return: dictionary of arrays of the results
+        '''
+        runner = BatchRunner(self.room, processes=processes, shards_count=4)
+        return runner.run(self.directions, source_pos=SOURCE_POS, duration=.5, receivers=[(3, 1.2, 3)],
+                          grid=((1, 1.2, 1), (9, 1.2, 7), .5), seed=7, max_reflections=30, **parameters).to_arrays()
+
+    def assert_same_results(self, results, expected):
+        self.assertEqual(sorted(results), sorted(expected))
+        for key in expected:
+            np.testing.assert_array_equal(results[key], expected[key], err_msg=key)
+
+    def test_processes_count_does_not_change_results(self):
+        expected = self.run_batch()
+        for processes in (2, 3):
+            self.assert_same_results(self.run_batch(processes), expected)
+
+    def test_resuming_after_finished_shards(self):
+        expected = self.run_batch()
+        original = SimulationEngine.run_reflections
+        engines = []
+
+        def interrupted(engine, max_reflections=None):
+            if engine not in engines:
+                if len(engines) == 2:   # before the first pass of the third shard
+                    raise KeyboardInterrupt
+                engines.append(engine)
+            return original(engine, max_reflections)
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_path = os.path.join(directory, 'run.npz')
+            with mock.patch.object(SimulationEngine, 'run_reflections', interrupted):
+                with self.assertRaises(KeyboardInterrupt):
+                    self.run_batch(checkpoint_path=checkpoint_path, checkpoint_interval=0)
+            self.assertEqual(int(load_checkpoint(checkpoint_path)['finished_shards']), 2)
+            self.assertEqual(os.listdir(checkpoint_path + '.shards'), [])
+            self.assert_same_results(self.run_batch(2, checkpoint_path=checkpoint_path), expected)
+
+    def test_resuming_interrupted_shard(self):
+        expected = self.run_batch()
+        original = SimulationEngine.run_reflections
+        passes = []
+
+        def interrupted(engine, max_reflections=None):
+            passes.append(max_reflections)
+            if len(passes) == 45:   # within the second shard
+                raise KeyboardInterrupt
+            return original(engine, max_reflections)
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_path = os.path.join(directory, 'run.npz')
+            with mock.patch.object(SimulationEngine, 'run_reflections', interrupted):
+                with self.assertRaises(KeyboardInterrupt):
+                    self.run_batch(checkpoint_path=checkpoint_path, checkpoint_interval=0)
+            self.assertEqual(os.listdir(checkpoint_path + '.shards'), ['shard00001.npz'])
+            self.assert_same_results(self.run_batch(checkpoint_path=checkpoint_path), expected)
+            self.assertFalse(os.path.exists(checkpoint_path + '.shards'))
+
+if __name__ == '__main__':
+    unittest.main()
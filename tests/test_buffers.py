@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+
+'''
+Tests of vertex data uploaded to OpenGL buffers.
+'''
+
+import unittest
+
+import numpy as np
+
+from gui.buffers import particle_colors, particle_positions
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+
+class ParticleBuffersTest(unittest.TestCase):
+
+    def test_positions_are_contiguous_float32(self):
+        positions = np.random.RandomState(1).uniform(-5, 5, (100, 6))[:, ::2]   # a strided view
+        vertices = particle_positions(positions)
+        self.assertEqual(vertices.dtype, np.float32)
+        self.assertTrue(vertices.flags['C_CONTIGUOUS'])
+        np.testing.assert_array_equal(vertices, positions.astype(np.float32))
+
+    def test_colors_equal_drawing_particles_one_by_one(self):
+        source_spl = 80
+        energies = np.random.RandomState(2).uniform(0, source_spl, 500)
+        colors = particle_colors(energies, source_spl)
+        self.assertEqual(colors.dtype, np.float32)
+        self.assertEqual(colors.shape, (500, 3))
+        for energy, color in zip(energies, colors):   # colors of particles drawn with glColor3f() one by one
+            green = energy / source_spl
+            np.testing.assert_allclose(color, (1 - green, green, 0), atol=1e-6)
+
+    def test_colors_of_energies_beyond_source_level(self):
+        colors = particle_colors(np.array([-20., 0., 100.]), 80)
+        np.testing.assert_array_equal(colors, [(1, 0, 0), (1, 0, 0), (0, 1, 0)])
+        self.assertEqual(particle_colors(np.empty(0), 80).shape, (0, 3))
+
+if __name__ == '__main__':
+    unittest.main()
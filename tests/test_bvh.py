@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+'''
+Tests of the bounding volume hierarchy against intersecting rays with all triangles.
+'''
+
+import unittest
+
+import numpy as np
+
+from benchmarks.rooms import pillars_room
+from geometry.bvh import BoundingVolumeHierarchy
+from simulation.emitter import fibonacci_directions
+from tests import load_text_room
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+
+def brute_force_distances(triangles, origins, directions, epsilon=1e-6):
+    '''
+    Function intersecting every ray with every triangle (Moller-Trumbore algorithm).
+    :param triangles: array of shape (m, 3, 3) with vertices of each triangle
+    :param origins: array of shape (n, 3) with rays origins
+    :param directions: array of shape (n, 3) with rays unit directions
+    :param epsilon: minimum hit distance
+    :return: array of shape (n, m) with distance of each ray to each triangle, inf if the ray misses it
+    '''
+    v0, e1, e2 = triangles[:, 0], triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+    p = np.cross(directions[:, None], e2[None])
+    determinant = np.einsum('jk,ijk->ij', e1, p)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inverse = 1 / determinant
+        s = origins[:, None] - v0[None]
+        u = np.einsum('ijk,ijk->ij', s, p) * inverse
+        q = np.cross(s, e1[None])
+        v = np.einsum('ik,ijk->ij', directions, q) * inverse
+        t = np.einsum('jk,ijk->ij', e2, q) * inverse
+        hits = (np.abs(determinant) > 1e-12) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= epsilon)
+    return np.where(hits, t, np.inf)
+
+
+class BoundingVolumeHierarchyTest(unittest.TestCase):
+
+    def assert_nearest_hits(self, triangles, origins, directions, leaf_size=4):
+        bvh = BoundingVolumeHierarchy(triangles, leaf_size=leaf_size)
+        hit_triangles, distances = bvh.intersect(origins, directions)
+        expected = brute_force_distances(triangles, origins, directions)
+        nearest = expected.min(axis=1)
+        np.testing.assert_allclose(distances, nearest, rtol=1e-12)
+        missed = np.isinf(nearest)
+        np.testing.assert_array_equal(hit_triangles[missed], -1)
+        # rays crossing an edge shared by two triangles may hit either of them, at the same distance
+        hit = ~missed
+        np.testing.assert_allclose(expected[hit, hit_triangles[hit]], nearest[hit], rtol=1e-12)
+        return missed
+
+    def test_random_triangles(self):
+        rng = np.random.RandomState(3)
+        triangles = rng.uniform(-5, 5, (300, 1, 3)) + rng.uniform(-1, 1, (300, 3, 3))
+        origins = rng.uniform(-6, 6, (500, 3))
+        directions = rng.normal(size=(500, 3))
+        directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+        for leaf_size in (1, 4, 16):
+            missed = self.assert_nearest_hits(triangles, origins, directions, leaf_size)
+            self.assertTrue(0 < missed.sum() < len(missed))
+
+    def test_axis_aligned_rays(self):
+        rng = np.random.RandomState(5)
+        triangles = rng.uniform(-5, 5, (200, 1, 3)) + rng.uniform(-1, 1, (200, 3, 3))
+        origins = rng.uniform(-6, 6, (300, 3))
+        directions = np.zeros((300, 3))
+        directions[np.arange(300), rng.randint(3, size=300)] = rng.choice((-1, 1), 300)
+        self.assert_nearest_hits(triangles, origins, directions)
+
+    def test_room_triangles(self):
+        room = load_text_room(pillars_room(200))
+        triangles = room._compute_triangles(room._compute_face_vertices())[1]
+        directions = fibonacci_directions(2000)
+        origins = np.tile((.5, 1.5, .5), (len(directions), 1))   # the source position in simulation coordinates
+        missed = self.assert_nearest_hits(triangles, origins, directions)
+        self.assertFalse(missed.any())   # the room is closed
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+
+'''
+Tests of the ray emitters of the sound source.
+'''
+
+import unittest
+
+import numpy as np
+
+from simulation.emitter import (EMITTERS, directional_directions, emit_directions, fibonacci_directions,
+                                stratified_directions)
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+
+class EmitterTest(unittest.TestCase):
+
+    def test_unit_directions(self):
+        for method in EMITTERS:
+            for rays_count in (1, 2, 225, 1000):
+                directions = emit_directions(rays_count, method)
+                self.assertEqual(directions.shape, (rays_count, 3))
+                np.testing.assert_allclose(np.linalg.norm(directions, axis=1), 1)
+
+    def test_fibonacci_directions_cover_sphere_evenly(self):
+        directions = fibonacci_directions(4000)
+        np.testing.assert_allclose(directions.mean(axis=0), 0, atol=1e-3)
+        # each octant gets an eighth of the rays, and no two rays coincide
+        octants = np.bincount((directions > 0) @ (1, 2, 4), minlength=8)
+        np.testing.assert_allclose(octants, 500, atol=10)
+        self.assertEqual(len(np.unique(directions.round(9), axis=0)), len(directions))
+
+    def test_stratified_directions_one_per_cell(self):
+        rays_count = 1000
+        directions = stratified_directions(rays_count, seed=5)
+        np.testing.assert_array_equal(directions, stratified_directions(rays_count, seed=5))
+        self.assertFalse(np.array_equal(directions, stratified_directions(rays_count, seed=6)))
+        # bands of equal height per cell, each cell spans an equal part of the azimuth of its band
+        bands_count = int(round(np.sqrt(rays_count / np.pi)))
+        counts = np.full(bands_count, rays_count // bands_count)
+        counts[:rays_count % bands_count] += 1
+        edges = -1 + 2 * np.concatenate(([0], np.cumsum(counts))) / rays_count
+        bands = np.searchsorted(edges, directions[:, 1], side='right') - 1
+        np.testing.assert_array_equal(bands, np.repeat(np.arange(bands_count), counts))
+        azimuths = np.arctan2(directions[:, 2], directions[:, 0]) % (2 * np.pi)
+        cells = np.floor(azimuths / (2 * np.pi) * counts[bands]).astype(int)
+        np.testing.assert_array_equal(cells, np.arange(rays_count) - np.repeat(np.cumsum(counts) - counts, counts))
+
+    def test_directional_directions_follow_radiated_power(self):
+        axis = np.array((1., 2., 2.)) / 3
+        directions = directional_directions(8000, axis=axis, pattern='cardioid')
+        cosines = directions @ axis
+        # power of the cardioid .5 + .5 * cos in the front half is 7 / 8 of the total, uniform in the cosine
+        self.assertAlmostEqual((cosines > 0).mean(), 7 / 8, places=3)
+        omnidirectional = directional_directions(8000, axis=axis, pattern='omnidirectional')
+        self.assertAlmostEqual(((omnidirectional @ axis) > 0).mean(), .5, places=3)
+
+    def test_invalid_parameters(self):
+        with self.assertRaises(ValueError):
+            fibonacci_directions(0)
+        with self.assertRaises(ValueError):
+            emit_directions(100, 'random')
+        with self.assertRaises(ValueError):
+            directional_directions(100, pattern='shotgun')
+        with self.assertRaises(ValueError):
+            directional_directions(100, pattern=lambda cosine: np.zeros_like(cosine))
+
+if __name__ == '__main__':
+    unittest.main()
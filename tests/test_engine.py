@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+
+'''
+Tests of the headless simulation engine.
+'''
+
+import unittest
+
+import numpy as np
+
+from benchmarks.rooms import box_room
+from simulation.emitter import fibonacci_directions
+from simulation.engine import SimulationEngine, SPEED_OF_SOUND
+from tests import load_text_room
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+
+class SimulationEngineTest(unittest.TestCase):
+
+    def test_source_closer_to_walls_than_starting_sphere(self):
+        room = load_text_room(box_room())
+        source_pos = np.array([.2, 1.5, .3])   # 0.2 m and 0.3 m from two walls, within the 0.5 m starting sphere
+        engine = SimulationEngine(room, source_pos=source_pos, directions=fibonacci_directions(1000), radius=.5)
+        distances = np.linalg.norm(engine.positions - source_pos, axis=1)
+        np.testing.assert_allclose(engine.times * SPEED_OF_SOUND, distances)
+        np.testing.assert_allclose(engine.path_lengths, distances)
+        self.assertTrue((distances <= .5 + 1e-12).all())
+        inside = (engine.positions >= -1e-9) & (engine.positions <= np.array((10, 3, 8)) + 1e-9)   # room walls
+        self.assertTrue(inside.all())
+        self.assertTrue((engine._hit_distances >= 0).all())
+        engine.run_reflections(3)
+        self.assertTrue((engine.path_lengths >= engine.times * SPEED_OF_SOUND - 1e-9).all())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+
+'''
+Tests of the receiver grid traversal against numeric integration of segments over its cells.
+'''
+
+import unittest
+
+import numpy as np
+
+from geometry.room import FREQUENCIES
+from simulation.receiver_grid import ReceiverGrid
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+SAMPLES_COUNT = 20000   # points sampled along each segment
+
+
+def sampled_lengths(grid, origins, directions, lengths):
+    '''
+    Function integrating lengths of segments inside each grid cell by sampling points evenly along them.
+    :param grid: ReceiverGrid() instance, only its geometry is used
+    :param origins: array of shape (n, 3) with segments beginnings
+    :param directions: array of shape (n, 3) with segments unit directions
+    :param lengths: array with segments lengths
+    :return: array of grid shape with summed lengths of all segments inside each cell
+    '''
+    cells_lengths = np.zeros(grid.shape)
+    for origin, direction, length in zip(origins, directions, lengths):
+        step = length / SAMPLES_COUNT
+        points = origin + direction * ((np.arange(SAMPLES_COUNT) + .5) * step)[:, None]   # middles of the steps
+        cells = np.floor((points - grid.lower) / grid.cell_sizes).astype(int)
+        inside = ((cells >= 0) & (cells < grid.shape)).all(axis=1)
+        np.add.at(cells_lengths, tuple(cells[inside].T), step)
+    return cells_lengths
+
+
+class ReceiverGridTest(unittest.TestCase):
+
+    def assert_integrated_lengths(self, grid, origins, directions, lengths):
+        directions = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+        grid.add_segments(origins, directions, lengths, np.ones((len(origins), len(FREQUENCIES))))
+        cells_lengths = grid.energies * np.prod(grid.cell_sizes)   # unit energies are divided by the cell volume
+        np.testing.assert_allclose(cells_lengths, np.repeat(cells_lengths[..., :1], len(FREQUENCIES), axis=-1))
+        expected = sampled_lengths(grid, origins, directions, lengths)
+        # each boundary crossing may move a single sampling step to the neighbouring cell
+        np.testing.assert_allclose(cells_lengths[..., 0], expected, atol=4 * lengths.max() / SAMPLES_COUNT)
+        return expected
+
+    def test_random_segments(self):
+        rng = np.random.RandomState(11)
+        grid = ReceiverGrid((1, 0, 1), (9, 3, 7), .7)   # cells are resized to fit the box exactly
+        origins = rng.uniform(-1, 10, (40, 3))
+        directions = rng.normal(size=(40, 3))
+        lengths = rng.uniform(0, 12, 40)
+        expected = self.assert_integrated_lengths(grid, origins, directions, lengths)
+        self.assertGreater((expected > 0).sum(), 50)
+
+    def test_axis_aligned_segments(self):
+        grid = ReceiverGrid((0, 0, 0), (4, 2, 3), .5)
+        origins = np.array([(-1, .3, .3), (3.9, 1.7, 2.2), (1.2, -.5, 1.1), (2.2, .7, 3.5), (.25, .25, .25)])
+        directions = np.array([(1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, 0, -1), (1, 1, 0)], dtype=np.float64)
+        lengths = np.array([6, 2.6, 1.8, 5, 1.5])
+        self.assert_integrated_lengths(grid, origins, directions, lengths)
+
+    def test_listener_plane(self):
+        rng = np.random.RandomState(13)
+        grid = ReceiverGrid((0, 1.2, 0), (6, 1.2, 4), .5)   # a plane one cell thick around the height of 1.2 m
+        self.assertEqual(grid.shape[1], 1)
+        origins = rng.uniform(0, 6, (40, 3))
+        directions = rng.normal(size=(40, 3))
+        lengths = rng.uniform(0, 5, 40)
+        self.assert_integrated_lengths(grid, origins, directions, lengths)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+'''
+Tests of recording ray events to disk and replaying them.
+'''
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from benchmarks.rooms import box_room
+from simulation.batch import BatchRunner
+from simulation.emitter import fibonacci_directions
+from simulation.engine import SimulationEngine
+from simulation.recording import DEFAULT_WINDOW, Recording, TrajectoryRecorder, write_metadata
+from tests import load_text_room
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+SOURCE_POS = (5, 1.5, 4)   # source position inside the box room, in simulation coordinates
+SCATTERING = 'abs wall <5 5 6 7 8 9> [10 20 30 40 50 60]'   # materials reflecting particles diffusely as well
+
+
+class RecordingTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.room = load_text_room(box_room())
+
+    def record(self, directory, rays_count, shards_count, **parameters):
+        '''
+        Method recording a run of the box room into a directory.
+        '''
+        runner = BatchRunner(self.room, processes=1, shards_count=shards_count)
+        runner.run(fibonacci_directions(rays_count), source_pos=SOURCE_POS, max_reflections=3, record_path=directory,
+                   **parameters)
+
+    def assert_same_replay(self, recording, expected):
+        for time in np.linspace(expected.start, expected.duration, 20):
+            particles, positions, energies = recording.positions_at(time)
+            expected_particles, expected_positions, expected_energies = expected.positions_at(time)
+            order, expected_order = np.argsort(particles), np.argsort(expected_particles)
+            np.testing.assert_array_equal(particles[order], expected_particles[expected_order])
+            np.testing.assert_array_equal(positions[order], expected_positions[expected_order])
+            np.testing.assert_array_equal(energies[order], expected_energies[expected_order])
+
+    def test_replay_equals_reflection_events(self):
+        room = load_text_room(box_room().replace('abs wall <5 5 6 7 8 9>', SCATTERING))
+        directions = fibonacci_directions(200)
+        recorded = SimulationEngine(room, source_pos=SOURCE_POS, directions=directions, seed=3)
+        expected = SimulationEngine(room, source_pos=SOURCE_POS, directions=directions, seed=3).run_events(8)
+        with tempfile.TemporaryDirectory() as directory:
+            write_metadata(directory, SOURCE_POS, recorded.source_spl, len(directions))
+            recorder = TrajectoryRecorder(recorded, directory, chunk_size=500)   # many chunks of each window
+            recorded.observers.append(recorder)
+            recorded.run_reflections(8)
+            recorder.close()
+            recording = Recording(directory)
+            self.assertAlmostEqual(recording.duration, expected.ends.max())
+            window_ends = np.arange(1, 10) * DEFAULT_WINDOW
+            for time in np.concatenate((np.linspace(0, recording.duration, 25), window_ends, expected.times[::97])):
+                particles, positions, energies = recording.positions_at(time)
+                expected_particles, expected_positions, expected_energies = expected.positions_at(time)
+                order, expected_order = np.argsort(particles), np.argsort(expected_particles)
+                np.testing.assert_array_equal(particles[order], expected_particles[expected_order])
+                np.testing.assert_allclose(positions[order], expected_positions[expected_order], atol=1e-4)
+                np.testing.assert_allclose(energies[order], expected_energies[expected_order], rtol=1e-6)
+
+    def test_recording_again_replaces_earlier_parts(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.record(directory, 60, 6)
+            self.record(directory, 30, 3)
+            recording = Recording(directory)
+            particles, _, _ = recording.positions_at(recording.start + .001)
+            self.assertEqual(len(recording.metadata['parts']), 3)
+            self.assertEqual(sorted(particles.tolist()), list(range(30)))
+
+    def test_resumed_recording_equals_uninterrupted_one(self):
+        original = SimulationEngine.run_reflections
+        passes = []
+
+        def interrupted(engine, max_reflections=None):
+            passes.append(max_reflections)
+            if len(passes) == 5:   # within the second shard
+                raise KeyboardInterrupt
+            return original(engine, max_reflections)
+
+        with tempfile.TemporaryDirectory() as directory, tempfile.TemporaryDirectory() as expected_directory:
+            self.record(expected_directory, 60, 2)
+            checkpoint_path = os.path.join(directory, 'run.npz')
+            with mock.patch.object(SimulationEngine, 'run_reflections', interrupted):
+                with self.assertRaises(KeyboardInterrupt):
+                    self.record(directory, 60, 2, checkpoint_path=checkpoint_path, checkpoint_interval=0)
+            self.record(directory, 60, 2, checkpoint_path=checkpoint_path)
+            self.assert_same_replay(Recording(directory), Recording(expected_directory))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+
+'''
+Tests of the compiled room cache.
+'''
+
+import os
+import tempfile
+import unittest
+
+from benchmarks.rooms import box_room
+from input.room_cache import COMPILED_FORMAT_VERSION, evict_compiled, load_room
+
+__author__ = 'Norbert Mieczkowski'
+__copyright__ = 'Copyright 2015, Norbert Mieczkowski'
+__version__ = '1.0.0'
+
+
+class RoomCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_rooms_are_removed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache_dir = os.path.join(directory, 'cache')
+            os.makedirs(os.path.join(cache_dir, 'results'))   # other cached files are never removed
+            old_version = os.path.join(cache_dir, '{}-1-v{}'.format('0' * 40, COMPILED_FORMAT_VERSION - 1))
+            os.makedirs(old_version)
+            paths = []
+            for subdivisions in (1, 2, 3):
+                paths.append(os.path.join(directory, 'room{}.txt'.format(subdivisions)))
+                with open(paths[-1], 'w') as room_file:
+                    room_file.write(box_room(subdivisions=subdivisions))
+            first = load_room(paths[0], cache_dir).compiled_path
+            second = load_room(paths[1], cache_dir).compiled_path
+            self.assertFalse(os.path.exists(old_version))
+            os.utime(second, (0, 0))   # the second room was used long ago
+            load_room(paths[0], cache_dir)   # loaded from the cache, still the same compiled room
+            third = load_room(paths[2], cache_dir).compiled_path
+            size = sum(entry.stat().st_size for path in (first, second, third) for entry in os.scandir(path))
+            evict_compiled(cache_dir, size - 1, third)   # just too large, the least recently used room is removed
+            self.assertEqual(sorted(os.listdir(cache_dir)),
+                             sorted(['results', os.path.basename(first), os.path.basename(third)]))
+            evict_compiled(cache_dir, 0, first)
+            self.assertEqual(sorted(os.listdir(cache_dir)), sorted(['results', os.path.basename(first)]))
+
+if __name__ == '__main__':
+    unittest.main()